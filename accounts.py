@@ -18,8 +18,10 @@
 import logging
 import os
 
+from google.appengine.api import datastore_errors
+from google.appengine.api import taskqueue
 from google.appengine.api import users
-from google.appengine.api import memcache
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
 import jinja2
@@ -36,6 +38,16 @@ JINJA_ENVIRONMENT = jinja2.Environment(
     extensions=['jinja2.ext.autoescape'],
     autoescape=True)
 
+# Models which can be rewritten by ReindexHandler, by kind.
+REINDEX_MODELS = {
+  'ManagedLists': crawl_lists.ManagedLists,
+  'Tweet': tweets.Tweet,
+  'User': tweets.User,
+}
+
+# Number of entities rewritten by each reindex task.
+REINDEX_BATCH_SIZE = 200
+
 
 class AccountsHandler(webapp2.RequestHandler):
   def get(self):
@@ -116,18 +128,10 @@ class DeleteAllTweetsHandler(webapp2.RequestHandler):
     tweet_query = tweets.Tweet.query()
     for tweet in tweet_query:
       tweet.key.delete()
+    ndb.delete_multi(tweets.RawTweet.query().fetch(keys_only=True))
 
-    # TODO: consolidate the logic.  Perhaps just add a task to delete the
-    # memcache entries and test it in that handler.  Avoiding cross-handler
-    # dependencies would be good for testing purposes.
-    admin_list_result = crawl_lists.ManagedLists.query(
-        ancestor=crawl_lists.lists_key()).fetch(1)
-
-    # For every list, enqueue a task to crawl that list.
-    if admin_list_result:
-      for l in admin_list_result[0].list_ids:
-        memcache.delete(key=crawl_lists.LISTS_LATEST_KEY_PREFIX + l,
-            namespace=crawl_lists.LISTS_LATEST_NAMESPACE)
+    # Start crawling every list from scratch.
+    crawl_lists.DeleteAllCrawlCursors()
     self.redirect('/accounts')
 
 
@@ -141,6 +145,7 @@ class RecrawlTweetsHandler(webapp2.RequestHandler):
     tweet_query = tweets.Tweet.query()
     for tweet in tweet_query:
       tweet.key.delete()
+    ndb.delete_multi(tweets.RawTweet.query().fetch(keys_only=True))
 
     token_manager = oauth_token_manager.OauthTokenManager()
     fetcher = twitter_fetcher.TwitterFetcher(token_manager)
@@ -161,6 +166,51 @@ class RecrawlTweetsHandler(webapp2.RequestHandler):
     self.redirect('/accounts')
 
 
+class ReindexHandler(webapp2.RequestHandler):
+  """Rewrites all entities of a kind with the current index profile.
+
+  The indexes of an entity are only updated when it is put, so this has to be
+  run for each kind after properties are indexed or unindexed in tweets.py.
+  It also rewrites list ids stored as strings as integers, see
+  tweets.ListIdProperty.
+  Each task rewrites one batch and enqueues a task for the next one with the
+  query cursor, so the migration resumes where it left off if a task fails
+  and is retried.
+  """
+  def post(self):
+    kind = self.request.get('kind')
+    model_class = REINDEX_MODELS.get(kind)
+    if not model_class:
+      msg = 'Unknown kind to reindex: %s' % kind
+      logging.warning(msg)
+      self.response.write(msg)
+      return
+
+    start_cursor = None
+    if self.request.get('cursor'):
+      try:
+        start_cursor = Cursor(urlsafe=self.request.get('cursor'))
+      except datastore_errors.BadValueError as e:
+        msg = 'Could not parse cursor %s: %s' % (self.request.get('cursor'), e)
+        logging.warning(msg)
+        self.response.write(msg)
+        return
+
+    entities, next_cursor, more = model_class.query().fetch_page(
+        REINDEX_BATCH_SIZE, start_cursor=start_cursor)
+    ndb.put_multi(entities)
+
+    if more and next_cursor:
+      taskqueue.add(url='/accounts/reindex', method='POST',
+          params={'kind': kind, 'cursor': next_cursor.urlsafe()})
+      msg = 'Rewrote %d %s entities, enqueued the next batch' % (
+          len(entities), kind)
+    else:
+      msg = 'Rewrote %d %s entities, reindex done' % (len(entities), kind)
+    logging.info(msg)
+    self.response.write(msg)
+
+
 app = webapp2.WSGIApplication([
   ('/accounts', AccountsHandler),
   ('/accounts/', AccountsHandler),
@@ -169,4 +219,5 @@ app = webapp2.WSGIApplication([
   ('/accounts/delete_all_accounts', DeleteAllAccountsHandler),
   ('/accounts/delete_all_tweets', DeleteAllTweetsHandler),
   ('/accounts/recrawl', RecrawlTweetsHandler),
+  ('/accounts/reindex', ReindexHandler),
 ], debug=True)
@@ -20,7 +20,11 @@ import webtest
 
 import test_env_setup
 
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
 import accounts
+import mock
 import tweets
 import web_test_base
 
@@ -157,6 +161,35 @@ class AccountsTest(web_test_base.WebTestBase):
     self.assertTrue(response.body.find('bob') != -1)
     self.assertTrue(response.body.find('steve') != -1)
 
+  @mock.patch.object(taskqueue, 'add')
+  def testReindex(self, mock_add_queue_method):
+    ndb.put_multi([self.CreateTweet(i, ('bob', 2)) for i in range(1, 4)])
+    date_modified = tweets.Tweet.query().fetch(1)[0].date_modified
+
+    with mock.patch.object(accounts, 'REINDEX_BATCH_SIZE', 2):
+      response = self.testapp.post('/accounts/reindex', {'kind': 'Tweet'})
+      self.assertEqual(200, response.status_int)
+      self.assertEqual(1, len(mock_add_queue_method.mock_calls))
+      params = mock_add_queue_method.call_args[1]['params']
+      self.assertEqual('Tweet', params['kind'])
+
+      # The next task picks up from the cursor and finishes the kind.
+      self.testapp.post('/accounts/reindex', params)
+      self.assertEqual(1, len(mock_add_queue_method.mock_calls))
+
+    self.assertTweetDbContents(['1', '2', '3'])
+    for twt in tweets.Tweet.query().fetch():
+      self.assertTrue(twt.date_modified >= date_modified)
+
+  @mock.patch.object(taskqueue, 'add')
+  def testReindex_badParams(self, mock_add_queue_method):
+    response = self.testapp.post('/accounts/reindex', {'kind': 'Game'})
+    self.assertTrue(response.body.find('Unknown kind') != -1)
+    response = self.testapp.post('/accounts/reindex',
+        {'kind': 'User', 'cursor': 'not a cursor'})
+    self.assertTrue(response.body.find('Could not parse cursor') != -1)
+    self.assertFalse(mock_add_queue_method.mock_calls)
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Martin Cochran
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Utilities shared by the offline benchmarks (the *_benchmark.py scripts).
+
+The benchmarks run against the same testbed stubs as the unit tests, so they
+need the App Engine SDK in the location expected by test_env_setup. Run them
+from the root of the repository, eg:
+
+  python crawl_lists_benchmark.py
+"""
+
+import glob
+import json
+import os
+import time
+
+import test_env_setup
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+LIST_STATUSES_DIR = 'testdata/list_statuses'
+
+
+def LoadListStatuses():
+  """Loads the sample ListStatuses responses.
+
+  Returns:
+    A list of (list_id, json_obj) pairs, one for each file in
+    testdata/list_statuses, sorted by list id.
+  """
+  pages = []
+  for filename in sorted(glob.glob(os.path.join(LIST_STATUSES_DIR, '*.json'))):
+    list_id = os.path.basename(filename)[:-len('.json')]
+    with open(filename, 'r') as f:
+      pages.append((list_id, json.loads(f.read())))
+  return pages
+
+
+def ActivateTestbed():
+  """Activates and returns a testbed with the stubs used by the crawlers."""
+  bed = testbed.Testbed()
+  bed.activate()
+  bed.init_memcache_stub()
+  bed.init_datastore_v3_stub()
+  bed.init_taskqueue_stub()
+  bed.init_urlfetch_stub()
+  return bed
+
+
+def ClearNdbCache():
+  """Clears the ndb in-context cache so lookups are not served from it."""
+  ndb.get_context().clear_cache()
+
+
+class RpcCounter(object):
+  """Counts the API calls made by service and method.
+
+  The counter hooks into the apiproxy of the active testbed, so it must be
+  created after the testbed is activated.
+  """
+
+  def __init__(self):
+    self.counts = {}
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'benchmark_rpc_counter', self._CountCall)
+
+  def _CountCall(self, service, call, request, response):
+    name = '%s.%s' % (service, call)
+    self.counts[name] = self.counts.get(name, 0) + 1
+
+  def Reset(self):
+    self.counts = {}
+
+  def Total(self, service=None):
+    """Returns the number of calls made to the service, or to all services."""
+    return sum([v for (k, v) in self.counts.items()
+        if not service or k.startswith('%s.' % service)])
+
+
+class Timer(object):
+  """Context manager which records the elapsed wall time in milliseconds."""
+
+  def __enter__(self):
+    self.start = time.time()
+    self.elapsed_ms = 0.0
+    return self
+
+  def __exit__(self, *args):
+    self.elapsed_ms = (time.time() - self.start) * 1000.0
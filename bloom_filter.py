@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Martin Cochran
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""A compact probabilistic set of strings.
+
+A Bloom filter never reports that an added string is missing, but it can
+report that a string which was never added is present, with a probability
+that depends on how full it is. The bits are a plain string so that filters
+can be kept in memcache.
+
+More info: https://en.wikipedia.org/wiki/Bloom_filter
+"""
+
+import hashlib
+import math
+import struct
+
+
+class BloomFilter(object):
+  """Bloom filter over strings, with double hashing of an md5 digest."""
+
+  def __init__(self, num_bits, num_hashes, bits=None):
+    """Initializes the filter.
+
+    Args:
+      num_bits: Size of the filter in bits.
+      num_hashes: Number of bits set for each string.
+      bits: (optional) String from Serialize() of a filter with the same
+        num_bits and num_hashes. The filter is empty if not given.
+    """
+    self.num_bits = num_bits
+    self.num_hashes = num_hashes
+    if bits:
+      self.bits = bytearray(bits)
+    else:
+      self.bits = bytearray((num_bits + 7) // 8)
+
+  @classmethod
+  def ForCapacity(cls, capacity, error_rate):
+    """Returns an empty filter sized for the capacity and error rate.
+
+    Args:
+      capacity: Number of strings which will be added.
+      error_rate: Rate of false positives once capacity strings are added.
+    """
+    num_bits = int(math.ceil(
+        -capacity * math.log(error_rate) / (math.log(2) ** 2)))
+    num_hashes = max(1, int(round(float(num_bits) / capacity * math.log(2))))
+    return cls(num_bits, num_hashes)
+
+  def _Positions(self, item):
+    if isinstance(item, unicode):
+      item = item.encode('utf-8')
+    h1, h2 = struct.unpack('<QQ', hashlib.md5(item).digest())
+    return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+  def Add(self, item):
+    """Adds a string to the filter."""
+    for pos in self._Positions(item):
+      self.bits[pos >> 3] |= 1 << (pos & 7)
+
+  def MightContain(self, item):
+    """Returns False if the string was never added, True if it may have been."""
+    for pos in self._Positions(item):
+      if not self.bits[pos >> 3] & (1 << (pos & 7)):
+        return False
+    return True
+
+  def __contains__(self, item):
+    return self.MightContain(item)
+
+  def Serialize(self):
+    """Returns the bits of the filter as a string."""
+    return str(self.bits)
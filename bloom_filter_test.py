@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Martin Cochran
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+import bloom_filter
+
+
+class BloomFilterTest(unittest.TestCase):
+
+  def testAddAndContains(self):
+    bloom = bloom_filter.BloomFilter.ForCapacity(100, 0.01)
+    self.assertFalse(bloom.MightContain('542785926674399232'))
+    bloom.Add('542785926674399232')
+    bloom.Add(u'caf\xe9')
+    self.assertTrue(bloom.MightContain('542785926674399232'))
+    self.assertTrue(u'caf\xe9' in bloom)
+    self.assertFalse('542785926674399233' in bloom)
+
+  def testErrorRate(self):
+    bloom = bloom_filter.BloomFilter.ForCapacity(1000, 0.01)
+    for i in range(1000):
+      bloom.Add(str(i))
+    for i in range(1000):
+      self.assertTrue(str(i) in bloom)
+    false_positives = len([i for i in range(1000, 11000) if str(i) in bloom])
+    self.assertTrue(false_positives < 200, false_positives)
+
+  def testSerialize(self):
+    bloom = bloom_filter.BloomFilter.ForCapacity(100, 0.01)
+    bloom.Add('a')
+    copy = bloom_filter.BloomFilter(bloom.num_bits, bloom.num_hashes,
+        bloom.Serialize())
+    self.assertTrue('a' in copy)
+    copy.Add('b')
+    self.assertFalse('b' in bloom)
+    self.assertEqual(len(bloom.Serialize()), len(copy.Serialize()))
+
+
+if __name__ == '__main__':
+  unittest.main()
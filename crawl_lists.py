@@ -15,19 +15,22 @@
 # limitations under the License.
 #
 
+import bisect
 from datetime import datetime, timedelta
 import logging
 import math
 import os
+import sys
+import time
 
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 
+from game_model import ActiveTournamentIndex
 from game_model import Game
 from game_model import GameSource
 from game_model import Team
-from game_model import Tournament
 from scores_messages import AgeBracket
 from scores_messages import Division
 from scores_messages import GameSourceType
@@ -35,6 +38,8 @@ from scores_messages import League
 
 import webapp2
 
+import bloom_filter
+import crawl_planner
 import games
 import list_id_bimap
 import oauth_token_manager
@@ -43,8 +48,26 @@ import tweets
 import twitter_fetcher
 
 
-LISTS_LATEST_KEY_PREFIX = 'list_latest_status_'
+LISTS_LATEST_KEY_PREFIX = 'list_crawl_cursor_'
 LISTS_LATEST_NAMESPACE = 'lists_crawling'
+SEEN_TWEETS_KEY = 'seen_tweets'
+
+# Size of each generation of the set of tweet ids stored by crawls, and the
+# rate of false positives once a generation is full.
+SEEN_TWEETS_PER_GENERATION = 2000
+SEEN_TWEETS_ERROR_RATE = 0.01
+
+# Number of generations of seen tweet ids which are kept.
+SEEN_TWEETS_GENERATIONS = 2
+
+# When the seen tweet ids are rebuilt, tweets created up to this long after
+# the rebuild may still be looked up. This allows for clock skew and for
+# crawls which store tweets while the set is rebuilt.
+SEEN_TWEETS_REBUILD_MARGIN = timedelta(minutes=5)
+
+# Number of times to retry adding to the seen tweet ids if another crawl
+# updated them concurrently.
+SEEN_TWEETS_CAS_RETRIES = 5
 
 ADMIN_USER = 'martin_cochran'
 
@@ -63,6 +86,24 @@ MAX_REQUESTS = 10L
 # Num posts to retrieve on each crawl attempt.
 POSTS_TO_RETRIEVE = 200L
 
+# Time after which a crawl of a list stops fetching pages in the request and
+# enqueues a task to crawl the rest.
+CRAWL_TIME_BUDGET_SECS = 60
+
+# How the lists due to be crawled are crawled. With CRAWL_LISTS_IN_TASKS each
+# list is crawled by its own task on the list-statuses queue. With
+# CRAWL_LISTS_CONCURRENTLY they are all crawled by one task, which fetches the
+# first page of every list at once.
+CRAWL_LISTS_IN_TASKS = 'tasks'
+CRAWL_LISTS_CONCURRENTLY = 'concurrent'
+LIST_CRAWL_MODE = CRAWL_LISTS_IN_TASKS
+
+# If True, the statuses of each page are decoded and ingested in batches of
+# STREAM_BATCH_SIZE as the page is read, instead of decoding the whole page
+# before ingesting it.
+STREAM_LIST_STATUSES = False
+STREAM_BATCH_SIZE = 50
+
 # Value to indicate that there are no tweets in the stream
 FIRST_TWEET_IN_STREAM_ID = 2L
 
@@ -85,7 +126,219 @@ def lists_key(lists_table_name=DEFAULT_LISTS_DB_NAME, user=ADMIN_USER):
 
 class ManagedLists(ndb.Model):
   """A set of list ids that are owned by a given user."""
-  list_ids = ndb.StringProperty('l', repeated=True, indexed=False)
+  list_ids = tweets.ListIdProperty('l', repeated=True, indexed=False)
+
+
+def crawl_cursor_key(list_id):
+  """Constructs a Datastore key for the crawl cursor of a list."""
+  return ndb.Key('CrawlCursor', list_id)
+
+
+class CrawlCursor(ndb.Model):
+  """The range of tweet ids that have been crawled from a list.
+
+  There is one entity for each list, keyed by list id, which is fronted by
+  memcache so that crawling a list never needs to query the Tweet table to
+  find where the last crawl left off.
+  """
+  # Id of the most recent tweet crawled from the list.
+  newest_id = ndb.IntegerProperty('n', indexed=False)
+
+  # Id of the oldest tweet crawled from the list.
+  oldest_id = ndb.IntegerProperty('o', indexed=False)
+
+  last_modified_at = ndb.DateTimeProperty('lm', auto_now=True, indexed=False)
+
+  @classmethod
+  def Lookup(cls, list_id):
+    """Returns the crawl cursor for the list, or None if it was never crawled.
+
+    Args:
+      list_id: ID of the list.
+    """
+    cached = memcache.get(key=LISTS_LATEST_KEY_PREFIX + list_id,
+        namespace=LISTS_LATEST_NAMESPACE)
+    if cached is not None:
+      return cls(key=crawl_cursor_key(list_id), newest_id=cached[0],
+          oldest_id=cached[1])
+
+    cursor = crawl_cursor_key(list_id).get()
+    if cursor:
+      cursor._UpdateMemcache(list_id)
+    return cursor
+
+  @classmethod
+  def Advance(cls, list_id, newest_id, oldest_id):
+    """Widens the range of crawled ids for the list to include the given ids.
+
+    Args:
+      list_id: ID of the list.
+      newest_id: (long) id of the most recent tweet that was just crawled.
+      oldest_id: (long) id of the oldest tweet that was just crawled.
+    Returns:
+      The updated CrawlCursor.
+    """
+    cursor = cls._AdvanceInTransaction(list_id, newest_id, oldest_id)
+    cursor._UpdateMemcache(list_id)
+    return cursor
+
+  @classmethod
+  @ndb.transactional
+  def _AdvanceInTransaction(cls, list_id, newest_id, oldest_id):
+    cursor = crawl_cursor_key(list_id).get()
+    if not cursor:
+      cursor = cls(key=crawl_cursor_key(list_id), newest_id=newest_id,
+          oldest_id=oldest_id)
+    elif newest_id <= cursor.newest_id and oldest_id >= cursor.oldest_id:
+      return cursor
+    else:
+      if newest_id < cursor.newest_id:
+        logging.warning('Tweet %s crawled from list %s older than latest %s',
+            newest_id, list_id, cursor.newest_id)
+      cursor.newest_id = max(newest_id, cursor.newest_id)
+      cursor.oldest_id = min(oldest_id, cursor.oldest_id)
+    cursor.put()
+    return cursor
+
+  def _UpdateMemcache(self, list_id):
+    # Concurrent crawls of the same list may race here and leave an older
+    # range in memcache. That only causes some tweets to be crawled again.
+    memcache.set(key=LISTS_LATEST_KEY_PREFIX + list_id,
+        value=(self.newest_id, self.oldest_id),
+        namespace=LISTS_LATEST_NAMESPACE)
+
+
+def DeleteAllCrawlCursors():
+  """Deletes the crawl cursors of all lists so they are crawled from scratch."""
+  keys = CrawlCursor.query().fetch(keys_only=True)
+  memcache.delete_multi([LISTS_LATEST_KEY_PREFIX + k.id() for k in keys],
+      namespace=LISTS_LATEST_NAMESPACE)
+  memcache.delete(SEEN_TWEETS_KEY, namespace=LISTS_LATEST_NAMESPACE)
+  ndb.delete_multi(keys)
+
+
+class SeenTweetIds(object):
+  """Probabilistic set of the ids of the tweets recently stored by crawls.
+
+  Crawls overlap with what was already crawled, so many tweets in a page are
+  already in the datastore. This lets UpdateTweetDbWithNewTweets insert the
+  tweets which are certainly new without looking them up first, and only look
+  up the ones which may have been seen.
+
+  The set is shared by all lists, since the same tweet may be crawled from
+  several lists and the first list it was stored from must be kept.
+
+  The ids are kept in up to SEEN_TWEETS_GENERATIONS Bloom filters of
+  SEEN_TWEETS_PER_GENERATION ids each. Once the newest generation is full a
+  new one is started and the oldest is dropped. Ids at or below floor_id may
+  be in the datastore without being in the set, so they are never reported
+  as new. The floor is raised to the newest id of each dropped generation.
+
+  The set lives in memcache. On a miss it is rebuilt empty, with its floor at
+  the id of a tweet created SEEN_TWEETS_REBUILD_MARGIN from now. Every tweet
+  stored before was created before that, so it is looked up. This doesn't
+  rely on a query, which could miss tweets that were just written.
+  Tweets stored other than by crawling lists, eg by /accounts, are not added
+  to the set and so must not be newer than the tweets crawled after them.
+  """
+
+  def __init__(self, floor_id=0, generations=None):
+    """Initializes the set.
+
+    Args:
+      floor_id: (long) ids at or below this may have been seen.
+      generations: list of [BloomFilter, number of ids, max id] lists, oldest
+        first.
+    """
+    self.floor_id = floor_id
+    self.generations = generations or []
+
+  @classmethod
+  def Lookup(cls):
+    """Returns the SeenTweetIds, rebuilding them on a miss."""
+    seen_ids = cls._FromMemcacheValue(memcache.get(
+        key=SEEN_TWEETS_KEY, namespace=LISTS_LATEST_NAMESPACE))
+    if seen_ids:
+      return seen_ids
+    seen_ids = cls.Rebuild()
+    memcache.add(key=SEEN_TWEETS_KEY, value=seen_ids._ToMemcacheValue(),
+        namespace=LISTS_LATEST_NAMESPACE)
+    return seen_ids
+
+  @classmethod
+  def Rebuild(cls, now=None):
+    """Builds an empty set whose floor is above every stored tweet.
+
+    Args:
+      now: (optional) datetime of the rebuild. Defaults to utcnow.
+    """
+    floor_id = tweets.TweetIdAt(
+        (now or datetime.utcnow()) + SEEN_TWEETS_REBUILD_MARGIN)
+    logging.info('Rebuilt seen tweets with floor %s', floor_id)
+    return cls(floor_id=floor_id)
+
+  @classmethod
+  def AddToMemcache(cls, id_strs):
+    """Adds tweet ids to the set which is kept in memcache.
+
+    Args:
+      id_strs: Ids of tweets which were just stored.
+    """
+    client = memcache.Client()
+    for _ in range(SEEN_TWEETS_CAS_RETRIES):
+      seen_ids = cls._FromMemcacheValue(
+          client.gets(SEEN_TWEETS_KEY, namespace=LISTS_LATEST_NAMESPACE))
+      if not seen_ids:
+        # Dropped from memcache, so the next Lookup rebuilds it with a floor
+        # above the tweets which were just stored.
+        return
+      seen_ids.Add(id_strs)
+      if client.cas(SEEN_TWEETS_KEY, seen_ids._ToMemcacheValue(),
+          namespace=LISTS_LATEST_NAMESPACE):
+        return
+    logging.warning('Could not update the seen tweets')
+    client.delete(SEEN_TWEETS_KEY, namespace=LISTS_LATEST_NAMESPACE)
+
+  def IsNew(self, id_str):
+    """Returns True if the tweet is certainly not in the set."""
+    if long(id_str) <= self.floor_id:
+      return False
+    for bloom, _, _ in self.generations:
+      if bloom.MightContain(id_str):
+        return False
+    return True
+
+  def Add(self, id_strs):
+    """Adds tweet ids to the set, starting a new generation when full."""
+    for id_str in id_strs:
+      if not self.generations or (
+          self.generations[-1][1] >= SEEN_TWEETS_PER_GENERATION):
+        self._AddGeneration()
+      generation = self.generations[-1]
+      generation[0].Add(id_str)
+      generation[1] += 1
+      generation[2] = max(generation[2], long(id_str))
+
+  def _AddGeneration(self):
+    if len(self.generations) >= SEEN_TWEETS_GENERATIONS:
+      dropped = self.generations.pop(0)
+      self.floor_id = max(self.floor_id, dropped[2])
+    self.generations.append([bloom_filter.BloomFilter.ForCapacity(
+      SEEN_TWEETS_PER_GENERATION, SEEN_TWEETS_ERROR_RATE), 0, 0L])
+
+  def _ToMemcacheValue(self):
+    return (self.floor_id, [(bloom.num_bits, bloom.num_hashes,
+      bloom.Serialize(), count, max_id)
+      for bloom, count, max_id in self.generations])
+
+  @classmethod
+  def _FromMemcacheValue(cls, value):
+    if value is None:
+      return None
+    floor_id, generations = value
+    return cls(floor_id=floor_id, generations=[
+      [bloom_filter.BloomFilter(num_bits, num_hashes, bits), count, max_id]
+      for num_bits, num_hashes, bits, count, max_id in generations])
 
 
 class UpdateListsHandler(webapp2.RequestHandler):
@@ -115,6 +368,17 @@ class UpdateListsRateLimitedHandler(webapp2.RequestHandler):
     try:
       json_obj = fetcher.LookupLists(
           ADMIN_USER, fake_data=self.request.get('fake_data'))
+    except twitter_fetcher.RateLimitError as e:
+      # Try again once the rate limit window resets.
+      msg = 'Rate limited retrieving lists for %s' % ADMIN_USER
+      logging.info('%s: %s', msg, e)
+      url = '/tasks/update_lists_rate_limited'
+      if self.request.get('fake_data'):
+        url = '%s?fake_data=true' % url
+      taskqueue.add(url=url, method='GET', queue_name='list-lists',
+          countdown=e.retry_after_secs)
+      self.response.write(msg)
+      return
     except twitter_fetcher.FetchError as e:
       msg = 'Could not retrieve lists for %s' % ADMIN_USER
       logging.warning('%s: %s', msg, e)
@@ -122,7 +386,7 @@ class UpdateListsRateLimitedHandler(webapp2.RequestHandler):
       return
 
     list_objs = json_obj.get('lists', [])
-    lists = [k.get('id_str', '') for k in list_objs]
+    lists = [k['id_str'] for k in list_objs if k.get('id_str')]
 
     new_lists = set(lists)
     existing_list_results = ManagedLists.query(ancestor=lists_key()).fetch(1)
@@ -220,6 +484,27 @@ class CrawlState():
       return default_value
 
 
+def EnqueueListCrawls(list_ids, fake_data=''):
+  """Enqueues the tasks to crawl the lists, according to LIST_CRAWL_MODE.
+
+  Args:
+    list_ids: IDs of the lists to crawl.
+    fake_data: Value of the fake_data parameter of the crawl requests.
+  """
+  if LIST_CRAWL_MODE == CRAWL_LISTS_CONCURRENTLY:
+    if list_ids:
+      taskqueue.add(url='/tasks/crawl_lists', method='GET',
+          params={'list_ids': ','.join(list_ids), 'fake_data': fake_data},
+          queue_name='list-statuses')
+    return
+
+  # For every list, enqueue a task to crawl that list.
+  for l in list_ids:
+    taskqueue.add(url='/tasks/crawl_list', method='GET',
+        params={'list_id': l, 'fake_data': fake_data},
+        queue_name='list-statuses')
+
+
 class CrawlAllListsHandler(webapp2.RequestHandler):
   def get(self):
     admin_list_result = ManagedLists.query(ancestor=lists_key()).fetch(1)
@@ -229,17 +514,37 @@ class CrawlAllListsHandler(webapp2.RequestHandler):
       self.response.write(msg)
       return
 
-    # For every list, enqueue a task to crawl that list.
-    for l in admin_list_result[0].list_ids:
-      taskqueue.add(url='/tasks/crawl_list', method='GET',
-          params={'list_id': l, 'fake_data': self.request.get('fake_data')},
-          queue_name='list-statuses')
+    EnqueueListCrawls(admin_list_result[0].list_ids,
+        fake_data=self.request.get('fake_data'))
 
     msg = 'Enqueued crawl requests for lists %s' % admin_list_result[0].list_ids
     logging.debug(msg)
     self.response.write(msg)
 
 
+class CrawlDueListsHandler(webapp2.RequestHandler):
+  """Crawls the lists which are due according to the crawl planner.
+
+  This is run frequently by cron. Each list is crawled at its own interval,
+  which depends on how active the list is and whether a tournament in its
+  division is in progress.
+  """
+  def get(self):
+    admin_list_result = ManagedLists.query(ancestor=lists_key()).fetch(1)
+    if not admin_list_result:
+      msg = 'No lists to crawl'
+      logging.warning(msg)
+      self.response.write(msg)
+      return
+
+    due_lists = crawl_planner.ScheduleDueLists(admin_list_result[0].list_ids)
+    EnqueueListCrawls(due_lists, fake_data=self.request.get('fake_data'))
+
+    msg = 'Enqueued crawl requests for lists %s' % due_lists
+    logging.debug(msg)
+    self.response.write(msg)
+
+
 class BackfillGamesHandler(webapp2.RequestHandler):
   """Handler to update prior games / do data cleanup."""
   def get(self):
@@ -395,32 +700,71 @@ class CrawlAllUsersHandler(webapp2.RequestHandler):
     self.response.write(msg)
 
 
-def UpdateUser(json_user, user_map):
-  """Add or update the json user to the datastore.
+def UpdateUsers(json_users, user_map):
+  """Add or update a batch of json users in the datastore.
+
+  Users are deduplicated by id so an account that shows up many times in a
+  crawl is only handled once. All the existing users are fetched with one
+  get_multi, and only the new users and those whose profile image URL or
+  screen name changed are written, with one put_multi.
+
+  Args:
+    json_users: list of Twitter user json objs. If a user appears more than
+      once the first occurrence wins, which for a timeline is the most recent.
+    user_map: Map from string user id to user object. Every user in
+      json_users is added to it if not already present.
+  """
+  json_user_map = {}
+  user_ids = []
+  for json_user in json_users:
+    user_id = json_user.get('id_str', '')
+    if not user_id or user_id in json_user_map:
+      continue
+    json_user_map[user_id] = json_user
+    user_ids.append(user_id)
+
+  keys = [tweets.user_entity_key(user_id) for user_id in user_ids]
+  changed_users = []
+  for user_id, model_user in zip(user_ids, ndb.get_multi(keys)):
+    json_user = json_user_map[user_id]
+    if not model_user:
+      model_user = tweets.User.FromJson(json_user)
+      if not model_user:
+        continue
+      changed_users.append(model_user)
+    elif _UpdateUserFromJson(model_user, json_user):
+      changed_users.append(model_user)
+    if not user_map.get(model_user.id_str, None):
+      user_map[model_user.id_str] = model_user
+
+  if changed_users:
+    ndb.put_multi(changed_users)
+
+
+def _UpdateUserFromJson(model_user, json_user):
+  """Update the fields of a stored user that may change between crawls.
 
   Args:
-    json_user: Twitter user json obj.
-    user_map: Map from integer user id to user object.
+    model_user: tweets.User object from the datastore.
+    json_user: Twitter user json obj for the same user.
+  Returns:
+    True if model_user was changed and needs to be written.
   """
-  model_user = tweets.User.GetOrInsertFromJson(json_user)
   json_user_url = json_user.get('profile_image_url_https', '')
   # Update the user profile URL if it has changed.
   changed = False
-  if model_user and model_user.profile_image_url_https != json_user_url:
+  if model_user.profile_image_url_https != json_user_url:
     model_user.profile_image_url_https = json_user_url
     changed = True
 
   # If the user screen name is not already lower case, update it.
   screen_name = json_user.get('screen_name', '').lower()
-  if model_user and model_user.screen_name != screen_name:
+  if model_user.screen_name != screen_name:
     logging.info('screen name updating from %s to %s',
         model_user.screen_name, screen_name)
     model_user.screen_name = screen_name
     changed = True
-  if changed:
-    model_user.put()
-  if model_user and not user_map.get(model_user.id_str, None):
-    user_map[model_user.id_str] = model_user
+  return changed
 
 
 class CrawlUserHandler(webapp2.RequestHandler):
@@ -441,14 +785,434 @@ class CrawlUserHandler(webapp2.RequestHandler):
 
     try:
       json_obj = fetcher.LookupUsers(user_id_param)
+    except twitter_fetcher.RateLimitError as e:
+      # Look up the same users once the rate limit window resets.
+      msg = 'Rate limited looking up users %s' % user_id_param
+      logging.info('%s: %s', msg, e)
+      taskqueue.add(url='/tasks/crawl_users', method='POST',
+          params={'user_id': user_id_param}, queue_name='lookup-users',
+          countdown=e.retry_after_secs)
+      self.response.write(msg)
+      return
     except twitter_fetcher.FetchError as e:
       msg = 'Could not lookup users %s' % user_id_param
       logging.warning('%s: %s', msg, e)
       self.response.write(msg)
       return
 
-    for json_user in json_obj:
-      UpdateUser(json_user, {})
+    UpdateUsers(json_obj, {})
+
+
+class TeamResolver(object):
+  """Resolves Twitter account ids to the teams they represent.
+
+  One resolver is created for each crawl. Prefetch looks up all the authors
+  and user mentions in a batch of tweets with one keyed get_multi, and every
+  answer is memoized, including for ids with no known user, so matching
+  tweets to games never needs a datastore query per tweet.
+  """
+
+  def __init__(self, user_map=None):
+    """Initializes the resolver.
+
+    Args:
+      user_map: map from string user ids to users who have authored a tweet
+        during this crawl cycle and thus may not be propagated in the db yet.
+    """
+    self._user_map = user_map or {}
+
+    # Map from string user id to the User object for that id, or None if no
+    # such user is known.
+    self._resolved = {}
+
+  def Prefetch(self, twts):
+    """Looks up the authors and user mentions of all the given tweets.
+
+    Args:
+      twts: list of tweets.ParsedTweet objects.
+    """
+    user_ids = []
+    for twt in twts:
+      if not twt:
+        continue
+      user_ids.append(twt.author_id)
+      user_ids.extend(twt.user_mention_ids)
+    self._LookupUsers(user_ids)
+
+  def Resolve(self, user_id):
+    """Try to build a game_model.Team object from a string user_id.
+
+    Args:
+      user_id: (string) twitter ID of the user account.
+    Returns:
+      A tuple with game_model.Team object, division, league, and age bracket.
+      If the user ID is not found in the user_map or the db then a team with
+      score_reporter_id equal to UNKNOWN_SR_ID is returned for this first
+      element and the other values should be ignored.
+    """
+    if user_id not in self._resolved:
+      self._LookupUsers([user_id])
+    user = self._resolved[user_id]
+    if not user:
+      team = Team(score_reporter_id=UNKNOWN_SR_ID)
+      return team, Division.OPEN, League.USAU, AgeBracket.NO_RESTRICTION
+    div, ab, league = list_id_bimap.ListIdBiMap.GetStructuredPropertiesForList(
+        user.from_list)
+    return Team.FromTwitterUser(user), div, league, ab
+
+  def _LookupUsers(self, user_ids):
+    """Looks up and memoizes all ids not already known with one get_multi."""
+    missing_ids = []
+    for user_id in user_ids:
+      if user_id in self._resolved or user_id in missing_ids:
+        continue
+      if self._user_map.get(user_id):
+        self._resolved[user_id] = self._user_map.get(user_id)
+      elif not user_id:
+        self._resolved[user_id] = None
+      else:
+        missing_ids.append(user_id)
+
+    if not missing_ids:
+      return
+    keys = [tweets.user_entity_key(user_id) for user_id in missing_ids]
+    for user_id, user in zip(missing_ids, ndb.get_multi(keys)):
+      self._resolved[user_id] = user
+
+
+class GameIndex(object):
+  """In-memory index of the games that tweets may be matched against.
+
+  Games are indexed by the twitter ids of their teams, and for each team they
+  are kept sorted by compare time (see GameIndex.CompareTime) so the games a
+  tweet could belong to are found with a dict lookup and a bisect instead of a
+  scan over every game. One index is built for each call to UpdateGames.
+  """
+
+  def __init__(self, games=None):
+    """Initializes the index.
+
+    Args:
+      games: list of game_model.Game objects to index.
+    """
+    # Map from twitter id to a list of (compare_time, sequence number) tuples
+    # sorted by compare_time.
+    self._entries_by_team = {}
+
+    # Indexed games, in the order they were added. The position of a game in
+    # this list is its sequence number.
+    self._games = []
+
+    # Map from id() of each indexed game to its sequence number.
+    self._sequence_numbers = {}
+
+    # Map from sequence number to the set of twitter ids the game is indexed
+    # with.
+    self._indexed_team_ids = {}
+
+    for game in games or []:
+      self.AddGame(game)
+
+  @property
+  def games(self):
+    """The indexed games, in the order they were added."""
+    return list(self._games)
+
+  @staticmethod
+  def CompareTime(game):
+    """Returns the time tweets are compared to when matched with the game."""
+    if game.start_time and game.start_time > game.last_modified_at:
+      return game.start_time
+    return game.last_modified_at
+
+  def AddGame(self, game):
+    """Adds a game to the index, or re-indexes the teams of an indexed game.
+
+    Teams which are no longer in an indexed game are removed from the index,
+    so this must be called whenever the teams of a game are changed.
+
+    Args:
+      game: game_model.Game object.
+    """
+    seq = self._sequence_numbers.get(id(game))
+    if seq is None:
+      seq = len(self._games)
+      self._games.append(game)
+      self._sequence_numbers[id(game)] = seq
+
+    twitter_ids = set([team.twitter_id for team in game.teams
+      if team.twitter_id is not None])
+    indexed_ids = self._indexed_team_ids.get(seq, set())
+    for twitter_id in indexed_ids - twitter_ids:
+      entries = self._entries_by_team[twitter_id]
+      entries[:] = [entry for entry in entries if entry[1] != seq]
+
+    compare_time = GameIndex.CompareTime(game)
+    for twitter_id in twitter_ids - indexed_ids:
+      entries = self._entries_by_team.setdefault(twitter_id, [])
+      bisect.insort(entries, (compare_time, seq))
+    self._indexed_team_ids[seq] = twitter_ids
+
+  def Candidates(self, twt, teams):
+    """Returns the games that the tweet could belong to.
+
+    A game is a candidate if it was indexed with the twitter id of one of the
+    teams and its compare time is within MAX_LENGTH_OF_GAME_IN_HOURS of when
+    the tweet was created. Teams replaced in a game are only re-indexed when
+    it's passed to AddGame again, so the caller still needs to check that
+    the game has a matching team.
+
+    Args:
+      twt: tweets.ParsedTweet object.
+      teams: list of game_model.Team objects found in the tweet.
+    Returns:
+      A list of game_model.Game objects in the order they were indexed.
+    """
+    max_game_length = timedelta(hours=MAX_LENGTH_OF_GAME_IN_HOURS)
+    lower = (twt.created_at - max_game_length, sys.maxint)
+    upper = (twt.created_at + max_game_length, -1)
+    seqs = set()
+    for team in teams:
+      entries = self._entries_by_team.get(team.twitter_id)
+      if team.twitter_id is None or not entries:
+        continue
+      start = bisect.bisect_right(entries, lower)
+      end = bisect.bisect_left(entries, upper)
+      seqs.update([seq for (_, seq) in entries[start:end]])
+    return [self._games[seq] for seq in sorted(seqs)]
+
+
+class StreamedPage(object):
+  """Iterates over the statuses of a streamed page, counting them."""
+
+  def __init__(self, statuses):
+    """Initializes the page.
+
+    Args:
+      statuses: Iterator over the parsed JSON statuses.
+    """
+    self._statuses = statuses
+    self.num_statuses = 0
+
+    # ID of the last status with an id that has been consumed, if any.
+    self.oldest_id = None
+
+  def __iter__(self):
+    for json_twt in self._statuses:
+      self.num_statuses += 1
+      try:
+        self.oldest_id = long(json_twt.get('id_str', ''))
+      except ValueError:
+        pass
+      yield json_twt
+
+  def Batches(self, batch_size):
+    """Yields lists of up to batch_size statuses."""
+    batch = []
+    for json_twt in self:
+      batch.append(json_twt)
+      if len(batch) >= batch_size:
+        yield batch
+        batch = []
+    if batch:
+      yield batch
+
+
+class ListStatusesPager(object):
+  """Fetches the pages of statuses in a list that have not been crawled yet.
+
+  The pages are fetched newest first, walking max_id downward, until the
+  crawl catches up with the tweets crawled before, hits one of the crawl
+  limits, or runs out of time. In the last case a task is enqueued to crawl
+  the rest of the list.
+  """
+
+  def __init__(self, fetcher, crawl_state, fake_data=False,
+      time_budget_secs=None, clock=time.time, first_page=None, stream=False):
+    """Initializes the pager.
+
+    Args:
+      fetcher: twitter_fetcher.TwitterFetcher to fetch the pages with.
+      crawl_state: CrawlState of the list, which is updated as pages are
+        fetched.
+      fake_data: If True, the fetcher returns fake data.
+      time_budget_secs: Seconds after which no more pages are fetched.
+        Defaults to CRAWL_TIME_BUDGET_SECS.
+      clock: Function returning the current time in seconds.
+      first_page: (optional) Future for the first page, which was already
+        requested with ListStatusesAsync.
+      stream: If True, the pages are fetched with stream=True and yielded as
+        StreamedPage objects, which must be consumed before the next page is
+        requested.
+    """
+    self.fetcher = fetcher
+    self.crawl_state = crawl_state
+    self.fake_data = fake_data
+    self.first_page = first_page
+    self.stream = stream
+    self.time_budget_secs = time_budget_secs
+    if time_budget_secs is None:
+      self.time_budget_secs = CRAWL_TIME_BUDGET_SECS
+    self.clock = clock
+
+    # Task enqueued to continue the crawl, if any.
+    self.enqueued_task = None
+
+  def Pages(self):
+    """Yields the parsed JSON list of statuses in each page.
+
+    If the pager streams, a StreamedPage is yielded for each page instead.
+
+    If the rate limit is reached part way through a crawl, the rest of the
+    crawl is enqueued to run once the rate limit window resets.
+
+    Raises:
+      twitter_fetcher.FetchError if the first page could not be fetched.
+    """
+    state = self.crawl_state
+    deadline = self.clock() + self.time_budget_secs
+    num_pages = 0
+    while True:
+      try:
+        if self.first_page:
+          first_page, self.first_page = self.first_page, None
+          json_obj = first_page.get_result()
+        elif self.stream:
+          json_obj = self.fetcher.ListStatuses(state.list_id,
+              count=state.num_to_crawl, since_id=state.last_tweet_id,
+              max_id=state.max_id, fake_data=self.fake_data, stream=True)
+        else:
+          json_obj = self.fetcher.ListStatuses(state.list_id,
+              count=state.num_to_crawl, since_id=state.last_tweet_id,
+              max_id=state.max_id, fake_data=self.fake_data)
+      except twitter_fetcher.RateLimitError as e:
+        # A crawl that has not started walking back through the list is
+        # picked up again by the next scheduled crawl.
+        if not num_pages and not state.max_id:
+          raise
+        logging.info('Pausing crawl of list %s: %s', state.list_id, e)
+        self.enqueued_task = self._EnqueueContinuation(
+            countdown=e.retry_after_secs)
+        return
+      except twitter_fetcher.FetchError as e:
+        if not num_pages:
+          raise
+        logging.warning('Could not fetch page %s of list %s: %s',
+            num_pages + 1, state.list_id, e)
+        self.enqueued_task = self._EnqueueContinuation()
+        return
+
+      num_pages += 1
+      state.total_requests_made += 1
+      if self.stream:
+        page = StreamedPage(json_obj)
+        yield page
+        num_statuses = page.num_statuses
+        oldest_id = page.oldest_id
+        state.total_crawled += num_statuses
+      else:
+        num_statuses = len(json_obj)
+        state.total_crawled += num_statuses
+        yield json_obj
+        oldest_id = self._OldestStatusId(json_obj)
+
+      if not self._ShouldCrawlMore(oldest_id, num_statuses):
+        return
+      state.max_id = oldest_id
+      if self.clock() >= deadline:
+        logging.info('Crawl of list %s out of time after %s pages',
+            state.list_id, num_pages)
+        self.enqueued_task = self._EnqueueContinuation()
+        return
+
+  def _OldestStatusId(self, json_obj):
+    """Returns the id of the last status with an id in the page, or None."""
+    for json_twt in reversed(json_obj):
+      try:
+        return long(json_twt.get('id_str', ''))
+      except ValueError:
+        continue
+    return None
+
+  def _ShouldCrawlMore(self, oldest_id, num_tweets_crawled):
+    """Returns True iff there are more statuses to crawl after this page.
+
+    Args:
+      oldest_id: ID of the oldest status in the page that was just fetched.
+      num_tweets_crawled: Number of statuses in the page.
+    """
+    state = self.crawl_state
+    tweet_in_db_id = state.last_tweet_id
+    logging.debug('list_id: %s', state.list_id)
+    logging.debug('tweet_in_db_id: %s', tweet_in_db_id)
+    logging.debug('num_tweets_crawled: %s', num_tweets_crawled)
+    logging.debug('total_crawled: %s', state.total_crawled)
+    logging.debug('total_requests_made: %s', state.total_requests_made)
+    # If no tweets were in the stream, then there are no more to crawl.
+    if not oldest_id:
+      return False
+    logging.debug('oldest_id: %s', oldest_id)
+
+    # If the oldest tweet returned is the most recent on in the db, then
+    # we're all caught up.
+    if oldest_id <= tweet_in_db_id + 1:
+      return False
+
+    # If we hit our threshold, bail.
+    if state.total_crawled >= MAX_POSTS_TO_CRAWL:
+      return False
+
+    # If this is the first time we've crawled this list, don't worry about it.
+    # The user backfill will ensure that we get good enough history for the
+    # stream.
+    if tweet_in_db_id + 1 == FIRST_TWEET_IN_STREAM_ID:
+      return False
+
+    # Don't crawl more if we only crawled one this turn. This works around a
+    # behavior of the Twitter API that appears to cap the number of historical
+    # tweets you can retrieve from a given list.
+    if num_tweets_crawled <= 1:
+      logging.info('Only 1 tweet crawled this iteration - stopping backfill')
+      return False
+
+    if state.total_requests_made >= MAX_REQUESTS:
+      logging.info('Backfill reached limit of %s total API requests',
+          MAX_REQUESTS)
+      return False
+    return True
+
+  def _EnqueueContinuation(self, countdown=None):
+    """Enqueues a task to crawl the pages not fetched by this request.
+
+    Args:
+      countdown: If set, the number of seconds to wait before running the task.
+    """
+    state = self.crawl_state
+    params = {
+        'list_id': state.list_id,
+        'total_crawled': state.total_crawled,
+        'max_id': state.max_id,
+        'since_id': state.last_tweet_id + 1,
+        'num_to_crawl': state.num_to_crawl,
+        'total_requests_made': state.total_requests_made,
+    }
+
+    logging.info('More tweets in update than fetched - enqueuing another task')
+    logging.info('Total crawled: %s', state.total_crawled)
+    if countdown:
+      return taskqueue.add(url='/tasks/crawl_list', method='GET',
+          params=params, queue_name='list-statuses', countdown=countdown)
+    return taskqueue.add(url='/tasks/crawl_list', method='GET',
+        params=params, queue_name='list-statuses')
+
+
+def LastCrawledTweetId(list_id):
+  """Returns the id of the newest tweet crawled from the list."""
+  cursor = CrawlCursor.Lookup(list_id)
+  if cursor:
+    return cursor.newest_id
+  return FIRST_TWEET_IN_STREAM_ID
+
 
 class CrawlListHandler(webapp2.RequestHandler):
   """Crawls the new statuses from a pre-defined list."""
@@ -460,9 +1224,23 @@ class CrawlListHandler(webapp2.RequestHandler):
       self.response.write(msg)
       return
 
-    last_tweet_id = self._LookupLatestTweet(list_id)
-    crawl_state = CrawlState.FromRequest(self.request, last_tweet_id)
-    
+    crawl_state = CrawlState.FromRequest(self.request,
+        LastCrawledTweetId(list_id))
+    self.CrawlList(crawl_state)
+
+  def CrawlList(self, crawl_state, fetcher=None, first_page=None):
+    """Crawls a list and matches its new tweets to games.
+
+    The backfill_date, update_games_only and fake_data parameters of the
+    request apply to the crawl.
+
+    Args:
+      crawl_state: CrawlState of the list.
+      fetcher: (optional) twitter_fetcher.TwitterFetcher to fetch the statuses
+        with.
+      first_page: (optional) Future for the first page of statuses, as
+        returned by ListStatusesAsync for the crawl_state.
+    """
     # In parallel: look-up the latest set of games for this
     # division and cache it
     division, age_bracket, league = list_id_bimap.ListIdBiMap.GetStructuredPropertiesForList(
@@ -475,8 +1253,10 @@ class CrawlListHandler(webapp2.RequestHandler):
       games_start = backfill_date + timedelta(weeks=1)
       # Query tweets for that week for this list
       if not update_games_only:
+        # Only tweets with at least two integers can be matched to games.
         tweet_query = tweets.Tweet.query(
-            tweets.Tweet.from_list == list_id,
+            tweets.Tweet.from_list == crawl_state.list_id,
+            tweets.Tweet.two_or_more_integers == True,
             tweets.Tweet.created_at > games_start - timedelta(weeks=1),
             tweets.Tweet.created_at < games_start).order(
             ).order(-tweets.Tweet.created_at)
@@ -493,16 +1273,11 @@ class CrawlListHandler(webapp2.RequestHandler):
 
     tourney_ids = []
     if league == League.USAU:
-      tourneys_query = Tournament.query(
-          Tournament.end_date < games_start + timedelta(days=3))
-      tourneys = tourneys_query.fetch(100)
-      for tourney in tourneys:
-        if not tourney.sub_tournaments:
-          continue
-        for st in tourney.sub_tournaments:
-          if st.division == division and st.age_bracket == age_bracket:
-            tourney_ids.append(tourney.id_str)
+      # Tweets and games are crawled from the week before games_start.
+      tourney_ids = ActiveTournamentIndex.LookupTournamentIds(division,
+          age_bracket, games_start - timedelta(weeks=1), games_start)
 
+    sr_games_future = None
     if tourney_ids:
       # For SR, pull up games scheduled for a day in either direction.
       sr_games_query = Game.query(Game.division == division,
@@ -512,46 +1287,77 @@ class CrawlListHandler(webapp2.RequestHandler):
       sr_games_future = sr_games_query.fetch_async()
 
     if not backfill_date:
-      token_manager = oauth_token_manager.OauthTokenManager()
-      fetcher = twitter_fetcher.TwitterFetcher(token_manager)
+      if not fetcher:
+        token_manager = oauth_token_manager.OauthTokenManager()
+        fetcher = twitter_fetcher.TwitterFetcher(token_manager)
+      pager = ListStatusesPager(fetcher, crawl_state,
+          fake_data=self.request.get('fake_data'), first_page=first_page,
+          stream=STREAM_LIST_STATUSES)
+
+      # All pages are matched against the same games, which are loaded once
+      # the first page has been fetched.
+      game_index = None
       try:
-        json_obj = fetcher.ListStatuses(crawl_state.list_id, count=crawl_state.num_to_crawl,
-            since_id=crawl_state.last_tweet_id, max_id=crawl_state.max_id,
-            fake_data=self.request.get('fake_data'))
+        for page in pager.Pages():
+          batches = [page]
+          if pager.stream:
+            batches = page.Batches(STREAM_BATCH_SIZE)
+
+          # The range of tweets crawled from this list is only updated once
+          # the whole page is stored.
+          page_ids = []
+          for json_obj in batches:
+            # Update the various datastores.
+            twts, users = self.UpdateTweetDbWithNewTweets(json_obj,
+                crawl_state)
+            page_ids.extend([long(t.id_str) for t in twts])
+            # The newest tweet from the last crawl is always crawled again.
+            crawl_planner.RecordTweets(crawl_state.list_id, [t for t in twts
+              if long(t.id_str) > crawl_state.last_tweet_id + 1])
+            if game_index is None:
+              game_index = GameIndex(self._GetExistingGames(twit_games_future,
+                sr_games_future))
+            self.UpdateGames(twts, game_index, users, division, age_bracket,
+                league)
+          if page_ids:
+            CrawlCursor.Advance(crawl_state.list_id, page_ids[0], page_ids[-1])
       except twitter_fetcher.FetchError as e:
         msg = 'Could not fetch statuses for list %s' % crawl_state.list_id
         logging.warning('%s: %s', msg, e)
         self.response.write(msg)
 
         # TODO: retry the request a fixed # of times
-        return
+      return
 
-      # Update the various datastores.
-      twts, users = self.UpdateTweetDbWithNewTweets(json_obj, crawl_state)
+    game_index = GameIndex(self._GetExistingGames(twit_games_future,
+      sr_games_future))
+    if update_games_only:
+      self.RepairGames(game_index)
+      return
 
-    if backfill_date:
-      if update_games_only:
-        twts = []
-      else:
-        twts = twts_future.get_result()
-      users = {}
+    twts = [tweets.ParsedTweet.FromTweet(t) for t in twts_future.get_result()]
+    self.UpdateGames(twts, game_index, {}, division, age_bracket, league)
+    # TODO(SOON): Consider merging the games if they are appropriately consistent.
 
+  def _GetExistingGames(self, twit_games_future, sr_games_future):
+    """Returns the games from the Twitter and (optional) SR game queries."""
     existing_games = twit_games_future.get_result()
-    if tourney_ids:
-      sr_existing_games = sr_games_future.get_result()
-      existing_games.extend(sr_existing_games)
-    self.UpdateGames(twts, existing_games, users, division, age_bracket, league)
-    # TODO(SOON): Consider merging the games if they are appropriately consistent.
+    if sr_games_future:
+      existing_games.extend(sr_games_future.get_result())
+    return existing_games
 
   def UpdateTweetDbWithNewTweets(self, json_obj, crawl_state):
     """Update the Tweet DB with the newly-fetched tweets.
 
+    The CrawlCursor of the list is advanced by the caller.
+
     Args:
       json_obj: The parsed JSON object from the API response.
       crawl_state: State of the crawl for this list.
     Returns:
-      A 2-tuple. The first item is the list of tweets.Tweet objects that were
-      added to the datastore and the second is a dictionary mapping string
+      A 2-tuple. The first item is the list of tweets.ParsedTweet objects for
+      the tweets that were added to the datastore and the second is a
+      dictionary mapping string
       user ids to the tweets.User objects for all authors of tweets in this
       crawl cycle.
     """
@@ -559,36 +1365,31 @@ class CrawlListHandler(webapp2.RequestHandler):
     # team might not be populated. The Game creation code should look up
     # users with the key that guarantees consistency instead of doing a search.
 
-    # Keep track of the first tweet in the list for bookkeeping purposes.
-    latest_incoming_tweet = None
-    oldest_incoming_tweet = None
     twts = []
-    users = {}
+    json_users = []
     for json_twt in json_obj:
-      # TODO: consider writing all of these at the same time / in one transaction, possibly
-      # in the same transaction that updates all the games as well.
-      twt = tweets.Tweet.GetOrInsertFromJson(json_twt,
-          from_list=crawl_state.list_id)
-      if not latest_incoming_tweet:
-        latest_incoming_tweet = twt
+      twt = tweets.ParsedTweet.FromJson(json_twt)
       if not twt:
         # TODO: need to keep track of a counter, fire alert
         logging.warning('Could not parse tweet from %s', json_twt)
         continue
 
-      UpdateUser(json_twt.get('user', {}), users)
-      oldest_incoming_tweet = twt
+      json_users.append(json_twt.get('user', {}))
       twts.append(twt)
 
-    num_crawled = len(json_obj)
-    self._PossiblyEnqueueMoreCrawling(crawl_state.list_id,
-        crawl_state.last_tweet_id, oldest_incoming_tweet,
-        num_crawled, crawl_state.num_to_crawl,
-        num_crawled + crawl_state.total_crawled,
-        crawl_state.total_requests_made + 1)
+    # Look up and write the whole page at once rather than one get_or_insert
+    # transaction per tweet. Only the tweets which may already have been
+    # stored are looked up, and Tweet models are only built for the ones
+    # which are written. Games are matched with the ParsedTweets.
+    seen_ids = SeenTweetIds.Lookup()
+    new_twts = tweets.Tweet.BulkInsertFromJson(json_obj,
+        from_list=crawl_state.list_id, is_new=seen_ids.IsNew)
+    SeenTweetIds.AddToMemcache([t.id_str for t in new_twts])
+
+    users = {}
+    UpdateUsers(json_users, users)
 
-    # Update the value of most recent tweet.
-    self._UpdateLatestTweet(latest_incoming_tweet, crawl_state.list_id)
+    num_crawled = len(json_obj)
 
     logging.info('Added %s tweets to db for list %s', num_crawled,
         crawl_state.list_id)
@@ -596,13 +1397,14 @@ class CrawlListHandler(webapp2.RequestHandler):
  
     return (twts, users)
 
-  def UpdateGames(self, twts, existing_games, users, division, age_bracket,
+  def UpdateGames(self, twts, game_index, users, division, age_bracket,
       league):
     """Update the datastore with the game information in the given tweets.
 
     Args:
-      twts: list of tweets.Tweet objects
-      existing_games: list of game_model.Game objects already in the datastore
+      twts: list of tweets.ParsedTweet objects
+      game_index: GameIndex of the game_model.Game objects already in the
+        datastore. Games created from these tweets are added to it.
       users: dictionary from user ids to tweets.User objects for authors of all
         the tweets in twts
       division: Division of tweets
@@ -612,91 +1414,43 @@ class CrawlListHandler(webapp2.RequestHandler):
     # This will keep track of games added during processing of these tweets.
     added_games = []
 
-    logging.info('UpdateGames: %d tweets, %d existing games',
-        len(twts), len(existing_games))
+    team_resolver = TeamResolver(users)
+    team_resolver.Prefetch(twts)
+
+    # Games which were created or changed by these tweets, in the order they
+    # were first touched. Only these need to be written back.
+    dirty_games = []
+    dirty_game_ids = set()
+
+    logging.info('UpdateGames: %d tweets', len(twts))
     for twt in twts:
-      self._PossiblyAddTweetToGame(twt, existing_games, added_games, users,
-          division, age_bracket, league)
+      game = self._PossiblyAddTweetToGame(twt, game_index, added_games,
+          team_resolver, division, age_bracket, league)
+      if game and id(game) not in dirty_game_ids:
+        dirty_game_ids.add(id(game))
+        dirty_games.append(game)
 
-    # Update the games
-    # TOOD: consider doing this in one transaction to save time
-    for game in existing_games + added_games:
-      self._UpdateGameConsistency(game, users)
-      game.put()
+    if not dirty_games:
+      return
+    logging.info('UpdateGames: writing %d changed games', len(dirty_games))
+    for game in dirty_games:
+      self._UpdateGameConsistency(game, team_resolver, game_index=game_index)
+    ndb.Future.wait_all(ndb.put_multi_async(dirty_games))
 
-  def _PossiblyEnqueueMoreCrawling(self, list_id, tweet_in_db_id,
-      oldest_incoming_tweet, num_tweets_crawled, num_requested, total_crawled,
-      total_requests_made):
-    """Enqueue more tweet crawling if we haven't processed all stream updates.
+  def RepairGames(self, game_index):
+    """Updates the consistency of every indexed game and writes them all.
 
     Args:
-      list_id: ID of the list being crawled.
-      tweet_in_db_id: ID of most recent tweet in the tweet DB.
-      oldest_incoming_tweet: lowest-id tweet processed outside the DB.
-      num_tweets_crawled: Number of tweets crawled during this crawl attempt.
-      num_requested: Number of tweets request
-      total_crawled: Total number of tweets crawled during this crawl attempt,
-        including repeated calls to enqueue more crawl requests that resulted
-        from the original crawl request.
-      total_requests_made: Total number of requests made trying to crawl this
-        list.
-    Returns:
-      Any tasks that were enqueued.
+      game_index: GameIndex of the game_model.Game objects to repair.
     """
-    logging.debug('list_id: %s', list_id)
-    logging.debug('tweet_in_db_id: %s', tweet_in_db_id)
-    logging.debug('num_tweets_crawled: %s', num_tweets_crawled)
-    logging.debug('num_requested: %s', num_requested)
-    logging.debug('total_crawled: %s', total_crawled)
-    logging.debug('total_requests_made: %s', total_requests_made)
-    # If no tweets were in the stream, then there are no more to crawl.
-    if not oldest_incoming_tweet:
-      return None
-    logging.debug('oldest_incoming_tweet.id_str: %s', oldest_incoming_tweet.id_str)
-
-    # If the oldest tweet returned is the most recent on in the db, then
-    # we're all caught up.
-    if long(oldest_incoming_tweet.id_str) <= tweet_in_db_id + 1:
-      return None
-
-    # If we hit our threshold, bail.
-    if total_crawled >= MAX_POSTS_TO_CRAWL:
-      return None
-
-    # If this is the first time we've crawled this list, don't worry about it.
-    # The user backfill will ensure that we get good enough history for the
-    # stream.
-    if tweet_in_db_id + 1 == FIRST_TWEET_IN_STREAM_ID:
-      return None
-
-    # Don't crawl more if we only crawled one this turn. This works around a
-    # behavior of the Twitter API that appears to cap the number of historical
-    # tweets you can retrieve from a given list.
-    if num_tweets_crawled <= 1:
-      logging.info('Only 1 tweet crawled this iteration - stopping backfill')
-      return None
-
-    if total_requests_made >= MAX_REQUESTS:
-      logging.info('Backfill reached limit of %s total API requests',
-          MAX_REQUESTS)
-      return None
-
-    params = {
-        'list_id': list_id,
-        'total_crawled': total_crawled,
-        'max_id': long(oldest_incoming_tweet.id_str),
-        'since_id': tweet_in_db_id + 1,
-        'num_to_crawl': num_requested,
-        'total_requests_made': total_requests_made,
-    }
-
-    logging.info('More tweets in update than fetched - enqueuing another task')
-    logging.info('Total crawled: %s, num crawled this iteration: %s',
-        total_crawled, num_tweets_crawled)
-    return taskqueue.add(url='/tasks/crawl_list', method='GET',
-        params=params, queue_name='list-statuses')
-
-  def _UpdateGameConsistency(self, game, user_map):
+    games = game_index.games
+    logging.info('RepairGames: writing %d games', len(games))
+    team_resolver = TeamResolver({})
+    for game in games:
+      self._UpdateGameConsistency(game, team_resolver, game_index=game_index)
+    ndb.Future.wait_all(ndb.put_multi_async(games))
+
+  def _UpdateGameConsistency(self, game, team_resolver, game_index=None):
     """Update the game consistency.
 
     TODO(SOON): evaluate whether or not this is needed anymore.
@@ -706,6 +1460,9 @@ class CrawlListHandler(webapp2.RequestHandler):
 
     Args:
       game: the game_model.Game object to update.
+      team_resolver: TeamResolver for this crawl.
+      game_index: (optional) GameIndex the game is in. It's re-indexed if its
+        teams are updated.
     """
     # Figure out the right teams. Count the number of tweets by each author
     # and the number of mentions of any account.
@@ -758,47 +1515,51 @@ class CrawlListHandler(webapp2.RequestHandler):
 
     # Teams are inconsistent in the game - update them.
     logging.info('Updating inconsistent game: %s', game.id_str)
-    team_a, _, _, _ = self._TeamFromAuthorId(str(sorted_teams[0][1]), user_map)
+    team_a, _, _, _ = team_resolver.Resolve(str(sorted_teams[0][1]))
     if len(sorted_teams) > 1:
-      team_b, _, _, _ = self._TeamFromAuthorId(str(sorted_teams[1][1]), user_map)
+      team_b, _, _, _ = team_resolver.Resolve(str(sorted_teams[1][1]))
     else:
       team_b = Team(score_reporter_id=UNKNOWN_SR_ID)
 
     game.teams = [team_a, team_b]
+    if game_index:
+      game_index.AddGame(game)
 
-  def _PossiblyAddTweetToGame(self, twt, existing_games, added_games, user_map,
-      division, age_bracket, league):
+  def _PossiblyAddTweetToGame(self, twt, game_index, added_games,
+      team_resolver, division, age_bracket, league):
     """Determine if a tweet is a game tweet and add it to a game if so.
 
     Args:
-      twt: tweets.Tweet object to be processed.
-      existing_games: list of game_model.Game objects that are currently in the
-        db.
+      twt: tweets.ParsedTweet object to be processed.
+      game_index: GameIndex of the games that are currently in the db or have
+        been added as part of this crawl request. New games are added to it.
       added_games: list of game_model.Game objects that have been added as part 
         of this crawl request.
-      user_map: map of string user ids to users which have authored a tweet
-        during this crawl cycle and thus may not be propagated in the db yet.
+      team_resolver: TeamResolver for this crawl.
       division: Division to set new Game to, if creating one
       age_bracket: AgeBracket to set new Game to, if creating one
       league: League to set new Game to, if creating one
+    Returns:
+      The game_model.Game object that was created or had the tweet added as a
+      source, or None if no game was changed.
     """
     if not twt:
-      return
+      return None
     if not twt.two_or_more_integers:
-      return
+      return None
 
-    score_indicies = self._FindScoreIndicies(twt.entities.integers, twt.text)
+    score_indicies = self._FindScoreIndicies(twt.integers, twt.text)
     if not score_indicies:
       logging.debug('Ignoring tweet - numbers aren\'t scores: %s', twt.text)
-      return
+      return None
 
-    teams = self._FindTeamsInTweet(twt, user_map)
+    teams = self._FindTeamsInTweet(twt, team_resolver)
     logging.debug('teams: %s', teams)
-    scores = [twt.entities.integers[score_indicies[0]].num,
-          twt.entities.integers[score_indicies[1]].num]
+    scores = [twt.integers[score_indicies[0]].num,
+          twt.integers[score_indicies[1]].num]
     logging.debug('scores: %s', scores)
     (consistency_score, game) = self._FindMostConsistentGame(
-        twt, existing_games + added_games, teams, division, age_bracket, league, scores)
+        twt, game_index, teams, division, age_bracket, league, scores)
     logging.debug('consistency score %s for twt %s', consistency_score, twt.text)
     # TODO: detect tweets that are summaries for the day (eg, "We went
     # 3-0 today")
@@ -813,32 +1574,35 @@ class CrawlListHandler(webapp2.RequestHandler):
     # Try to find a game that matches this tweet in existing games. If no such
     # game exists, create one.
     if consistency_score < GAME_CONSISTENCY_THRESHOLD:
-      added_games.append(Game.FromTweet(twt, teams, scores, division,
-        age_bracket, league))
-    else:
-      for source in game.sources:
-        if twt.id_64 == source.tweet_id:
-          logging.debug('Tried to add tweet more than once as game source %s',
-              twt)
-          return
-      game.sources.append(GameSource.FromTweet(twt, scores))
-      game.sources.sort(cmp=lambda x,y: cmp(y.update_date_time,
-        x.update_date_time))
-      self._MergeTeamsIntoGame(game, teams)
+      game = Game.FromTweet(twt, teams, scores, division, age_bracket, league)
+      added_games.append(game)
+      game_index.AddGame(game)
+      return game
 
-  def _FindMostConsistentGame(self, twt, existing_games, teams,
+    for source in game.sources:
+      if twt.id_64 == source.tweet_id:
+        logging.debug('Tried to add tweet more than once as game source %s',
+            twt)
+        return None
+    game.sources.append(GameSource.FromTweet(twt, scores))
+    game.sources.sort(cmp=lambda x,y: cmp(y.update_date_time,
+      x.update_date_time))
+    self._MergeTeamsIntoGame(game, teams)
+    game_index.AddGame(game)
+    return game
+
+  def _FindMostConsistentGame(self, twt, game_index, teams,
       division, age_bracket, league, scores):
     """Returns the game most consistent with the given games.
 
     If no game is found to be at all consistent, the consistency score returned
-    will be 0.0 and the matching game will be None. existing_games and
-    added_games should be pre-filtered to contain only those games with the
-    correct domain, age bracket, and league.
+    will be 0.0 and the matching game will be None. game_index should
+    contain only those games with the correct domain, age bracket, and league.
 
     Args:
-      twt: tweets.Tweet object to be processed.
-      existing_games: list of game_model.Game objects that are currently in the
-        db or have been added as part of this crawl request.
+      twt: tweets.ParsedTweet object to be processed.
+      game_index: GameIndex of the games that are currently in the db or have
+        been added as part of this crawl request.
       teams: list of game_model.Team objects involved in this game.
       division: Division to set new Game to, if creating one
       age_bracket: AgeBracket to set new Game to, if creating one
@@ -856,7 +1620,10 @@ class CrawlListHandler(webapp2.RequestHandler):
     # team and probably isn't worth the effort.
     # TODO: use ML to build a better model once there is enough data.
     most_consistent = [0.0, None]
-    for game in existing_games:
+    # The index only returns games that happened within a few hours of the
+    # tweet, since otherwise they are probably not the same game.
+    for game in game_index.Candidates(twt, teams):
+      compare_time = GameIndex.CompareTime(game)
       for game_team in game.teams:
         for tweet_team in teams:
           if game_team.twitter_id != tweet_team.twitter_id:
@@ -867,24 +1634,6 @@ class CrawlListHandler(webapp2.RequestHandler):
             logging.debug('No useful identifier found for tweet_team %s', tweet_team)
             continue
 
-          # So one of the teams is the same. If this game happened within the last few
-          # hours it's probably the same game.
-          max_game_length = timedelta(hours=MAX_LENGTH_OF_GAME_IN_HOURS)
-
-          compare_time = game.last_modified_at
-          if game.start_time and game.start_time > game.last_modified_at:
-            compare_time = game.start_time
-
-          if twt.created_at < compare_time:
-            if abs(twt.created_at - compare_time) >= max_game_length:
-              logging.debug('game too old, skipping')
-              continue
-
-          if twt.created_at < compare_time:
-            if game.last_modified_at - compare_time >= max_game_length:
-              logging.debug('game too new, skipping')
-              continue
-
           new_scores = games.Scores.FromList(scores, ordered=False)
           score = self._CompareScoresFromAllSources(
               twt, new_scores, game.sources, compare_time)
@@ -898,7 +1647,7 @@ class CrawlListHandler(webapp2.RequestHandler):
     """Compare consistency of this score with all other scores in the game.
 
     Args:
-      twt: tweets.Tweet object
+      twt: tweets.ParsedTweet object
       new_scores: games.Scores object from this tweet.
       sources: List of game sources from this game.
       compare_time: datetime.datetime object for comparison time if
@@ -967,7 +1716,7 @@ class CrawlListHandler(webapp2.RequestHandler):
     max_seconds = float(timedelta(hours=MAX_LENGTH_OF_GAME_IN_HOURS).seconds)
     return (numerator / denominator) * ((max_seconds - seconds) / max_seconds)
 
-  def _FindTeamsInTweet(self, twt, user_map):
+  def _FindTeamsInTweet(self, twt, team_resolver):
     """Find the teams this tweet refers to.
 
     Determine the two teams this twt is referring to. Currently this only
@@ -975,30 +1724,27 @@ class CrawlListHandler(webapp2.RequestHandler):
     game score is included in the tweet text. Sorry, Ultiworld :)
 
     Args:
-      twt: tweets.Tweet object
-      user_map: map from string user ids to users who have authored a tweet
-        during this crawl cycle.
+      twt: tweets.ParsedTweet object
+      team_resolver: TeamResolver for this crawl.
     Returns:
       A list of exactly two game_model.Team objects. If the teams cannot be
       determined then the team.score_reporter_id will be set to UNKNOWN_SR_ID
       and no other object properties will be set.
     """
-    this_team, div, ab, l = self._TeamFromAuthorId(twt.author_id, user_map)
+    this_team, div, ab, l = team_resolver.Resolve(twt.author_id)
 
     # TODO(ultiworld): add logic to handle the case where the author of the
     # tweet is not involved in the game.
 
     # Try to determine the other team based on user account mention.
     other_team = Team(score_reporter_id=UNKNOWN_SR_ID)
-    if not twt.entities:
-      return [this_team, other_team]
-    if not twt.entities.user_mentions:
+    if not twt.user_mention_ids:
       return [this_team, other_team]
 
     # Otherwise we take the first team in that division / age bracket / league.
-    for user_mention in twt.entities.user_mentions:
-      candidate_team, other_div, other_ab, other_l = self._TeamFromAuthorId(
-          twt.entities.user_mentions[0].user_id, user_map)
+    for user_mention_id in twt.user_mention_ids:
+      candidate_team, other_div, other_ab, other_l = team_resolver.Resolve(
+          twt.user_mention_ids[0])
       if candidate_team.twitter_id:
         if (div != other_div) or (l != other_l):
           continue
@@ -1007,38 +1753,6 @@ class CrawlListHandler(webapp2.RequestHandler):
 
     return [this_team, other_team]
 
-  def _TeamFromAuthorId(self, author_id, user_map):
-    """Try to build a game_model.Team object from a string user_id.
-
-    Args:
-      author_id: (string) twitter ID of the user account.
-      user_map: map from string user ids to users who have authored a tweet
-        during this crawl cycle.
-    Returns:
-      A tuple with game_model.Team object, division, league, and age bracket.
-      If the user ID is not found in the provided
-      user_map or the db then a user with score_reporter_id equal to
-      UNKNOWN_SR_ID is returned for this first element and the other values
-      should be ignored.
-    """
-    if user_map.get(author_id):
-      user = user_map.get(author_id)
-      team = Team.FromTwitterUser(user_map.get(author_id))
-      div, ab, league = list_id_bimap.ListIdBiMap.GetStructuredPropertiesForList(
-          user.from_list)
-      return team, div, league, ab
-
-    account_query = tweets.User.query().order(tweets.User.screen_name)
-    account_query = account_query.filter(tweets.User.id_str == author_id)
-    user = account_query.fetch(1)
-    if user:
-      team = Team.FromTwitterUser(user[0])
-      div, ab, league = list_id_bimap.ListIdBiMap.GetStructuredPropertiesForList(
-          user[0].from_list)
-      return team, div, league, ab
-    team = Team(score_reporter_id=UNKNOWN_SR_ID)
-    return team, Division.OPEN, League.USAU, AgeBracket.NO_RESTRICTION
-
   def _MergeTeamsIntoGame(self, game, teams):
     """Merge the teams from the tweet into the game.
 
@@ -1073,7 +1787,8 @@ class CrawlListHandler(webapp2.RequestHandler):
     """Return the two integer entities referring to the score.
 
     Args:
-      integer_entities: a list of tweets.IntegerEntity objects.
+      integer_entities: a list of tweets.IntegerSpan or tweets.IntegerEntity
+        objects.
       tweet_text: Tweet text for logging purposes.
 
     Returns:
@@ -1100,63 +1815,42 @@ class CrawlListHandler(webapp2.RequestHandler):
     # games.
     return []
 
-  # TODO: consider making this and other datastore writes in this function
-  # transactional to be more resilient to errors / bugs / API service outages.
-  # Writing all tweets in one transaction using an ancestor query is the way
-  # to go.
-  # https://cloud.google.com/appengine/docs/python/ndb/transactions
-  def _UpdateLatestTweet(self, latest_tweet, list_id):
-    """Update the 'latest' table with the most recent set of tweets.
-
-    Args:
-      latest_tweet: Most recent tweet in the stream to be indexed.
-      list_id: ID of the list.
-    """
-    if not latest_tweet:
-      logging.debug('No latest tweet added')
-      return
 
-    latest_id = self._LookupLatestTweet(list_id)
+class CrawlListsHandler(CrawlListHandler):
+  """Crawls several lists in one request.
 
-    if long(latest_tweet.id_str) < latest_id:
-      logging.warning('Tweet %s written to the datastore older than latest %s',
-          latest_tweet.id_str, latest_id)
+  The first page of every list is fetched concurrently, then each list is
+  ingested and matched to games as by CrawlListHandler.
+  """
+  def get(self):
+    list_ids = [l for l in self.request.get('list_ids').split(',') if l]
+    if not list_ids:
+      msg = 'No lists specified'
+      logging.warning(msg)
+      self.response.write(msg)
       return
 
-    # Update memcache
-    memcache.add(key=LISTS_LATEST_KEY_PREFIX + list_id,
-        value=long(latest_tweet.id_str), time=3600, namespace=LISTS_LATEST_NAMESPACE)
-
-  def _LookupLatestTweet(self, list_id):
-    """Lookup the most recent tweet in the db for the given list.
-
-    Args:
-      list_id: The ID of the list.
-    Returns:
-      long(tweet.id_str) for the latest 'tweet' in db for that list.
-    """
-    # This won't necessarily be consistent, but we will never double-write
-    # tweets since we call get_or_insert.
-    cache_latest = memcache.get(
-        key=LISTS_LATEST_KEY_PREFIX + list_id, namespace=LISTS_LATEST_NAMESPACE)
+    token_manager = oauth_token_manager.OauthTokenManager()
+    fetcher = twitter_fetcher.TwitterFetcher(token_manager)
+    crawl_states = [CrawlState(l, 0L, 0L, 0L, 0L, LastCrawledTweetId(l))
+        for l in list_ids]
+    first_pages = [fetcher.ListStatusesAsync(state.list_id,
+      count=state.num_to_crawl, since_id=state.last_tweet_id,
+      max_id=state.max_id, fake_data=self.request.get('fake_data'),
+      stream=STREAM_LIST_STATUSES) for state in crawl_states]
 
-    # Let's look at the datastore
-    tweet_query = tweets.Tweet.query(tweets.Tweet.from_list == list_id).order(
-        -tweets.Tweet.id_str)
+    for crawl_state, first_page in zip(crawl_states, first_pages):
+      self.CrawlList(crawl_state, fetcher=fetcher, first_page=first_page)
 
-    twts = tweet_query.fetch(1)
-    if twts:
-      return long(twts[0].id_str)
 
-    return FIRST_TWEET_IN_STREAM_ID
-  
- 
 app = webapp2.WSGIApplication([
   ('/tasks/update_lists', UpdateListsHandler),
   ('/tasks/update_lists_rate_limited', UpdateListsRateLimitedHandler),
   ('/tasks/backfill_games', BackfillGamesHandler),
   ('/tasks/crawl_list', CrawlListHandler),
+  ('/tasks/crawl_lists', CrawlListsHandler),
   ('/tasks/crawl_all_lists', CrawlAllListsHandler),
+  ('/tasks/crawl_due_lists', CrawlDueListsHandler),
   ('/tasks/crawl_users', CrawlUserHandler),
   ('/tasks/crawl_all_users', CrawlAllUsersHandler),
 ], debug=True)
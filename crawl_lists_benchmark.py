@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Martin Cochran
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for the list crawling pipeline.
+
+Usage: python crawl_lists_benchmark.py
+"""
+
+from datetime import datetime, timedelta
+import random
+
+import benchmark_util
+
+from google.appengine.ext import ndb
+
+import crawl_lists
+from game_model import Game, GameSource, Team
+from scores_messages import AgeBracket
+from scores_messages import Division
+from scores_messages import GameSourceType
+from scores_messages import League
+import tweets
+
+
+def _IngestPerTweet(list_id, json_obj):
+  """Ingests a page the way crawl_lists did before bulk ingestion."""
+  for json_twt in json_obj:
+    tweets.Tweet.GetOrInsertFromJson(json_twt, from_list=list_id)
+
+
+def _IngestBulk(list_id, json_obj):
+  tweets.Tweet.BulkInsertFromJson(json_obj, from_list=list_id)
+
+
+def BenchmarkTweetIngestion():
+  """Replays the sample list pages through per-tweet and bulk ingestion.
+
+  Each page is ingested twice: once into an empty db, and once more to
+  simulate a recrawl where every tweet is already known.
+  """
+  print('Tweet ingestion: datastore RPCs and wall time per page')
+  for list_id, json_obj in benchmark_util.LoadListStatuses():
+    for name, ingest_fn in [('per-tweet', _IngestPerTweet),
+                            ('bulk', _IngestBulk)]:
+      bed = benchmark_util.ActivateTestbed()
+      counter = benchmark_util.RpcCounter()
+      results = []
+      for _ in range(2):
+        benchmark_util.ClearNdbCache()
+        counter.Reset()
+        with benchmark_util.Timer() as timer:
+          ingest_fn(list_id, json_obj)
+        results.append((counter.Total('datastore_v3'), timer.elapsed_ms))
+      bed.deactivate()
+      print('  list %s (%3d tweets) %-9s  new: %4d rpcs %8.1f ms   '
+          'recrawl: %4d rpcs %8.1f ms' % (list_id, len(json_obj), name,
+            results[0][0], results[0][1], results[1][0], results[1][1]))
+
+
+class _LinearGameIndex(crawl_lists.GameIndex):
+  """Finds candidates by scanning every game, as was done before GameIndex."""
+
+  def Candidates(self, twt, teams):
+    max_game_length = timedelta(hours=crawl_lists.MAX_LENGTH_OF_GAME_IN_HOURS)
+    twitter_ids = set([t.twitter_id for t in teams if t.twitter_id])
+    candidates = []
+    for game in self._games:
+      if not twitter_ids.intersection([t.twitter_id for t in game.teams]):
+        continue
+      compare_time = crawl_lists.GameIndex.CompareTime(game)
+      if abs(twt.created_at - compare_time) < max_game_length:
+        candidates.append(game)
+    return candidates
+
+
+def _CreateSyntheticGames(num_games, num_teams, start, rand):
+  """Creates games between random teams spread over a week."""
+  games = []
+  for i in range(num_games):
+    game_time = start + timedelta(minutes=rand.randint(0, 7 * 24 * 60))
+    team_ids = rand.sample(range(1, num_teams + 1), 2)
+    source = GameSource(type=GameSourceType.TWITTER, home_score=5,
+        away_score=7, update_date_time=game_time)
+    games.append(Game(id_str='game %d' % i,
+        teams=[Team(twitter_id=t) for t in team_ids], scores=[5, 7],
+        division=Division.OPEN, age_bracket=AgeBracket.NO_RESTRICTION,
+        league=League.USAU, created_at=game_time, last_modified_at=game_time,
+        sources=[source]))
+  return games
+
+
+def BenchmarkGameMatching(num_tweets=200, num_teams=400):
+  """Matches synthetic score tweets against a growing number of games."""
+  print('Game matching: wall time for %d score tweets' % num_tweets)
+  handler = crawl_lists.CrawlListHandler()
+  start = datetime(2016, 7, 1)
+  for num_games in [100, 1000, 5000, 20000]:
+    rand = random.Random(num_games)
+    games = _CreateSyntheticGames(num_games, num_teams, start, rand)
+    twts = []
+    for i in range(num_tweets):
+      created_at = start + timedelta(minutes=rand.randint(0, 7 * 24 * 60))
+      teams = [Team(twitter_id=rand.randint(1, num_teams)),
+          Team(score_reporter_id=crawl_lists.UNKNOWN_SR_ID)]
+      twts.append((tweets.Tweet(id_str=str(i), created_at=created_at), teams))
+
+    results = []
+    for index_class in [_LinearGameIndex, crawl_lists.GameIndex]:
+      with benchmark_util.Timer() as timer:
+        game_index = index_class(games)
+        for twt, teams in twts:
+          handler._FindMostConsistentGame(twt, game_index, teams,
+              Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU, [6, 7])
+      results.append(timer.elapsed_ms)
+    print('  %5d games  linear scan: %9.1f ms   indexed: %7.1f ms' % (
+        num_games, results[0], results[1]))
+
+
+class _StringListIdTweet(ndb.Model):
+  """The properties of the backfill query, with list ids stored as strings."""
+  from_list = ndb.StringProperty('fl')
+  two_or_more_integers = ndb.BooleanProperty('tom')
+  created_at = ndb.DateTimeProperty('cd')
+
+
+class _IntListIdTweet(ndb.Model):
+  """The properties of the backfill query, as stored by tweets.Tweet."""
+  from_list = tweets.ListIdProperty('fl')
+  two_or_more_integers = ndb.BooleanProperty('tom')
+  created_at = ndb.DateTimeProperty('cd')
+
+
+def _ListIdValueSize(entity):
+  """Returns the encoded size of the 'fl' value, which is in each index row."""
+  for prop in entity._to_pb().property_list():
+    if prop.name() == 'fl':
+      return len(prop.value().Encode())
+  return 0
+
+
+def BenchmarkListIdStorage(copies=20):
+  """Compares string and integer list ids in the backfill query.
+
+  The sample list pages are stored copies times with each encoding, then the
+  week-long (from_list, two_or_more_integers, created_at) query is run for
+  each list.
+  """
+  print('List id storage: index value size and backfill query wall time')
+  pages = benchmark_util.LoadListStatuses()
+  for name, model_class in [('string', _StringListIdTweet),
+                            ('integer', _IntListIdTweet)]:
+    bed = benchmark_util.ActivateTestbed()
+    entities = []
+    for list_id, json_obj in pages:
+      for json_twt in json_obj:
+        twt = tweets.Tweet.FromJson(json_twt, from_list=list_id)
+        for i in range(copies):
+          entities.append(model_class(from_list=list_id,
+              two_or_more_integers=twt.two_or_more_integers,
+              created_at=twt.created_at - timedelta(minutes=i)))
+    ndb.put_multi(entities)
+
+    num_results = 0
+    with benchmark_util.Timer() as timer:
+      for list_id, json_obj in pages:
+        end = max([tweets.Tweet.FromJson(j).created_at for j in json_obj])
+        num_results += len(model_class.query(
+          model_class.from_list == list_id,
+          model_class.two_or_more_integers == True,
+          model_class.created_at > end - timedelta(weeks=1),
+          model_class.created_at <= end).order(
+            -model_class.created_at).fetch())
+    bed.deactivate()
+    print('  %-7s  %2d bytes per index value   %5d results in %8.1f ms' % (
+        name, _ListIdValueSize(entities[0]), num_results, timer.elapsed_ms))
+
+
+if __name__ == '__main__':
+  BenchmarkTweetIngestion()
+  BenchmarkGameMatching()
+  BenchmarkListIdStorage()
@@ -20,12 +20,17 @@ import json
 import logging
 import mock
 import unittest
+import urlparse
 import webtest
 
 import test_env_setup
+from google.appengine.api import memcache
 from google.appengine.api import taskqueue
+from google.appengine.api import urlfetch_stub
+from google.appengine.ext import ndb
 
 import crawl_lists
+import crawl_planner
 from game_model import Game, GameSource, Team
 import list_id_bimap
 from scores_messages import AgeBracket
@@ -33,6 +38,7 @@ from scores_messages import Division
 from scores_messages import GameSourceType
 from scores_messages import League
 import tweets
+import twitter_fetcher
 import web_test_base
 
 
@@ -64,6 +70,20 @@ class CrawlListsTest(web_test_base.WebTestBase):
     self.assertEqual(200, response.status_int)
     self.assertTrue(response.body.find('Could not retrieve lists') != -1)
 
+  @mock.patch.object(taskqueue, 'add')
+  def testUpdateLists_rateLimited(self, mock_add_queue):
+    with mock.patch.object(twitter_fetcher.TwitterFetcher, 'LookupLists',
+        side_effect=twitter_fetcher.RateLimitError(
+          '/lists/ownerships.json', 300)):
+      response = self.testapp.get(
+          '/tasks/update_lists_rate_limited?fake_data=true')
+    self.assertEqual(200, response.status_int)
+
+    # The update is tried again once the window resets.
+    self.assertEquals([mock.call(
+        url='/tasks/update_lists_rate_limited?fake_data=true', method='GET',
+        queue_name='list-lists', countdown=300)], mock_add_queue.mock_calls)
+
   def testUpdateLists_withSavedListNoUpdate(self):
     # Return one list from the API, and store it.
     self.SetJsonResponse('{"lists": [{"id_str": "1234"}]}')
@@ -322,11 +342,154 @@ class CrawlListsTest(web_test_base.WebTestBase):
     self.assertEqual(200, response.status_int)
     self.assertTweetDbContents(['1'], '123')
 
+  def testCrawlList_advancesCrawlCursor(self):
+    self.SetTimelineResponse([self.CreateTweet(10, ('bob', 2)),
+        self.CreateTweet(9, ('bob', 2))])
+    response = self.testapp.get('/tasks/crawl_list?list_id=123')
+    self.assertEqual(200, response.status_int)
+
+    cursor = crawl_lists.crawl_cursor_key('123').get()
+    self.assertEquals(10L, cursor.newest_id)
+    self.assertEquals(9L, cursor.oldest_id)
+
+    # Ids are compared as integers, so the next crawl starts after 10.
+    json_obj = json.loads('[%s]' % ','.join([
+        self.CreateTweet(11, ('bob', 2)).ToJsonString(),
+        self.CreateTweet(10, ('bob', 2)).ToJsonString()]))
+    with mock.patch.object(twitter_fetcher.TwitterFetcher, 'ListStatuses',
+        autospec=True, return_value=json_obj) as mock_fetch:
+      response = self.testapp.get('/tasks/crawl_list?list_id=123')
+    self.assertEqual(200, response.status_int)
+    self.assertEquals(9L, mock_fetch.call_args[1]['since_id'])
+    self.assertEquals(11L, crawl_lists.CrawlCursor.Lookup('123').newest_id)
+
+  @mock.patch.object(crawl_lists, 'STREAM_LIST_STATUSES', True)
+  @mock.patch.object(crawl_lists, 'STREAM_BATCH_SIZE', 2)
+  def testCrawlList_stream(self):
+    """Verify a streamed page is ingested in batches."""
+    self.SetTimelineResponse([self.CreateTweet(12, ('bob', 2)),
+        self.CreateTweet(11, ('alice', 3)),
+        self.CreateTweet(10, ('bob', 2))])
+    with mock.patch.object(crawl_lists.CrawlListHandler,
+        'UpdateTweetDbWithNewTweets', autospec=True,
+        side_effect=crawl_lists.CrawlListHandler.UpdateTweetDbWithNewTweets
+        ) as mock_update:
+      response = self.testapp.get('/tasks/crawl_list?list_id=123')
+    self.assertEqual(200, response.status_int)
+
+    self.assertEquals([2, 1],
+        [len(c[1][1]) for c in mock_update.mock_calls])
+    self.assertTweetDbContents(['10', '11', '12'], '123')
+    cursor = crawl_lists.crawl_cursor_key('123').get()
+    self.assertEquals((12L, 10L), (cursor.newest_id, cursor.oldest_id))
+
+  def testCrawlCursor(self):
+    self.assertEquals(None, crawl_lists.CrawlCursor.Lookup('123'))
+
+    crawl_lists.CrawlCursor.Advance('123', 20L, 10L)
+    crawl_lists.CrawlCursor.Advance('123', 15L, 5L)
+    crawl_lists.CrawlCursor.Advance('123', 30L, 25L)
+
+    # Served from memcache.
+    cursor = crawl_lists.CrawlCursor.Lookup('123')
+    self.assertEquals((30L, 5L), (cursor.newest_id, cursor.oldest_id))
+
+    # Served from the datastore.
+    memcache.flush_all()
+    cursor = crawl_lists.CrawlCursor.Lookup('123')
+    self.assertEquals((30L, 5L), (cursor.newest_id, cursor.oldest_id))
+
+    crawl_lists.DeleteAllCrawlCursors()
+    self.assertEquals(None, crawl_lists.CrawlCursor.Lookup('123'))
+
+  def _NewTweetIds(self, num):
+    """Returns ids of tweets created after the seen tweet ids are rebuilt."""
+    base = tweets.TweetIdAt(datetime.utcnow() + timedelta(days=1))
+    return [str(base + i) for i in range(num)]
+
+  @mock.patch.object(crawl_lists, 'SEEN_TWEETS_PER_GENERATION', 2)
+  def testSeenTweetIds(self):
+    ids = self._NewTweetIds(11)
+    seen_ids = crawl_lists.SeenTweetIds.Lookup()
+    self.assertTrue(seen_ids.IsNew(ids[5]))
+
+    crawl_lists.SeenTweetIds.AddToMemcache([ids[5], ids[6]])
+    seen_ids = crawl_lists.SeenTweetIds.Lookup()
+    self.assertFalse(seen_ids.IsNew(ids[5]))
+    self.assertFalse(seen_ids.IsNew(ids[6]))
+    self.assertTrue(seen_ids.IsNew(ids[7]))
+
+    # Once the oldest generation is dropped its ids are no longer new.
+    crawl_lists.SeenTweetIds.AddToMemcache([ids[8], ids[9], ids[3], ids[4]])
+    seen_ids = crawl_lists.SeenTweetIds.Lookup()
+    self.assertEquals(long(ids[6]), seen_ids.floor_id)
+    self.assertFalse(seen_ids.IsNew(ids[5]))
+    self.assertFalse(seen_ids.IsNew(ids[4]))
+    self.assertTrue(seen_ids.IsNew(ids[10]))
+
+  def testSeenTweetIds_rebuild(self):
+    now = datetime.utcnow()
+    self.CreateTweet(tweets.TweetIdAt(now), ('bob', 2), created_at=now,
+        list_id='456').put()
+
+    # Every tweet stored before the rebuild, from any list, may be seen, even
+    # if queries don't return it yet.
+    seen_ids = crawl_lists.SeenTweetIds.Rebuild(now=now)
+    self.assertEquals(tweets.TweetIdAt(
+      now + crawl_lists.SEEN_TWEETS_REBUILD_MARGIN), seen_ids.floor_id)
+    self.assertFalse(seen_ids.IsNew(str(tweets.TweetIdAt(now))))
+    self.assertTrue(seen_ids.IsNew(str(
+      tweets.TweetIdAt(now + timedelta(hours=1)))))
+
+    # Kept in memcache until crawl cursors are reset.
+    floor_id = crawl_lists.SeenTweetIds.Lookup().floor_id
+    self.assertEquals(floor_id, crawl_lists.SeenTweetIds.Lookup().floor_id)
+    crawl_lists.CrawlCursor.Advance('123', 3L, 1L)
+    crawl_lists.DeleteAllCrawlCursors()
+    self.assertEquals(None, memcache.get(crawl_lists.SEEN_TWEETS_KEY,
+      namespace=crawl_lists.LISTS_LATEST_NAMESPACE))
+
+  def testCrawlList_keepsTweetFromOtherList(self):
+    """Verify a tweet stored from another list is not overwritten."""
+    self.SetTimelineResponse([self.CreateTweet(4, ('alice', 3))])
+    self.testapp.get('/tasks/crawl_list?list_id=456')
+    date_added = tweets.tweet_entity_key('4').get().date_added
+
+    self.SetTimelineResponse([self.CreateTweet(7, ('alice', 3)),
+      self.CreateTweet(4, ('alice', 3))])
+    response = self.testapp.get('/tasks/crawl_list?list_id=123')
+    self.assertEqual(200, response.status_int)
+
+    twt = tweets.tweet_entity_key('4').get()
+    self.assertEquals('456', twt.from_list)
+    self.assertEquals(date_added, twt.date_added)
+    self.assertEquals('123', tweets.tweet_entity_key('7').get().from_list)
+
+  def testCrawlList_onlyLooksUpSeenTweets(self):
+    """Verify tweets known to be new are written without a lookup."""
+    id_1, id_4, id_7 = self._NewTweetIds(3)
+    self.SetTimelineResponse([self.CreateTweet(id_4, ('alice', 3)),
+      self.CreateTweet(id_1, ('bob', 2))])
+    self.testapp.get('/tasks/crawl_list?list_id=123')
+
+    self.SetTimelineResponse([self.CreateTweet(id_7, ('alice', 3)),
+      self.CreateTweet(id_4, ('alice', 3))])
+    with mock.patch.object(ndb, 'get_multi', wraps=ndb.get_multi) as mock_get:
+      response = self.testapp.get('/tasks/crawl_list?list_id=123')
+    self.assertEqual(200, response.status_int)
+
+    tweet_keys = [k for call in mock_get.call_args_list for k in call[0][0]
+        if k.kind() == 'Tweet']
+    self.assertEquals([tweets.tweet_entity_key(id_4)], tweet_keys)
+    self.assertTweetDbContents([id_1, id_4, id_7], '123')
+    self.assertFalse(crawl_lists.SeenTweetIds.Lookup().IsNew(id_7))
+
   def testCrawlList_noId(self):
     response = self.testapp.get('/tasks/crawl_list')
     self.assertEqual(200, response.status_int)
     self.assertEqual('No list name specified', response.body)
 
+  @mock.patch.object(crawl_lists, 'CRAWL_TIME_BUDGET_SECS', 0)
   @mock.patch.object(taskqueue, 'add')
   def testCrawlList_enqueueMore(self, mock_add_queue):
     # Crawl one tweet with a small ID.
@@ -358,6 +521,119 @@ class CrawlListsTest(web_test_base.WebTestBase):
         url='/tasks/crawl_list', method='GET',
         params=expected_params, queue_name='list-statuses'))
 
+  @mock.patch.object(taskqueue, 'add')
+  def testCrawlList_crawlMorePagesInRequest(self, mock_add_queue):
+    # Crawl one tweet with a small ID.
+    self.SetTimelineResponse(self.CreateTweet(3, ('alice', 2)))
+    response = self.testapp.get('/tasks/crawl_list?list_id=123')
+    self.assertEqual(200, response.status_int)
+
+    # The second page reaches the tweet that was already crawled.
+    self.SetTimelineResponses([
+        [self.CreateTweet(12, ('alice', 2)), self.CreateTweet(10, ('alice', 2))],
+        [self.CreateTweet(10, ('alice', 2)), self.CreateTweet(8, ('alice', 2))],
+        [self.CreateTweet(8, ('alice', 2)), self.CreateTweet(3, ('alice', 2))],
+    ])
+    response = self.testapp.get('/tasks/crawl_list?list_id=123')
+    self.assertEqual(200, response.status_int)
+    self.assertTweetDbContents(['12', '10', '8', '3'], '123')
+    self.assertEquals([], self.return_content)
+
+    # Nothing was left to crawl in another task.
+    calls = mock_add_queue.mock_calls
+    self.assertEquals(0, len(calls))
+
+  def testListStatusesPager_timeBudget(self):
+    """Verify the pager stops and enqueues a task when out of time."""
+    crawl_state = crawl_lists.CrawlState('123', 0L, 0L, 0L, 2L, 3L)
+    pages = [
+        [{'id_str': '12'}, {'id_str': '10'}],
+        [{'id_str': '9'}, {'id_str': '8'}],
+        [{'id_str': '7'}, {'id_str': '6'}],
+    ]
+    fetcher = mock.Mock()
+    fetcher.ListStatuses.side_effect = pages
+    times = [100.0, 101.0, 130.0]
+    pager = crawl_lists.ListStatusesPager(fetcher, crawl_state,
+        time_budget_secs=30, clock=lambda: times.pop(0))
+
+    with mock.patch.object(taskqueue, 'add') as mock_add_queue:
+      self.assertEquals(pages[:2], list(pager.Pages()))
+
+    self.assertEquals([
+        mock.call('123', count=2L, since_id=2L, max_id=0L, fake_data=False),
+        mock.call('123', count=2L, since_id=2L, max_id=10L, fake_data=False),
+    ], fetcher.ListStatuses.mock_calls)
+    self.assertEquals(mock_add_queue.mock_calls, [mock.call(
+        url='/tasks/crawl_list', method='GET', params={
+          'list_id': '123',
+          'total_crawled': 4L,
+          'max_id': 8L,
+          'since_id': 3L,
+          'num_to_crawl': 2L,
+          'total_requests_made': 2L,
+        }, queue_name='list-statuses')])
+
+  def testListStatusesPager_stream(self):
+    """Verify streamed pages are counted as they are consumed."""
+    crawl_state = crawl_lists.CrawlState('123', 0L, 0L, 0L, 2L, 3L)
+    pages = [
+        iter([{'id_str': '12'}, {'id_str': '10'}]),
+        iter([{'id_str': '9'}]),
+    ]
+    fetcher = mock.Mock()
+    fetcher.ListStatuses.side_effect = pages
+    pager = crawl_lists.ListStatusesPager(fetcher, crawl_state, stream=True)
+
+    batches = []
+    for page in pager.Pages():
+      batches.extend(page.Batches(1))
+    self.assertEquals([[{'id_str': '12'}], [{'id_str': '10'}],
+      [{'id_str': '9'}]], batches)
+
+    # The second page was requested from the oldest status of the first.
+    self.assertEquals([
+        mock.call('123', count=2L, since_id=2L, max_id=0L, fake_data=False,
+          stream=True),
+        mock.call('123', count=2L, since_id=2L, max_id=10L, fake_data=False,
+          stream=True),
+    ], fetcher.ListStatuses.mock_calls)
+    self.assertEquals(3L, crawl_state.total_crawled)
+
+  def testListStatusesPager_rateLimited(self):
+    """Verify the pager delays the rest of the crawl until the window resets."""
+    crawl_state = crawl_lists.CrawlState('123', 0L, 0L, 0L, 2L, 3L)
+    fetcher = mock.Mock()
+    fetcher.ListStatuses.side_effect = [
+        [{'id_str': '12'}, {'id_str': '10'}],
+        twitter_fetcher.RateLimitError('/lists/statuses.json', 120),
+    ]
+    pager = crawl_lists.ListStatusesPager(fetcher, crawl_state,
+        time_budget_secs=30, clock=lambda: 100.0)
+
+    with mock.patch.object(taskqueue, 'add') as mock_add_queue:
+      self.assertEquals(1, len(list(pager.Pages())))
+
+    self.assertEquals(mock_add_queue.mock_calls, [mock.call(
+        url='/tasks/crawl_list', method='GET', params={
+          'list_id': '123',
+          'total_crawled': 2L,
+          'max_id': 10L,
+          'since_id': 3L,
+          'num_to_crawl': 2L,
+          'total_requests_made': 1L,
+        }, queue_name='list-statuses', countdown=120)])
+
+    # A new crawl which is rate limited is left to the next scheduled crawl.
+    crawl_state = crawl_lists.CrawlState('123', 0L, 0L, 0L, 2L, 3L)
+    fetcher.ListStatuses.side_effect = twitter_fetcher.RateLimitError(
+        '/lists/statuses.json', 120)
+    pager = crawl_lists.ListStatusesPager(fetcher, crawl_state)
+    with mock.patch.object(taskqueue, 'add') as mock_add_queue:
+      self.assertRaises(twitter_fetcher.RateLimitError, list, pager.Pages())
+    self.assertFalse(mock_add_queue.called)
+
+  @mock.patch.object(crawl_lists, 'CRAWL_TIME_BUDGET_SECS', 0)
   @mock.patch.object(taskqueue, 'add')
   def testCrawlList_simulateCrawlFollowUp(self, mock_add_queue):
     # Crawl one tweet with a small ID.
@@ -404,6 +680,7 @@ class CrawlListsTest(web_test_base.WebTestBase):
     calls = mock_add_queue.mock_calls
     self.assertEquals(0, len(calls))
 
+  @mock.patch.object(crawl_lists, 'CRAWL_TIME_BUDGET_SECS', 0)
   @mock.patch.object(taskqueue, 'add')
   def testCrawlList_stopBackfillOnlyOneCrawled(self, mock_add_queue):
     # Crawl one tweet with a small ID.
@@ -473,6 +750,7 @@ class CrawlListsTest(web_test_base.WebTestBase):
     calls = mock_add_queue.mock_calls
     self.assertEquals(0, len(calls))
 
+  @mock.patch.object(crawl_lists, 'CRAWL_TIME_BUDGET_SECS', 0)
   @mock.patch.object(taskqueue, 'add')
   def testCrawlList_simulateCrawlFollowUpEnqueueAnother(self, mock_add_queue):
     # Crawl one tweet with a recent ID which is after the ID that
@@ -528,6 +806,91 @@ class CrawlListsTest(web_test_base.WebTestBase):
         url='/tasks/crawl_list', method='GET',
         params={'list_id': '87', 'fake_data': ''}, queue_name='list-statuses'))
 
+  @mock.patch.object(taskqueue, 'add')
+  def testCrawlDueLists(self, mock_add_queue):
+    self.SetJsonResponse('{"lists": [{"id_str": "1234"}, {"id_str": "87"}]}')
+    self.testapp.get('/tasks/update_lists_rate_limited')
+
+    # Every list is due the first time.
+    response = self.testapp.get('/tasks/crawl_due_lists')
+    self.assertEqual(200, response.status_int)
+    calls = mock_add_queue.mock_calls
+    self.assertEquals(calls, [
+      mock.call(url='/tasks/crawl_list', method='GET',
+        params={'list_id': '1234', 'fake_data': ''},
+        queue_name='list-statuses'),
+      mock.call(url='/tasks/crawl_list', method='GET',
+        params={'list_id': '87', 'fake_data': ''},
+        queue_name='list-statuses'),
+    ])
+
+    # Neither list has had any tweets, so neither is due again yet.
+    mock_add_queue.reset_mock()
+    response = self.testapp.get('/tasks/crawl_due_lists')
+    self.assertEqual(200, response.status_int)
+    self.assertFalse(mock_add_queue.called)
+
+  @mock.patch.object(crawl_lists, 'LIST_CRAWL_MODE',
+      crawl_lists.CRAWL_LISTS_CONCURRENTLY)
+  @mock.patch.object(taskqueue, 'add')
+  def testCrawlDueLists_concurrently(self, mock_add_queue):
+    self.SetJsonResponse('{"lists": [{"id_str": "1234"}, {"id_str": "87"}]}')
+    self.testapp.get('/tasks/update_lists_rate_limited')
+
+    response = self.testapp.get('/tasks/crawl_due_lists')
+    self.assertEqual(200, response.status_int)
+    self.assertEquals(mock_add_queue.mock_calls, [
+      mock.call(url='/tasks/crawl_lists', method='GET',
+        params={'list_ids': '1234,87', 'fake_data': ''},
+        queue_name='list-statuses'),
+    ])
+
+  def testCrawlLists(self):
+    """Verify each list crawled concurrently is ingested on its own."""
+    pages = {
+        '1234': [self.CreateTweet(5, ('alice', 2))],
+        '87': [self.CreateTweet(4, ('bob', 3)), self.CreateTweet(3, ('bob', 3))],
+    }
+    fetched_list_ids = []
+
+    # The fetches may run in any order, so respond based on the list id.
+    def _FakeFetch(url, payload, method, headers, request, response,
+        follow_redirects=True, deadline=urlfetch_stub._API_CALL_DEADLINE,
+        validate_certificate=urlfetch_stub._API_CALL_VALIDATE_CERTIFICATE_DEFAULT):
+      params = urlparse.parse_qs(urlparse.urlparse(url).query)
+      list_id = params['list_id'][0]
+      fetched_list_ids.append(list_id)
+      response.set_statuscode(200)
+      response.set_content('[%s]' % ','.join(
+        [t.ToJsonString() for t in pages[list_id]]))
+    self.url_fetch_stub._RetrieveURL = _FakeFetch
+
+    response = self.testapp.get('/tasks/crawl_lists?list_ids=1234,87')
+    self.assertEqual(200, response.status_int)
+    self.assertEqual(['1234', '87'], sorted(fetched_list_ids))
+    self.assertTweetDbSize(3)
+    self.assertEqual('1234', tweets.tweet_key('5').get().from_list)
+    self.assertEqual('87', tweets.tweet_key('3').get().from_list)
+    self.assertEqual(5L, crawl_lists.CrawlCursor.Lookup('1234').newest_id)
+    self.assertEqual(4L, crawl_lists.CrawlCursor.Lookup('87').newest_id)
+
+    response = self.testapp.get('/tasks/crawl_lists')
+    self.assertEqual('No lists specified', response.body)
+
+  def testCrawlList_recordsTweetRate(self):
+    self.SetTimelineResponse([self.CreateTweet(5, ('alice', 2)),
+      self.CreateTweet(3, ('alice', 2))])
+    self.testapp.get('/tasks/crawl_list?list_id=123')
+    stats = crawl_planner.list_crawl_stats_key('123').get()
+    self.assertTrue(stats.tweet_count > 0)
+
+    # The newest tweet of the last crawl is returned again but not counted.
+    tweet_count = stats.tweet_count
+    self.SetTimelineResponse([self.CreateTweet(5, ('alice', 2))])
+    self.testapp.get('/tasks/crawl_list?list_id=123')
+    stats = crawl_planner.list_crawl_stats_key('123').get()
+    self.assertTrue(stats.tweet_count <= tweet_count)
+
   def testCrawlAllUsers_noUsers(self):
     """Ensure crawl_all_users handles case when there are no users."""
     response = self.testapp.get('/tasks/crawl_all_lists')
@@ -575,6 +938,19 @@ class CrawlListsTest(web_test_base.WebTestBase):
         params={'user_id': '%s' % (num_users + offset - 1)},
         queue_name='lookup-users'))
     
+  @mock.patch.object(taskqueue, 'add')
+  def testCrawlUsers_rateLimited(self, mock_add_queue):
+    with mock.patch.object(twitter_fetcher.TwitterFetcher, 'LookupUsers',
+        side_effect=twitter_fetcher.RateLimitError('/users/lookup.json', 120)):
+      response = self.testapp.post('/tasks/crawl_users',
+          params={'user_id': '1,2'})
+    self.assertEqual(200, response.status_int)
+
+    # The same users are looked up once the window resets.
+    self.assertEquals([mock.call(url='/tasks/crawl_users', method='POST',
+        params={'user_id': '1,2'}, queue_name='lookup-users', countdown=120)],
+        mock_add_queue.mock_calls)
+
   @mock.patch.object(taskqueue, 'add')
   def testCrawlUsers_newScreenName(self, mock_add_queue):
     """Ensure crawl_users updates screen_names if they have changed."""
@@ -598,6 +974,105 @@ class CrawlListsTest(web_test_base.WebTestBase):
     users = tweets.User.query().fetch()
     self.assertEquals('bob', users[0].screen_name)
 
+  def testUpdateUsers_dedupesUsers(self):
+    """Ensure a user in a batch many times is only written once."""
+    user = self.CreateUser(3, 'alice', profile_url_https='old')
+    user.screen_name = 'Alice'
+    user.put()
+
+    json_users = [
+        {'id_str': '3', 'id': 3, 'screen_name': 'alice',
+         'profile_image_url_https': 'newest'},
+        {'id_str': '3', 'id': 3, 'screen_name': 'alice',
+         'profile_image_url_https': 'older'},
+        {'id_str': '4', 'id': 4, 'screen_name': 'Bob'},
+        {},
+    ]
+    user_map = {}
+    crawl_lists.UpdateUsers(json_users, user_map)
+
+    self.assertUserDbContents(['3', '4'])
+    self.assertEquals(['3', '4'], sorted(user_map.keys()))
+
+    # The most recent profile of each user is the one stored.
+    alice = tweets.user_entity_key('3').get()
+    self.assertEquals('newest', alice.profile_image_url_https)
+    self.assertEquals('alice', alice.screen_name)
+    self.assertEquals('bob', tweets.user_entity_key('4').get().screen_name)
+
+  def testTeamResolver(self):
+    """Verify authors and mentions are resolved once and memoized."""
+    bob = self.CreateUser(2, 'bob')
+    bob.from_list = list_id_bimap.ListIdBiMap.USAU_COLLEGE_WOMENS_LIST_ID
+    bob.put()
+    alice = self.CreateUser(3, 'alice')
+
+    twt = self.CreateTweet(1, ('bob', 2))
+    twt.entities.user_mentions = [
+        tweets.UserMentionEntity(user_id='3', user_id_64=3),
+        tweets.UserMentionEntity(user_id='4', user_id_64=4)]
+
+    team_resolver = crawl_lists.TeamResolver({'3': alice})
+    team_resolver.Prefetch([None, twt])
+
+    # Changes to the db after the prefetch are not seen by the resolver.
+    bob.key.delete()
+    self.CreateUser(4, 'eve').put()
+
+    team, div, league, ab = team_resolver.Resolve('2')
+    self.assertEquals(2, team.twitter_id)
+    self.assertEquals(Division.WOMENS, div)
+    self.assertEquals(League.USAU, league)
+    self.assertEquals(AgeBracket.COLLEGE, ab)
+    self.assertEquals(3, team_resolver.Resolve('3')[0].twitter_id)
+    self.assertEquals(crawl_lists.UNKNOWN_SR_ID,
+        team_resolver.Resolve('4')[0].score_reporter_id)
+
+    # Ids not in the prefetched tweets are looked up on demand.
+    self.assertEquals(4, crawl_lists.TeamResolver().Resolve('4')[0].twitter_id)
+    self.assertEquals(crawl_lists.UNKNOWN_SR_ID,
+        team_resolver.Resolve('')[0].score_reporter_id)
+
+  def testGameIndex(self):
+    """Verify candidate games are found by team and time window."""
+    now = datetime.utcnow()
+    twt = self.CreateTweet(1, ('bob', 2), created_at=now)
+    max_length = timedelta(hours=crawl_lists.MAX_LENGTH_OF_GAME_IN_HOURS)
+
+    def _CreateGame(twitter_ids, last_modified_at, start_time=None):
+      return Game(teams=[Team(twitter_id=t) for t in twitter_ids],
+          last_modified_at=last_modified_at, start_time=start_time)
+
+    recent = _CreateGame([3, 2], now - timedelta(hours=1))
+    other_team = _CreateGame([3, 4], now)
+    too_old = _CreateGame([2], now - max_length)
+    too_new = _CreateGame([2], now + max_length)
+    # The start time is used if it is after the last modification.
+    starting_soon = _CreateGame([2], now - timedelta(weeks=1),
+        start_time=now + timedelta(hours=1))
+    game_index = crawl_lists.GameIndex(
+        [starting_soon, recent, other_team, too_old, too_new])
+
+    teams = [Team(twitter_id=2),
+        Team(score_reporter_id=crawl_lists.UNKNOWN_SR_ID)]
+    self.assertEquals([starting_soon, recent],
+        game_index.Candidates(twt, teams))
+    self.assertEquals([starting_soon, recent, other_team],
+        game_index.Candidates(twt, [Team(twitter_id=2), Team(twitter_id=3)]))
+
+    # Games added later and teams merged into indexed games are found too.
+    added = _CreateGame([5], now)
+    game_index.AddGame(added)
+    other_team.teams[1] = Team(twitter_id=5)
+    game_index.AddGame(other_team)
+    self.assertEquals([other_team, added],
+        game_index.Candidates(twt, [Team(twitter_id=5)]))
+
+    # Teams which were replaced are no longer indexed.
+    self.assertEquals([other_team],
+        game_index.Candidates(twt, [Team(twitter_id=4)]))
+    self.assertEquals([], game_index.Candidates(twt, [Team(twitter_id=6)]))
+
   @mock.patch.object(taskqueue, 'add')
   def testUpdateLists_cronEntryPoint(self, mock_add_queue):
     response = self.testapp.get('/tasks/update_lists')
@@ -618,7 +1093,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
 
     crawl_lists_handler = crawl_lists.CrawlListHandler()
     twt = self.CreateTweet(1, ('bob', 2))
-    teams = crawl_lists_handler._FindTeamsInTweet(twt, {})
+    teams = crawl_lists_handler._FindTeamsInTweet(twt,
+        crawl_lists.TeamResolver())
 
     # Make sure we found 'bob' correctly.
     self.assertEquals(2, teams[0].twitter_id)
@@ -633,7 +1109,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
 
     crawl_lists_handler = crawl_lists.CrawlListHandler()
     twt = self.CreateTweet(1, ('bob', 2))
-    teams = crawl_lists_handler._FindTeamsInTweet(twt, user_db)
+    teams = crawl_lists_handler._FindTeamsInTweet(twt,
+        crawl_lists.TeamResolver(user_db))
 
     # Make sure we found 'bob' correctly.
     self.assertEquals(2, teams[0].twitter_id)
@@ -651,7 +1128,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
     twt = self.CreateTweet(1, ('bob', 2))
     twt.entities.user_mentions = [tweets.UserMentionEntity(
       user_id='3', user_id_64=3)]
-    teams = crawl_lists_handler._FindTeamsInTweet(twt, user_db)
+    teams = crawl_lists_handler._FindTeamsInTweet(twt,
+        crawl_lists.TeamResolver(user_db))
 
     # Make sure we found 'bob' correctly.
     self.assertEquals(2, teams[0].twitter_id)
@@ -671,7 +1149,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
     twt = self.CreateTweet(1, ('bob', 2))
     twt.entities.user_mentions = [tweets.UserMentionEntity(
       user_id='3', user_id_64=3)]
-    teams = crawl_lists_handler._FindTeamsInTweet(twt, user_db)
+    teams = crawl_lists_handler._FindTeamsInTweet(twt,
+        crawl_lists.TeamResolver(user_db))
 
     # Make sure we found 'bob' correctly.
     self.assertEquals(2, teams[0].twitter_id)
@@ -681,7 +1160,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
     """Handle the case gracefully if the user doesn't exist in db."""
     crawl_lists_handler = crawl_lists.CrawlListHandler()
     twt = self.CreateTweet(1, ('bob', 2))
-    teams = crawl_lists_handler._FindTeamsInTweet(twt, {})
+    teams = crawl_lists_handler._FindTeamsInTweet(twt,
+        crawl_lists.TeamResolver())
 
     self.assertEquals(None, teams[0].twitter_id)
     self.assertEquals(None, teams[1].twitter_id)
@@ -690,9 +1170,11 @@ class CrawlListsTest(web_test_base.WebTestBase):
     """Verify that it doesn't find any consistent games if none exist."""
     crawl_lists_handler = crawl_lists.CrawlListHandler()
     twt = self.CreateTweet(1, ('bob', 2))
-    teams = crawl_lists_handler._FindTeamsInTweet(twt, {})
+    teams = crawl_lists_handler._FindTeamsInTweet(twt,
+        crawl_lists.TeamResolver())
     scores = [0, 0]
-    (score, game) = crawl_lists_handler._FindMostConsistentGame(twt, [],
+    (score, game) = crawl_lists_handler._FindMostConsistentGame(twt,
+        crawl_lists.GameIndex(),
         teams, Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU, scores)
 
     self.assertEquals(0.0, score)
@@ -707,7 +1189,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
     twt = self.CreateTweet(1, ('bob', 2), created_at=now)
 
     # The first team will be 'bob'
-    teams = crawl_lists_handler._FindTeamsInTweet(twt, {'2': user})
+    teams = crawl_lists_handler._FindTeamsInTweet(twt,
+        crawl_lists.TeamResolver({'2': user}))
 
     source = GameSource(type=GameSourceType.TWITTER,
         home_score=5, away_score=7,
@@ -720,7 +1203,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
     # Score has to be a plausible update to the game.
     scores = [6, 7]
 
-    (score, found_game) = crawl_lists_handler._FindMostConsistentGame(twt, [game],
+    (score, found_game) = crawl_lists_handler._FindMostConsistentGame(twt,
+        crawl_lists.GameIndex([game]),
         teams, Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU, scores)
 
     # Score should be high since the time of the Tweet is close to the game.
@@ -736,7 +1220,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
     twt = self.CreateTweet(1, ('bob', 2), created_at=now)
 
     # The first team will be 'bob'
-    teams = crawl_lists_handler._FindTeamsInTweet(twt, {'2': user})
+    teams = crawl_lists_handler._FindTeamsInTweet(twt,
+        crawl_lists.TeamResolver({'2': user}))
 
     # Simulate that this is a game crawled by score reporter weeks ago.
     score_crawl_time = now - timedelta(weeks=5)
@@ -752,7 +1237,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
     # Score has to be a plausible update to the game.
     scores = [2, 3]
 
-    (score, found_game) = crawl_lists_handler._FindMostConsistentGame(twt, [game],
+    (score, found_game) = crawl_lists_handler._FindMostConsistentGame(twt,
+        crawl_lists.GameIndex([game]),
         teams, Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU, scores)
 
     # Score should be high since the time of the Tweet is close to the game.
@@ -768,7 +1254,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
     twt = self.CreateTweet(1, ('bob', 2), created_at=now)
 
     # The first team will be 'bob'
-    teams = crawl_lists_handler._FindTeamsInTweet(twt, {'2': user})
+    teams = crawl_lists_handler._FindTeamsInTweet(twt,
+        crawl_lists.TeamResolver({'2': user}))
 
     source = GameSource(type=GameSourceType.TWITTER,
         update_date_time=now - timedelta(minutes=5))
@@ -779,7 +1266,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
         sources=[source])
 
     scores = [6, 7]
-    (score, found_game) = crawl_lists_handler._FindMostConsistentGame(twt, [game],
+    (score, found_game) = crawl_lists_handler._FindMostConsistentGame(twt,
+        crawl_lists.GameIndex([game]),
         teams, Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU, scores)
 
     self.assertEqual(0.0, score)
@@ -799,12 +1287,14 @@ class CrawlListsTest(web_test_base.WebTestBase):
     twt = self.CreateTweet(1, ('alice', 3), created_at=now)
 
     # The first team will be 'alice', 2nd will be unknown.
-    twt_teams = crawl_lists_handler._FindTeamsInTweet(twt, {})
+    twt_teams = crawl_lists_handler._FindTeamsInTweet(twt,
+        crawl_lists.TeamResolver())
 
     twt = self.CreateTweet(2, ('bob', 2), created_at=now)
 
     # The first team will be 'bob', 2nd will be unknown.
-    game_teams = crawl_lists_handler._FindTeamsInTweet(twt, {})
+    game_teams = crawl_lists_handler._FindTeamsInTweet(twt,
+        crawl_lists.TeamResolver())
 
     # Create a game with 'bob' in that division, age_bracket, and league
     game = Game(id_str='new game', teams=game_teams, scores=[5, 7],
@@ -814,7 +1304,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
     # When we try to find a game that's consistent with the 'alice' teams
     # it fails because the only known game has 'bob' and an unknown team.
     scores = [0, 0]
-    (score, found_game) = crawl_lists_handler._FindMostConsistentGame(twt, [game],
+    (score, found_game) = crawl_lists_handler._FindMostConsistentGame(twt,
+        crawl_lists.GameIndex([game]),
         twt_teams, Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU,
         scores)
 
@@ -831,7 +1322,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
     twt = self.CreateTweet(1, ('bob', 2), created_at=now)
 
     # The first team will be 'bob'
-    teams = crawl_lists_handler._FindTeamsInTweet(twt, {})
+    teams = crawl_lists_handler._FindTeamsInTweet(twt,
+        crawl_lists.TeamResolver())
 
     # Create a game with 'bob' in that division, age_bracket, and league, but with
     # an old date.
@@ -843,7 +1335,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
         last_modified_at=creation_date)
 
     scores = [0, 0]
-    (score, found_game) = crawl_lists_handler._FindMostConsistentGame(twt, [game],
+    (score, found_game) = crawl_lists_handler._FindMostConsistentGame(twt,
+        crawl_lists.GameIndex([game]),
         teams, Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU, scores)
 
     self.assertEquals(0.0, score)
@@ -883,7 +1376,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
     teams = [Team(twitter_id=3), Team(twitter_id=4)]
     creation_date = now
     scores = [13, 5]
-    (score, found_game) = crawl_lists_handler._FindMostConsistentGame(twt, [game],
+    (score, found_game) = crawl_lists_handler._FindMostConsistentGame(twt,
+        crawl_lists.GameIndex([game]),
         teams, Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU, scores)
 
     self.assertEquals(0.0, score)
@@ -898,7 +1392,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
     twt = self.CreateTweet(1, ('bob', 2), created_at=now)
 
     # The first team will be 'bob'
-    teams = crawl_lists_handler._FindTeamsInTweet(twt, {'2': user})
+    teams = crawl_lists_handler._FindTeamsInTweet(twt,
+        crawl_lists.TeamResolver({'2': user}))
 
     source = GameSource(type=GameSourceType.TWITTER,
       home_score=15, away_score=12,
@@ -911,7 +1406,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
     # Score is from a new game, apparently.
     scores = [1, 0]
 
-    (score, found_game) = crawl_lists_handler._FindMostConsistentGame(twt, [game],
+    (score, found_game) = crawl_lists_handler._FindMostConsistentGame(twt,
+        crawl_lists.GameIndex([game]),
         teams, Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU, scores)
 
     self.assertEquals(0.0, score)
@@ -963,9 +1459,10 @@ class CrawlListsTest(web_test_base.WebTestBase):
     id = 100
     twt_objs = []
     games = []
-    user_map = {
+    game_index = crawl_lists.GameIndex()
+    team_resolver = crawl_lists.TeamResolver({
         '2': self.CreateUser(2, 'mischief'),
-    }
+    })
     d = Division.MIXED
     a = AgeBracket.NO_RESTRICTION
     l = League.USAU
@@ -973,7 +1470,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
       t = datetime.strptime(date_fmt % twt[1], tweets.DATE_PARSE_FMT_STR)
       twt = self.CreateTweet(id, ('mischief', 2), text=twt[0], created_at=t)
       id -= 1
-      handler._PossiblyAddTweetToGame(twt, [], games, user_map, d, a, l)
+      handler._PossiblyAddTweetToGame(twt, game_index, games, team_resolver,
+          d, a, l)
 
     logging.info(games)
     self.assertEqual(3, len(games))
@@ -1017,35 +1515,114 @@ class CrawlListsTest(web_test_base.WebTestBase):
     self.assertEquals([], crawl_lists_handler._FindScoreIndicies(
       integers, '5         7/9'))
 
+  def testUpdateGames_onlyWritesChangedGames(self):
+    """Verify only games created or changed by the tweets are written."""
+    now = datetime.utcnow()
+    games = []
+    for (id_str, twitter_id) in [('bob game', 2), ('alice game', 3)]:
+      source = GameSource(type=GameSourceType.TWITTER, home_score=3,
+          away_score=5, update_date_time=now, account_id=twitter_id)
+      game = Game(id_str=id_str, teams=[Team(twitter_id=twitter_id),
+            Team(score_reporter_id=crawl_lists.UNKNOWN_SR_ID)],
+          scores=[3, 5], division=Division.OPEN,
+          age_bracket=AgeBracket.NO_RESTRICTION, league=League.USAU,
+          created_at=now, last_modified_at=now, sources=[source])
+      game.put()
+      games.append(game)
+
+    users = {'2': self.CreateUser(2, 'bob'), '4': self.CreateUser(4, 'eve')}
+    twts = [
+        self.CreateTweet(1, ('bob', 2), text='5-7', created_at=now),
+        self.CreateTweet(2, ('eve', 4), text='5-7', created_at=now),
+        self.CreateTweet(3, ('eve', 4), text='no score', created_at=now),
+    ]
+
+    crawl_lists_handler = crawl_lists.CrawlListHandler()
+    with mock.patch.object(crawl_lists.ndb, 'put_multi_async',
+        wraps=crawl_lists.ndb.put_multi_async) as mock_put:
+      crawl_lists_handler.UpdateGames(twts, crawl_lists.GameIndex(games),
+          users, Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU)
+
+    # One batch write with bob's game and the new game for eve.
+    self.assertEquals(1, len(mock_put.mock_calls))
+    written_games = mock_put.call_args[0][0]
+    self.assertEquals(2, len(written_games))
+    self.assertEquals(games[0], written_games[0])
+    self.assertEquals(4, written_games[1].teams[0].twitter_id)
+    self.assertGameDbSize(3)
+
+  def testUpdateGames_reindexesRepairedGame(self):
+    """Verify a later page matches the teams of a repaired game."""
+    now = datetime.utcnow()
+    sources = [GameSource(type=GameSourceType.TWITTER, home_score=3,
+        away_score=5, update_date_time=now, account_id=account_id,
+        tweet_id=tweet_id)
+        for (account_id, tweet_id) in [(2, 10), (2, 11), (4, 12), (4, 13)]]
+    game = Game(id_str='game', teams=[Team(twitter_id=9),
+          Team(score_reporter_id=crawl_lists.UNKNOWN_SR_ID)],
+        scores=[3, 5], division=Division.OPEN,
+        age_bracket=AgeBracket.NO_RESTRICTION, league=League.USAU,
+        created_at=now, last_modified_at=now, sources=sources)
+    game.put()
+    game_index = crawl_lists.GameIndex([game])
+
+    users = {'2': self.CreateUser(2, 'bob'), '4': self.CreateUser(4, 'eve'),
+        '9': self.CreateUser(9, 'carol')}
+    crawl_lists_handler = crawl_lists.CrawlListHandler()
+
+    # The first page matches the game by its stale team, and the teams are
+    # repaired to the two most frequent authors.
+    crawl_lists_handler.UpdateGames(
+        [self.CreateTweet(1, ('carol', 9), text='5-7', created_at=now)],
+        game_index, users, Division.OPEN, AgeBracket.NO_RESTRICTION,
+        League.USAU)
+    self.assertEquals([4, 2], [t.twitter_id for t in game.teams])
+
+    # The second page is matched against the repaired teams.
+    crawl_lists_handler.UpdateGames(
+        [self.CreateTweet(2, ('bob', 2), text='5-7', created_at=now)],
+        game_index, users, Division.OPEN, AgeBracket.NO_RESTRICTION,
+        League.USAU)
+    self.assertGameDbSize(1)
+    self.assertEquals(6, len(game.key.get().sources))
+
   def testPossiblyAddTweetToGame_dontAddTweetCases(self):
     """Sanity test for cases where a game should not be created from a tweet."""
     crawl_lists_handler = crawl_lists.CrawlListHandler()
 
     added_games = []
     # Gracefully handle twt being None.
-    crawl_lists_handler._PossiblyAddTweetToGame(None, [], added_games, {}, None,
+    game = crawl_lists_handler._PossiblyAddTweetToGame(None,
+        crawl_lists.GameIndex(), added_games, crawl_lists.TeamResolver(), None,
         None, None)
+    self.assertEquals(None, game)
     self.assertEquals([], added_games)
 
     # Make a tweet with no integer entities.
     twt = self.CreateTweet(1, ('bob', 2))
     self.assertFalse(twt.two_or_more_integers)
-    crawl_lists_handler._PossiblyAddTweetToGame(twt, [], added_games, {},
+    game = crawl_lists_handler._PossiblyAddTweetToGame(twt,
+        crawl_lists.GameIndex(), added_games, crawl_lists.TeamResolver(),
         Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU)
+    self.assertEquals(None, game)
     self.assertEquals([], added_games)
 
     # Now there are integer entities but they're too big.
     twt = self.CreateTweet(1, ('bob', 2), text='50-55')
     self.assertTrue(twt.two_or_more_integers)
-    crawl_lists_handler._PossiblyAddTweetToGame(twt, [], added_games, {},
+    game = crawl_lists_handler._PossiblyAddTweetToGame(twt,
+        crawl_lists.GameIndex(), added_games, crawl_lists.TeamResolver(),
         Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU)
+    self.assertEquals(None, game)
     self.assertEquals([], added_games)
 
     # There are two numbers but it looks like a date, not a score.
     twt = self.CreateTweet(1, ('bob', 2), text='5/5')
     self.assertTrue(twt.two_or_more_integers)
-    crawl_lists_handler._PossiblyAddTweetToGame(twt, [], added_games, {},
+    game = crawl_lists_handler._PossiblyAddTweetToGame(twt,
+        crawl_lists.GameIndex(), added_games, crawl_lists.TeamResolver(),
         Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU)
+    self.assertEquals(None, game)
     self.assertEquals([], added_games)
 
   def testPossiblyAddTweetToGame_newGame(self):
@@ -1057,9 +1634,10 @@ class CrawlListsTest(web_test_base.WebTestBase):
     self.assertTrue(twt.two_or_more_integers)
 
     added_games = []
-    crawl_lists_handler._PossiblyAddTweetToGame(twt, [], added_games, {},
+    game = crawl_lists_handler._PossiblyAddTweetToGame(twt,
+        crawl_lists.GameIndex(), added_games, crawl_lists.TeamResolver(),
         Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU)
-    self.assertEquals(1, len(added_games))
+    self.assertEquals([game], added_games)
 
   def testPossiblyAddTweetToGame_existingGame(self):
     """Sanity test for cases where a game be updated from a tweet."""
@@ -1072,7 +1650,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
     twt = self.CreateTweet(1, ('bob', 2), created_at=now)
 
     # The first team will be 'bob'
-    teams = crawl_lists_handler._FindTeamsInTweet(twt, {})
+    teams = crawl_lists_handler._FindTeamsInTweet(twt,
+        crawl_lists.TeamResolver())
 
     # Create a game with 'bob' in that division, age_bracket, and league
     source = GameSource(type=GameSourceType.TWITTER,
@@ -1088,10 +1667,12 @@ class CrawlListsTest(web_test_base.WebTestBase):
     self.assertTrue(twt.two_or_more_integers)
 
     # Test case where the source was in an existing game.
-    existing_games = [game]
+    game_index = crawl_lists.GameIndex([game])
     added_games = []
-    crawl_lists_handler._PossiblyAddTweetToGame(twt, existing_games,
-        added_games, {}, Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU)
+    found_game = crawl_lists_handler._PossiblyAddTweetToGame(twt, game_index,
+        added_games, crawl_lists.TeamResolver(), Division.OPEN,
+        AgeBracket.NO_RESTRICTION, League.USAU)
+    self.assertEquals(game, found_game)
     self.assertEquals([], added_games)
     self.assertEquals(sources_length + 1, len(game.sources))
 
@@ -1101,28 +1682,28 @@ class CrawlListsTest(web_test_base.WebTestBase):
 
     # Test case where the source was in an added game.
     sources_length = len(game.sources)
-    existing_games = []
     added_games = [game]
-    crawl_lists_handler._PossiblyAddTweetToGame(twt, existing_games,
-        added_games, {}, Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU)
-    self.assertEquals([], existing_games)
+    game_index = crawl_lists.GameIndex(added_games)
+    crawl_lists_handler._PossiblyAddTweetToGame(twt, game_index,
+        added_games, crawl_lists.TeamResolver(), Division.OPEN,
+        AgeBracket.NO_RESTRICTION, League.USAU)
     self.assertEquals(1, len(added_games))
     self.assertEquals(sources_length + 1, len(game.sources))
 
   def testPossiblyAddTweetToGame_existingGameNewMention(self):
     """Test where a game and its teams should be updated from a tweet."""
-    user_map = {
+    team_resolver = crawl_lists.TeamResolver({
         '2': self.CreateUser(2, 'bob'),
         '3': self.CreateUser(3, 'alice'),
         '4': self.CreateUser(3, 'eve'),
-    }
+    })
 
     now = datetime.utcnow()
     twt = self.CreateTweet(1, ('bob', 2), created_at=now)
 
     # The first team will be 'bob' and the second will be 'unknown'.
     crawl_lists_handler = crawl_lists.CrawlListHandler()
-    teams = crawl_lists_handler._FindTeamsInTweet(twt, user_map)
+    teams = crawl_lists_handler._FindTeamsInTweet(twt, team_resolver)
 
     # Create a game with 'bob' in that division, age_bracket, and league
     source = GameSource(type=GameSourceType.TWITTER,
@@ -1140,10 +1721,10 @@ class CrawlListsTest(web_test_base.WebTestBase):
     self.assertTrue(twt.two_or_more_integers)
 
     # Test case where the source was in an existing game.
-    existing_games = [game]
+    game_index = crawl_lists.GameIndex([game])
     added_games = []
-    crawl_lists_handler._PossiblyAddTweetToGame(twt, existing_games,
-        added_games, user_map, Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU)
+    crawl_lists_handler._PossiblyAddTweetToGame(twt, game_index,
+        added_games, team_resolver, Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU)
     self.assertEquals([], added_games)
     self.assertEquals(sources_length + 1, len(game.sources))
 
@@ -1159,8 +1740,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
 
     # Tweet is added to the game, but the new team is *not* added (see
     # comment in crawl_lists.CrawListsHandler._MergeTeamsIntoGame for why).
-    crawl_lists_handler._PossiblyAddTweetToGame(twt, existing_games,
-        added_games, user_map, Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU)
+    crawl_lists_handler._PossiblyAddTweetToGame(twt, game_index,
+        added_games, team_resolver, Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU)
     self.assertEquals([], added_games)
     self.assertEquals(sources_length + 2, len(game.sources))
 
@@ -1179,7 +1760,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
     twt = self.CreateTweet(1, ('bob', 2), created_at=now)
 
     # The first team will be 'bob'
-    teams = crawl_lists_handler._FindTeamsInTweet(twt, {})
+    teams = crawl_lists_handler._FindTeamsInTweet(twt,
+        crawl_lists.TeamResolver())
 
     # Create a game with 'bob' in that division, age_bracket, and league
     source = GameSource(type=GameSourceType.TWITTER,
@@ -1200,16 +1782,18 @@ class CrawlListsTest(web_test_base.WebTestBase):
     self.assertTrue(twt.two_or_more_integers)
 
     # Test case where the source was in an existing game.
-    existing_games = [game]
+    game_index = crawl_lists.GameIndex([game])
     added_games = []
-    crawl_lists_handler._PossiblyAddTweetToGame(twt, existing_games,
-        added_games, {}, Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU)
+    crawl_lists_handler._PossiblyAddTweetToGame(twt, game_index,
+        added_games, crawl_lists.TeamResolver(), Division.OPEN,
+        AgeBracket.NO_RESTRICTION, League.USAU)
     self.assertEquals([], added_games)
     self.assertEquals(sources_length + 1, len(game.sources))
 
     # Try to add the same tweet to the game again.
-    crawl_lists_handler._PossiblyAddTweetToGame(twt, existing_games,
-        added_games, {}, Division.OPEN, AgeBracket.NO_RESTRICTION, League.USAU)
+    self.assertEquals(None, crawl_lists_handler._PossiblyAddTweetToGame(twt,
+        game_index, added_games, crawl_lists.TeamResolver(), Division.OPEN,
+        AgeBracket.NO_RESTRICTION, League.USAU))
     self.assertEquals([], added_games)
 
     # The sources length should be unchanged
@@ -1331,6 +1915,31 @@ class CrawlListsTest(web_test_base.WebTestBase):
     self.assertEqual(200, response.status_int)
     self.assertGameDbSize(1)
 
+  def testBackfillGames_updateGamesOnly(self):
+    """Verify a backfill with update_games_only repairs the existing games."""
+    list_id = list_id_bimap.ListIdBiMap.USAU_COLLEGE_OPEN_LIST_ID
+    division, age_bracket, league = (
+        list_id_bimap.ListIdBiMap.GetStructuredPropertiesForList(list_id))
+    creation_date = datetime(2015, 2, 28)
+    self.CreateUser(2, 'bob').put()
+    source = GameSource(type=GameSourceType.TWITTER, home_score=5,
+        away_score=7, update_date_time=creation_date, account_id=2,
+        tweet_id=1)
+    game = Game(id_str='game', teams=[Team(twitter_id=9),
+          Team(score_reporter_id=crawl_lists.UNKNOWN_SR_ID)],
+        scores=[5, 7], division=division, age_bracket=age_bracket,
+        league=league, created_at=creation_date,
+        last_modified_at=creation_date, sources=[source])
+    game.put()
+
+    creation_date_str = (creation_date - timedelta(days=3)).strftime('%m/%d/%Y')
+    response = self.testapp.get('/tasks/crawl_list', params={
+      'list_id': list_id, 'backfill_date': creation_date_str,
+      'update_games_only': '1'})
+    self.assertEqual(200, response.status_int)
+    self.assertGameDbSize(1)
+    self.assertEqual(2, game.key.get().teams[0].twitter_id)
+
   def testUpdateGameConsistency(self):
     """Test updating games with only one tweet."""
     # Create game with only one team and one game source.
@@ -1341,12 +1950,14 @@ class CrawlListsTest(web_test_base.WebTestBase):
 
     game.teams = [Team(score_reporter_id=crawl_lists.UNKNOWN_SR_ID)]
     crawl_lists_handler = crawl_lists.CrawlListHandler()
-    crawl_lists_handler._UpdateGameConsistency(game, {})
+    crawl_lists_handler._UpdateGameConsistency(game,
+        crawl_lists.TeamResolver())
     self.assertEqual(2, len(game.teams))
     self.assertEqual(2, game.teams[0].twitter_id)
 
     # Update it again - no changes should have been made.
-    crawl_lists_handler._UpdateGameConsistency(game, {})
+    crawl_lists_handler._UpdateGameConsistency(game,
+        crawl_lists.TeamResolver())
     self.assertEqual(2, len(game.teams))
     self.assertEqual(2, game.teams[0].twitter_id)
 
@@ -1361,7 +1972,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
         Team(score_reporter_id='2'),
     ]
     crawl_lists_handler = crawl_lists.CrawlListHandler()
-    crawl_lists_handler._UpdateGameConsistency(game, {})
+    crawl_lists_handler._UpdateGameConsistency(game,
+        crawl_lists.TeamResolver())
     self.assertEqual(2, len(game.teams))
 
   def testUpdateGameConsistency_srSource(self):
@@ -1371,7 +1983,8 @@ class CrawlListsTest(web_test_base.WebTestBase):
     game.sources = [GameSource(type=GameSourceType.SCORE_REPORTER)]
 
     crawl_lists_handler = crawl_lists.CrawlListHandler()
-    crawl_lists_handler._UpdateGameConsistency(game, {})
+    crawl_lists_handler._UpdateGameConsistency(game,
+        crawl_lists.TeamResolver())
 
     # It doesn't do anything in this case.
     self.assertEqual(0, len(game.teams))
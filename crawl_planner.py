@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Martin Cochran
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Decides how often each list should be crawled.
+
+Each list keeps a ListCrawlStats entity with an estimate of how many tweets,
+and how many tweets with scores, are posted to the list per hour. The
+estimates are exponentially decayed counts: every crawled tweet adds a weight
+which halves for every TWEET_RATE_HALF_LIFE between when it was posted and
+now. Weighting by post time means a backlog crawled after a long idle period
+doesn't look like a burst of activity.
+
+The list is crawled more often the more tweets it gets, and most often while
+a tournament in its division is in progress.
+"""
+
+from datetime import datetime, timedelta
+import logging
+import math
+
+from google.appengine.ext import ndb
+
+from game_model import ActiveTournamentIndex
+from scores_messages import League
+
+import list_id_bimap
+
+# Half life of the weight of a tweet in the tweet rate estimates.
+TWEET_RATE_HALF_LIFE = timedelta(hours=3)
+
+# Bounds on the time between crawls of a list.
+MIN_CRAWL_INTERVAL = timedelta(minutes=5)
+MAX_CRAWL_INTERVAL = timedelta(hours=72)
+
+# Time between crawls of a list while a tournament in its division is in
+# progress, depending on whether score tweets are being posted.
+LIVE_CRAWL_INTERVAL = MIN_CRAWL_INTERVAL
+LIVE_QUIET_CRAWL_INTERVAL = timedelta(minutes=15)
+
+# Tournament dates have no times, so a tournament is in progress from the
+# start of its first day until the end of its last day.
+LIVE_TOURNAMENT_SLACK = timedelta(days=1)
+
+# Outside of tournaments, a list is crawled about once for every this many
+# tweets or score tweets posted to it, whichever comes first.
+TWEETS_PER_CRAWL = 50.0
+SCORE_TWEETS_PER_CRAWL = 2.0
+
+# Score tweets per hour above which a live tournament is considered busy.
+LIVE_SCORE_TWEETS_PER_HOUR = 1.0
+
+
+def list_crawl_stats_key(list_id):
+  """Constructs a Datastore key for the crawl stats of a list."""
+  return ndb.Key('ListCrawlStats', list_id)
+
+
+def _Decay(elapsed):
+  """Returns the weight left after the elapsed timedelta."""
+  hours = max(0.0, elapsed.total_seconds() / 3600.0)
+  half_life_hours = TWEET_RATE_HALF_LIFE.total_seconds() / 3600.0
+  return math.pow(0.5, hours / half_life_hours)
+
+
+class ListCrawlStats(ndb.Model):
+  """Tweet rate estimates and crawl times for a list, keyed by list id."""
+  # Decayed count of tweets, as of updated_at.
+  tweet_count = ndb.FloatProperty('tc', indexed=False, default=0.0)
+
+  # Decayed count of tweets with two or more integers, as of updated_at.
+  score_tweet_count = ndb.FloatProperty('sc', indexed=False, default=0.0)
+
+  # Time the counts were last updated.
+  updated_at = ndb.DateTimeProperty('ua', indexed=False)
+
+  # Time a crawl of the list was last enqueued.
+  last_scheduled_at = ndb.DateTimeProperty('ls', indexed=False)
+
+  def TweetsPerHour(self, now):
+    """Returns the estimated tweets per hour at the given time."""
+    return self._Rate(self.tweet_count, now)
+
+  def ScoreTweetsPerHour(self, now):
+    """Returns the estimated score tweets per hour at the given time."""
+    return self._Rate(self.score_tweet_count, now)
+
+  def _Rate(self, count, now):
+    if not self.updated_at:
+      return 0.0
+    # The decayed count integrates to count * half_life / ln(2) tweets, so
+    # that is the window it averages over.
+    window_hours = (TWEET_RATE_HALF_LIFE.total_seconds() / 3600.0 /
+        math.log(2))
+    return count * _Decay(now - self.updated_at) / window_hours
+
+  def _AddTweets(self, twts, now):
+    decay = 1.0
+    if self.updated_at:
+      decay = _Decay(now - self.updated_at)
+    self.tweet_count *= decay
+    self.score_tweet_count *= decay
+    for twt in twts:
+      weight = _Decay(now - twt.created_at)
+      self.tweet_count += weight
+      if twt.two_or_more_integers:
+        self.score_tweet_count += weight
+    self.updated_at = now
+
+
+@ndb.transactional
+def RecordTweets(list_id, twts, now=None):
+  """Adds newly crawled tweets to the rate estimates of the list.
+
+  Args:
+    list_id: ID of the list the tweets were crawled from.
+    twts: List of tweets.ParsedTweet objects which were crawled for the first
+      time.
+    now: (optional) datetime of the crawl. Defaults to utcnow().
+  Returns:
+    The updated ListCrawlStats.
+  """
+  if not now:
+    now = datetime.utcnow()
+  key = list_crawl_stats_key(list_id)
+  stats = key.get() or ListCrawlStats(key=key)
+  stats._AddTweets(twts, now)
+  stats.put()
+  return stats
+
+
+def IsTournamentLive(list_id, now):
+  """Returns True iff a tournament in the list's division is in progress."""
+  division, age_bracket, league = (
+      list_id_bimap.ListIdBiMap.GetStructuredPropertiesForList(list_id))
+  if league != League.USAU:
+    return False
+  return bool(ActiveTournamentIndex.LookupTournamentIds(division, age_bracket,
+    now, slack=LIVE_TOURNAMENT_SLACK, now=now))
+
+
+def CrawlInterval(stats, live, now):
+  """Returns the timedelta to wait between crawls of a list.
+
+  Args:
+    stats: ListCrawlStats of the list, or None if it has none yet.
+    live: True iff a tournament in the list's division is in progress.
+    now: datetime the interval is computed at.
+  """
+  tweet_rate = 0.0
+  score_rate = 0.0
+  if stats:
+    tweet_rate = stats.TweetsPerHour(now)
+    score_rate = stats.ScoreTweetsPerHour(now)
+
+  if live:
+    if score_rate >= LIVE_SCORE_TWEETS_PER_HOUR:
+      return LIVE_CRAWL_INTERVAL
+    return LIVE_QUIET_CRAWL_INTERVAL
+
+  interval = MAX_CRAWL_INTERVAL
+  if tweet_rate > 0:
+    interval = min(interval, timedelta(hours=TWEETS_PER_CRAWL / tweet_rate))
+  if score_rate > 0:
+    interval = min(interval,
+        timedelta(hours=SCORE_TWEETS_PER_CRAWL / score_rate))
+  return max(interval, MIN_CRAWL_INTERVAL)
+
+
+def ScheduleDueLists(list_ids, now=None):
+  """Returns the lists which are due to be crawled and marks them scheduled.
+
+  A list is due if it has never been scheduled or if its crawl interval has
+  passed since it was last scheduled. The interval is recomputed on every
+  call so a list is picked up soon after a tournament starts, even if it was
+  idle before.
+
+  Args:
+    list_ids: IDs of all lists which can be crawled.
+    now: (optional) datetime to plan at. Defaults to utcnow().
+  Returns:
+    The IDs of the lists to crawl now, in the order given.
+  """
+  if not now:
+    now = datetime.utcnow()
+  all_stats = ndb.get_multi([list_crawl_stats_key(l) for l in list_ids])
+  due_lists = []
+  for list_id, stats in zip(list_ids, all_stats):
+    if stats and stats.last_scheduled_at:
+      interval = CrawlInterval(stats, IsTournamentLive(list_id, now), now)
+      if now - stats.last_scheduled_at < interval:
+        continue
+      logging.info('Crawling list %s, %s since last crawl (interval %s)',
+          list_id, now - stats.last_scheduled_at, interval)
+    if _MarkScheduled(list_id, now):
+      due_lists.append(list_id)
+  return due_lists
+
+
+@ndb.transactional
+def _MarkScheduled(list_id, now):
+  """Records that a crawl was scheduled, unless one was already scheduled.
+
+  Returns:
+    False iff another request scheduled a crawl of the list at or after now.
+  """
+  key = list_crawl_stats_key(list_id)
+  stats = key.get() or ListCrawlStats(key=key)
+  if stats.last_scheduled_at and stats.last_scheduled_at >= now:
+    return False
+  stats.last_scheduled_at = now
+  stats.put()
+  return True
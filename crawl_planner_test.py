@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Martin Cochran
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from datetime import datetime, timedelta
+import unittest
+
+import test_env_setup
+
+import crawl_planner
+import game_model
+import list_id_bimap
+from scores_messages import AgeBracket
+from scores_messages import Division
+from scores_messages import League
+import web_test_base
+
+
+class CrawlPlannerTest(web_test_base.WebTestBase):
+
+  def setUp(self):
+    super(CrawlPlannerTest, self).setUp()
+    self.now = datetime(2016, 7, 16, 12)
+
+  def _CreateTweets(self, num_tweets, created_at, text=''):
+    return [self.CreateTweet(i + 1, ('alice', 2), text=text,
+      created_at=created_at) for i in range(num_tweets)]
+
+  def testRecordTweets_steadyRate(self):
+    """Verify the rate estimate converges to a steady rate of tweets."""
+    start = self.now - timedelta(hours=24)
+    for i in range(24 * 4):
+      crawl_time = start + timedelta(minutes=15 * (i + 1))
+      # 5 tweets in the 15 minutes before each crawl.
+      twts = self._CreateTweets(5, crawl_time - timedelta(minutes=7))
+      stats = crawl_planner.RecordTweets('123', twts, now=crawl_time)
+    self.assertAlmostEquals(20.0, stats.TweetsPerHour(self.now), delta=1.0)
+    self.assertEquals(0.0, stats.ScoreTweetsPerHour(self.now))
+
+    # The rate decays once tweets stop.
+    self.assertTrue(stats.TweetsPerHour(self.now + timedelta(hours=18)) < 1.0)
+
+  def testRecordTweets_backlog(self):
+    """Verify a backlog of old tweets isn't counted as a burst."""
+    twts = self._CreateTweets(200, self.now - timedelta(days=3))
+    stats = crawl_planner.RecordTweets('123', twts, now=self.now)
+    self.assertTrue(stats.TweetsPerHour(self.now) < 0.1)
+
+  def testRecordTweets_scoreTweets(self):
+    twts = self._CreateTweets(4, self.now, text='Hello 7 to 5')
+    twts.extend(self._CreateTweets(4, self.now, text='Hello'))
+    stats = crawl_planner.RecordTweets('123', twts, now=self.now)
+    self.assertAlmostEquals(stats.TweetsPerHour(self.now),
+        2 * stats.ScoreTweetsPerHour(self.now))
+
+  def testCrawlInterval(self):
+    self.assertEquals(crawl_planner.MAX_CRAWL_INTERVAL,
+        crawl_planner.CrawlInterval(None, False, self.now))
+    self.assertEquals(crawl_planner.LIVE_QUIET_CRAWL_INTERVAL,
+        crawl_planner.CrawlInterval(None, True, self.now))
+
+    # Busy list outside of a tournament.
+    stats = crawl_planner.RecordTweets('123',
+        self._CreateTweets(40, self.now), now=self.now)
+    interval = crawl_planner.CrawlInterval(stats, False, self.now)
+    self.assertTrue(interval < timedelta(hours=12))
+    self.assertTrue(interval > crawl_planner.MIN_CRAWL_INTERVAL)
+
+    # Scores during a live tournament.
+    stats = crawl_planner.RecordTweets('123',
+        self._CreateTweets(10, self.now, text='We won 15-13'), now=self.now)
+    self.assertEquals(crawl_planner.LIVE_CRAWL_INTERVAL,
+        crawl_planner.CrawlInterval(stats, True, self.now))
+    self.assertTrue(crawl_planner.CrawlInterval(stats, False, self.now) <
+        interval)
+
+  def testIsTournamentLive(self):
+    list_id = list_id_bimap.ListIdBiMap.GetListId(Division.WOMENS,
+        AgeBracket.NO_RESTRICTION, League.USAU)
+    tourney = game_model.Tournament(id_str='tourney', url='/tourney',
+        sub_tournaments=[game_model.SubTournament(division=Division.WOMENS,
+          age_bracket=AgeBracket.NO_RESTRICTION)],
+        start_date=datetime(2016, 7, 16), end_date=datetime(2016, 7, 17))
+    game_model.ActiveTournamentIndex.AddTournament(tourney, now=self.now)
+
+    self.assertTrue(crawl_planner.IsTournamentLive(list_id, self.now))
+    self.assertFalse(crawl_planner.IsTournamentLive(list_id,
+      self.now - timedelta(days=3)))
+
+  def testScheduleDueLists(self):
+    self.assertEquals(['1', '2'],
+        crawl_planner.ScheduleDueLists(['1', '2'], now=self.now))
+    self.assertEquals([],
+        crawl_planner.ScheduleDueLists(['1', '2'], now=self.now))
+
+    # Scores are posted to list 2.
+    crawl_planner.RecordTweets('2',
+        self._CreateTweets(40, self.now, text='We won 15-13'), now=self.now)
+    later = self.now + timedelta(hours=6)
+    self.assertEquals(['2'], crawl_planner.ScheduleDueLists(['1', '2'],
+      now=later))
+
+    later = self.now + crawl_planner.MAX_CRAWL_INTERVAL
+    self.assertEquals(['1'], crawl_planner.ScheduleDueLists(['1', '2'],
+      now=later))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -18,6 +18,7 @@ from datetime import datetime, timedelta
 import os
 import uuid
 
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
 from google.appengine.ext.ndb import msgprop
 
@@ -30,6 +31,16 @@ DEFAULT_TEAM_TABLE_NAME = 'team_db'
 FULL_INFO_TABLE_NAME = 'full_team_info_db'
 SR_TEAM_TABLE_NAME = 'team_db'
 
+ACTIVE_TOURNAMENTS_KEY_PREFIX = 'active_tournaments_'
+ACTIVE_TOURNAMENTS_NAMESPACE = 'tournaments'
+
+# Tournaments are considered active this long before they start and after they
+# end, to allow for games scheduled outside of the published dates.
+ACTIVE_TOURNAMENT_SLACK = timedelta(days=2)
+
+# Tournaments which ended this long ago are dropped from the index.
+ACTIVE_TOURNAMENT_RETENTION = timedelta(weeks=26)
+
 
 # Example date: '8/30/2015 11:30 AM'
 BRACKET_DATE_FMT_STR = '%m/%d/%Y %I:%M %p'
@@ -84,6 +95,11 @@ def full_team_info_key(team_sr_id, team_table_name=FULL_INFO_TABLE_NAME):
   return ndb.Key('FullTeamInfo', '%s_%s' % (team_table_name, team_sr_id))
 
 
+def active_tournament_index_key(division, age_bracket):
+  return ndb.Key('ActiveTournamentIndex', '%s_%s' % (division.name,
+    age_bracket.name))
+
+
 class TeamIdLookup(ndb.Model):
   """Model to store mapping from TeamIds to team tourney IDs."""
 
@@ -332,6 +348,116 @@ class Tournament(ndb.Model):
     return tourney
 
 
+class TournamentWindow(ndb.Model):
+  """The dates of a tournament, as stored in the ActiveTournamentIndex."""
+  id_str = ndb.StringProperty('id', indexed=False)
+
+  start_date = ndb.DateTimeProperty('sd', indexed=False)
+
+  end_date = ndb.DateTimeProperty('ed', indexed=False)
+
+
+class ActiveTournamentIndex(ndb.Model):
+  """The tournaments for a division and age bracket, with their dates.
+
+  There is one entity for each (division, age bracket) pair which is updated
+  whenever a tournament is stored, and is fronted by memcache so the Twitter
+  crawl can find the tournaments happening around the time of the crawl
+  without querying the Tournament table.
+  """
+  tournaments = ndb.StructuredProperty(TournamentWindow, 't', repeated=True)
+
+  @classmethod
+  def AddTournament(cls, tourney, now=None):
+    """Adds or updates a tournament in the index of each of its divisions.
+
+    Args:
+      tourney: Tournament object.
+      now: datetime of the update, used to prune old tournaments. Defaults to
+        utcnow.
+    """
+    if not tourney.end_date:
+      return
+    now = now or datetime.utcnow()
+    start_date = tourney.start_date or tourney.end_date
+    for st in tourney.sub_tournaments:
+      key = active_tournament_index_key(st.division, st.age_bracket)
+      index = cls._AddTournamentInTransaction(key, tourney.id_str, start_date,
+          tourney.end_date, now)
+      index._UpdateMemcache()
+
+  @classmethod
+  @ndb.transactional
+  def _AddTournamentInTransaction(cls, key, id_str, start_date, end_date, now):
+    index = key.get() or cls(key=key)
+    window = TournamentWindow(id_str=id_str, start_date=start_date,
+        end_date=end_date)
+    tournaments = [t for t in index.tournaments if t.id_str != id_str and
+        t.end_date > now - ACTIVE_TOURNAMENT_RETENTION]
+    tournaments.append(window)
+    tournaments.sort(key=lambda t: t.start_date)
+    if tournaments == index.tournaments:
+      return index
+    index.tournaments = tournaments
+    index.put()
+    return index
+
+  @classmethod
+  def LookupTournamentIds(cls, division, age_bracket, start, end=None,
+      slack=ACTIVE_TOURNAMENT_SLACK, now=None):
+    """Returns the ids of the tournaments active at any time in a range.
+
+    Tournaments which ended before ACTIVE_TOURNAMENT_RETENTION are pruned
+    from the index, so ranges which may include them are looked up with a
+    query on the Tournament table instead.
+
+    Args:
+      division: scores_messages.Division of the tournaments.
+      age_bracket: scores_messages.AgeBracket of the tournaments.
+      start: datetime of the start of the range.
+      end: (optional) datetime of the end of the range. Defaults to start.
+      slack: timedelta before the start and after the end of a tournament
+        during which it is still considered active.
+      now: (optional) current datetime. Defaults to utcnow.
+    Returns:
+      A list of Tournament.id_str values.
+    """
+    end = end or start
+    now = now or datetime.utcnow()
+    if start - slack <= now - ACTIVE_TOURNAMENT_RETENTION:
+      return cls._QueryTournamentIds(division, age_bracket, start, end, slack)
+
+    key = active_tournament_index_key(division, age_bracket)
+    windows = memcache.get(key=ACTIVE_TOURNAMENTS_KEY_PREFIX + key.id(),
+        namespace=ACTIVE_TOURNAMENTS_NAMESPACE)
+    if windows is None:
+      index = key.get() or cls(key=key)
+      windows = index._UpdateMemcache()
+    return [id_str for (id_str, start_date, end_date) in windows
+        if start_date - slack <= end and start <= end_date + slack]
+
+  @staticmethod
+  def _QueryTournamentIds(division, age_bracket, start, end, slack):
+    """Like LookupTournamentIds, but queries the Tournament table."""
+    tourneys = Tournament.query(Tournament.end_date >= start - slack).order(
+        Tournament.end_date).fetch(100)
+    tourney_ids = []
+    for tourney in tourneys:
+      if (tourney.start_date or tourney.end_date) - slack > end:
+        continue
+      for st in tourney.sub_tournaments:
+        if st.division == division and st.age_bracket == age_bracket:
+          tourney_ids.append(tourney.id_str)
+          break
+    return tourney_ids
+
+  def _UpdateMemcache(self):
+    windows = [(t.id_str, t.start_date, t.end_date) for t in self.tournaments]
+    memcache.set(key=ACTIVE_TOURNAMENTS_KEY_PREFIX + self.key.id(),
+        value=windows, namespace=ACTIVE_TOURNAMENTS_NAMESPACE)
+    return windows
+
+
 class Game(ndb.Model):
   """Information about a single game including all sources."""
   id_str = ndb.StringProperty('id', required=True)
@@ -392,7 +518,7 @@ class Game(ndb.Model):
     """Builds a Game object from a tweet and the specified teams.
 
     Args:
-      twt: The tweets.Tweet object
+      twt: The tweets.ParsedTweet or tweets.Tweet object
       teams: A list of exactly two Team objects derived from that Tweet.
       scores: A list of exactly two integer scores derived from that Tweet.
       division: The Division of the teams playing.
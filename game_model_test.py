@@ -20,6 +20,7 @@ import unittest
 import uuid
 
 import test_env_setup
+from google.appengine.api import memcache
 
 import game_model
 import score_reporter_crawler
@@ -305,5 +306,81 @@ class GameModelTest(unittest.TestCase):
     self.assertEqual(None, game_model.ParseStartTime('Sat 8/29', '-11'))
 
 
+class ActiveTournamentIndexTest(web_test_base.WebTestBase):
+  """Tests for the index of active tournaments used by the list crawler."""
+
+  def _CreateTourney(self, id_str, start_date, end_date, sub_tournaments):
+    return game_model.Tournament(id_str=id_str, url='http://a.b.c/%s' % id_str,
+        start_date=start_date, end_date=end_date,
+        sub_tournaments=[game_model.SubTournament(division=d, age_bracket=a)
+          for (d, a) in sub_tournaments])
+
+  def testLookupTournamentIds(self):
+    open_college = (scores_messages.Division.OPEN,
+        scores_messages.AgeBracket.COLLEGE)
+    women_college = (scores_messages.Division.WOMENS,
+        scores_messages.AgeBracket.COLLEGE)
+    start = datetime.datetime(2016, 5, 27)
+    end = datetime.datetime(2016, 5, 30)
+    now = datetime.datetime(2016, 6, 1)
+    index = game_model.ActiveTournamentIndex
+    index.AddTournament(self._CreateTourney('nationals', start, end,
+      [open_college, women_college]), now=now)
+    index.AddTournament(self._CreateTourney('regionals',
+      start - datetime.timedelta(weeks=2), end - datetime.timedelta(weeks=2),
+      [open_college]), now=now)
+
+    self.assertEquals(['nationals'], index.LookupTournamentIds(*open_college,
+      start=datetime.datetime(2016, 5, 28), now=now))
+    self.assertEquals(['nationals'], index.LookupTournamentIds(*women_college,
+      start=datetime.datetime(2016, 5, 28), now=now))
+    self.assertEquals(['regionals'], index.LookupTournamentIds(*open_college,
+      start=datetime.datetime(2016, 5, 14), now=now))
+    self.assertEquals([], index.LookupTournamentIds(*open_college,
+      start=datetime.datetime(2016, 5, 21), now=now))
+    self.assertEquals([], index.LookupTournamentIds(
+      scores_messages.Division.MIXED, scores_messages.AgeBracket.COLLEGE,
+      start=datetime.datetime(2016, 5, 28), now=now))
+
+    # Updated dates replace the old ones, also when served from the db.
+    index.AddTournament(self._CreateTourney('regionals',
+      start - datetime.timedelta(weeks=1), end - datetime.timedelta(weeks=1),
+      [open_college]), now=now)
+    memcache.flush_all()
+    self.assertEquals([], index.LookupTournamentIds(*open_college,
+      start=datetime.datetime(2016, 5, 14), now=now))
+    self.assertEquals(['regionals'], index.LookupTournamentIds(*open_college,
+      start=datetime.datetime(2016, 5, 21), now=now))
+
+    # Any tournament active during a range is found.
+    self.assertEquals(['regionals', 'nationals'], index.LookupTournamentIds(
+      *open_college, start=datetime.datetime(2016, 5, 14),
+      end=datetime.datetime(2016, 5, 27), now=now))
+
+    # Tournaments that ended long ago are pruned.
+    index.AddTournament(self._CreateTourney('next year', start, end,
+      [open_college]), now=now + datetime.timedelta(weeks=52))
+    key = game_model.active_tournament_index_key(*open_college)
+    self.assertEquals(['next year'], [t.id_str for t in key.get().tournaments])
+
+  def testLookupTournamentIds_beforeRetention(self):
+    """Verify ranges older than the index are looked up in the db."""
+    open_college = (scores_messages.Division.OPEN,
+        scores_messages.AgeBracket.COLLEGE)
+    start = datetime.datetime(2016, 5, 27)
+    end = datetime.datetime(2016, 5, 30)
+    self._CreateTourney('nationals', start, end, [open_college]).put()
+    self._CreateTourney('womens', start, end,
+        [(scores_messages.Division.WOMENS,
+          scores_messages.AgeBracket.COLLEGE)]).put()
+    self._CreateTourney('later', start + datetime.timedelta(weeks=2),
+        end + datetime.timedelta(weeks=2), [open_college]).put()
+
+    self.assertEquals(['nationals'],
+        game_model.ActiveTournamentIndex.LookupTournamentIds(*open_college,
+          start=start - datetime.timedelta(weeks=1), end=start,
+          now=start + datetime.timedelta(weeks=52)))
+
+
 if __name__ == '__main__':
   unittest.main()
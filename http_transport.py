@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Martin Cochran
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""HTTP transport used by the Twitter and Score Reporter fetchers.
+
+By default requests go to the network with urlfetch. For offline load tests
+TRANSPORT_MODE can be switched to:
+
+  record: Responses from the network are also written to a corpus on disk,
+    keyed by the method, the normalized URL and the payload.
+  replay: Responses are served from the corpus, after REPLAY_LATENCY_SECS
+    and failing with urlfetch.DownloadError at REPLAY_ERROR_RATE. Requests
+    which were not recorded fail with ReplayMissError.
+
+The corpus is a directory of gzipped files, one per request. Request headers,
+and so the credentials sent with a request, are never recorded. The App
+Engine sandbox doesn't allow writing files, so record from a local script
+such as the benchmarks, eg:
+
+  http_transport.TRANSPORT_MODE = http_transport.TRANSPORT_RECORD
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import random
+import urllib
+import urlparse
+
+from google.appengine.api import urlfetch
+from google.appengine.ext import ndb
+
+TRANSPORT_LIVE = 'live'
+TRANSPORT_RECORD = 'record'
+TRANSPORT_REPLAY = 'replay'
+TRANSPORT_MODE = TRANSPORT_LIVE
+
+CORPUS_DIR = 'testdata/http_corpus'
+
+# Delay before each replayed response, and the fraction of replayed requests
+# which fail.
+REPLAY_LATENCY_SECS = 0.0
+REPLAY_ERROR_RATE = 0.0
+
+
+class ReplayMissError(urlfetch.Error):
+  """No response was recorded for a replayed request."""
+  pass
+
+
+def GetTransport():
+  """Returns the transport for TRANSPORT_MODE."""
+  if TRANSPORT_MODE == TRANSPORT_RECORD:
+    return RecordingTransport(Corpus(CORPUS_DIR))
+  if TRANSPORT_MODE == TRANSPORT_REPLAY:
+    return ReplayTransport(Corpus(CORPUS_DIR),
+        latency_secs=REPLAY_LATENCY_SECS, error_rate=REPLAY_ERROR_RATE)
+  return Transport()
+
+
+def NormalizeUrl(url):
+  """Returns the URL with a lower case host and sorted query parameters.
+
+  URLs which only differ in the order of their parameters fetch the same
+  page, so they are recorded under the same key.
+  """
+  if isinstance(url, unicode):
+    url = url.encode('utf-8')
+  parts = urlparse.urlsplit(url)
+  params = sorted(urlparse.parse_qsl(parts.query, keep_blank_values=True))
+  return urlparse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(),
+    parts.path or '/', urllib.urlencode(params), ''))
+
+
+class Response(object):
+  """Replayed response with the fields of a urlfetch result that are used."""
+
+  def __init__(self, status_code, content, headers):
+    self.status_code = status_code
+    self.content = content
+    self.headers = CaselessDict(headers)
+
+
+class CaselessDict(dict):
+  """Dict of headers whose keys are looked up regardless of case."""
+
+  def __init__(self, headers):
+    super(CaselessDict, self).__init__(
+        [(k.lower(), v) for k, v in headers.iteritems()])
+
+  def __getitem__(self, key):
+    return super(CaselessDict, self).__getitem__(key.lower())
+
+  def __contains__(self, key):
+    return super(CaselessDict, self).__contains__(key.lower())
+
+  def get(self, key, default=None):
+    return super(CaselessDict, self).get(key.lower(), default)
+
+
+class Corpus(object):
+  """Recorded responses, stored in a directory with one file per request."""
+
+  def __init__(self, directory):
+    self.directory = directory
+
+  def Get(self, method, url, payload=None):
+    """Returns the Response recorded for the request, or None."""
+    filename = self._Filename(method, url, payload)
+    if not os.path.exists(filename):
+      return None
+    with gzip.open(filename, 'rb') as f:
+      metadata = json.loads(f.readline())
+      content = f.read()
+    return Response(metadata['status_code'], content, metadata['headers'])
+
+  def Put(self, method, url, payload, response):
+    """Records the response to the request, replacing any earlier one."""
+    if not os.path.isdir(self.directory):
+      os.makedirs(self.directory)
+    metadata = {
+      'method': method,
+      'url': NormalizeUrl(url),
+      'status_code': response.status_code,
+      'headers': dict(response.headers),
+    }
+    with gzip.open(self._Filename(method, url, payload), 'wb') as f:
+      f.write('%s\n' % json.dumps(metadata, sort_keys=True))
+      f.write(response.content)
+
+  def _Filename(self, method, url, payload):
+    key = '\n'.join([method.upper(), NormalizeUrl(url), payload or ''])
+    return os.path.join(self.directory,
+        '%s.gz' % hashlib.sha1(key).hexdigest())
+
+
+class Transport(object):
+  """Fetches URLs from the network with urlfetch."""
+
+  def Fetch(self, url, method='GET', payload=None, headers={}, deadline=None):
+    """Fetches the URL and returns the response.
+
+    Raises:
+      urlfetch.Error on any error from the fetch.
+    """
+    return self.FetchAsync(url, method=method, payload=payload,
+        headers=headers, deadline=deadline).get_result()
+
+  def FetchAsync(self, url, method='GET', payload=None, headers={},
+      deadline=None):
+    """Starts fetching the URL and returns an ndb.Future for the response.
+
+    The response has the status_code, content and headers of a urlfetch
+    result. Errors are raised by the future's get_result().
+    """
+    return ndb.get_context().urlfetch(url, method=method, payload=payload,
+        headers=headers, deadline=deadline)
+
+
+class RecordingTransport(Transport):
+  """Fetches URLs from the network and records the responses in a corpus."""
+
+  def __init__(self, corpus, transport=None):
+    self.corpus = corpus
+    self.transport = transport or Transport()
+
+  @ndb.tasklet
+  def FetchAsync(self, url, method='GET', payload=None, headers={},
+      deadline=None):
+    response = yield self.transport.FetchAsync(url, method=method,
+        payload=payload, headers=headers, deadline=deadline)
+    self.corpus.Put(method, url, payload, response)
+    raise ndb.Return(response)
+
+
+class ReplayTransport(Transport):
+  """Serves the responses recorded in a corpus."""
+
+  def __init__(self, corpus, latency_secs=0.0, error_rate=0.0,
+      rand=random.random):
+    """Initializes the transport.
+
+    Args:
+      corpus: Corpus with the recorded responses.
+      latency_secs: Delay before each response. Concurrent requests wait
+        concurrently, as they would for the network.
+      error_rate: Fraction of requests which fail with urlfetch.DownloadError.
+      rand: Function returning a random float in [0, 1).
+    """
+    self.corpus = corpus
+    self.latency_secs = latency_secs
+    self.error_rate = error_rate
+    self.rand = rand
+
+  @ndb.tasklet
+  def FetchAsync(self, url, method='GET', payload=None, headers={},
+      deadline=None):
+    if self.latency_secs:
+      yield ndb.sleep(self.latency_secs)
+    if self.error_rate and self.rand() < self.error_rate:
+      raise urlfetch.DownloadError('Injected error for %s' % url)
+    response = self.corpus.Get(method, url, payload)
+    if response is None:
+      logging.warning('No recorded response for %s %s', method, url)
+      raise ReplayMissError('No recorded response for %s %s' % (method, url))
+    raise ndb.Return(response)
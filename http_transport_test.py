@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Martin Cochran
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import mock
+import shutil
+import tempfile
+import unittest
+
+import test_env_setup
+
+from google.appengine.api import urlfetch
+from google.appengine.api import urlfetch_stub
+from google.appengine.ext import testbed
+
+import http_transport
+import oauth_token_manager
+import score_reporter_handler
+import twitter_fetcher
+
+
+class HttpTransportTest(unittest.TestCase):
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+    self.testbed.init_urlfetch_stub()
+    self.url_fetch_stub = self.testbed.get_stub(testbed.URLFETCH_SERVICE_NAME)
+
+    self.fetched_urls = []
+    self.return_content = []
+
+    def _FakeFetch(url, payload, method, headers, request, response,
+        follow_redirects=True, deadline=urlfetch_stub._API_CALL_DEADLINE,
+        validate_certificate=urlfetch_stub._API_CALL_VALIDATE_CERTIFICATE_DEFAULT):
+      self.fetched_urls.append(url)
+      response.set_statuscode(200)
+      response.set_content(self.return_content.pop(0))
+      header = response.add_header()
+      header.set_key('X-Rate-Limit-Remaining')
+      header.set_value('179')
+
+    self.saved_retrieve_url = self.url_fetch_stub._RetrieveURL
+    self.url_fetch_stub._RetrieveURL = _FakeFetch
+
+    self.corpus_dir = tempfile.mkdtemp()
+    self.corpus = http_transport.Corpus(self.corpus_dir)
+
+  def tearDown(self):
+    self.url_fetch_stub._RetrieveURL = self.saved_retrieve_url
+    self.testbed.deactivate()
+    shutil.rmtree(self.corpus_dir)
+
+  def testNormalizeUrl(self):
+    self.assertEquals('https://api.twitter.com/lists/statuses.json?a=1&b=&c=2',
+        http_transport.NormalizeUrl(
+          'https://API.twitter.com/lists/statuses.json?c=2&a=1&b='))
+    self.assertEquals('http://example.com/',
+        http_transport.NormalizeUrl('http://example.com'))
+
+  def testRecordAndReplay(self):
+    self.return_content = ['[{"id_str": "1"}]', '<html></html>']
+    transport = http_transport.RecordingTransport(self.corpus)
+    response = transport.Fetch('http://example.com/a?x=1&y=2',
+        headers={'Authorization': 'Bearer secret'})
+    self.assertEquals('[{"id_str": "1"}]', response.content)
+    transport.FetchAsync('http://example.com/b').get_result()
+    self.assertEquals(2, len(self.fetched_urls))
+
+    transport = http_transport.ReplayTransport(self.corpus)
+    response = transport.Fetch('http://example.com/a?y=2&x=1')
+    self.assertEquals(200, response.status_code)
+    self.assertEquals('[{"id_str": "1"}]', response.content)
+    self.assertEquals('179', response.headers.get('x-rate-limit-remaining'))
+    self.assertEquals('<html></html>',
+        transport.FetchAsync('http://example.com/b').get_result().content)
+    self.assertEquals(2, len(self.fetched_urls))
+
+    self.assertRaises(http_transport.ReplayMissError, transport.Fetch,
+        'http://example.com/a?x=2&y=2')
+    self.assertRaises(http_transport.ReplayMissError, transport.Fetch,
+        'http://example.com/a?x=1&y=2', method='POST')
+
+  def testReplay_injectedErrorsAndLatency(self):
+    self.return_content = ['content']
+    http_transport.RecordingTransport(self.corpus).Fetch('http://example.com')
+
+    rands = [0.5, 0.1]
+    transport = http_transport.ReplayTransport(self.corpus,
+        latency_secs=0.01, error_rate=0.25, rand=lambda: rands.pop(0))
+    self.assertEquals('content', transport.Fetch('http://example.com').content)
+    self.assertRaises(urlfetch.DownloadError, transport.Fetch,
+        'http://example.com')
+
+  def testGetTransport(self):
+    self.assertEquals(http_transport.Transport,
+        type(http_transport.GetTransport()))
+    with mock.patch.object(http_transport, 'TRANSPORT_MODE',
+        http_transport.TRANSPORT_REPLAY):
+      self.assertEquals(http_transport.ReplayTransport,
+          type(http_transport.GetTransport()))
+
+  def testFetchers(self):
+    """Verify both fetchers can replay a recorded crawl."""
+    self.return_content = ['[{"id_str": "1"}]', '<html></html>']
+    token_manager = oauth_token_manager.OauthTokenManager(is_mock=True)
+    fetcher = twitter_fetcher.TwitterFetcher(token_manager,
+        transport=http_transport.RecordingTransport(self.corpus))
+    fetcher.ListStatuses('123', since_id=5)
+    with mock.patch.object(http_transport, 'TRANSPORT_MODE',
+        http_transport.TRANSPORT_RECORD):
+      with mock.patch.object(http_transport, 'CORPUS_DIR', self.corpus_dir):
+        score_reporter_handler.FetchUsauPage('tournament/?ViewAll=false')
+
+    with mock.patch.object(http_transport, 'TRANSPORT_MODE',
+        http_transport.TRANSPORT_REPLAY):
+      with mock.patch.object(http_transport, 'CORPUS_DIR', self.corpus_dir):
+        fetcher = twitter_fetcher.TwitterFetcher(token_manager)
+        self.assertEquals([{'id_str': '1'}],
+            fetcher.ListStatuses('123', since_id=5))
+        self.assertRaises(twitter_fetcher.FetchError, fetcher.ListStatuses,
+            '124')
+        self.assertEquals('<html></html>', score_reporter_handler.FetchUsauPage(
+          'tournament/?ViewAll=false').content)
+    self.assertEquals(2, len(self.fetched_urls))
+
+
+if __name__ == '__main__':
+  unittest.main()
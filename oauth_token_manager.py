@@ -15,11 +15,46 @@
 # limitations under the License.
 #
 
+import base64
+import logging
+import time
+
+from google.appengine.api import memcache
 from google.appengine.api import users
 from google.appengine.ext import ndb
 
 DEFAULT_SECRET_DB_NAME = 'twitter_secret_db'
 
+# The credentials are cached in memcache under these keys, along with the
+# credentials version they were read at. The version is bumped whenever a
+# secret or token is added, which invalidates the cached values everywhere.
+CREDENTIALS_NAMESPACE = 'oauth_credentials'
+CREDENTIALS_VERSION_KEY = 'version'
+SECRET_KEY = 'secret'
+TOKEN_KEY = 'token'
+CREDENTIALS_KEY = 'credentials'
+
+# Seconds for which an instance uses the credentials it has read before
+# checking memcache again.
+CREDENTIALS_CACHE_SECS = 60
+
+# Only one request at a time asks Twitter for a new bearer token. The others
+# poll for the new token for up to REAUTH_WAIT_SECS, without blocking the
+# other tasklets of the request.
+REAUTH_LOCK_KEY = 'reauth_lock'
+REAUTH_LOCK_SECS = 30
+REAUTH_WAIT_SECS = 5
+REAUTH_POLL_SECS = 0.5
+
+# Map from credential key to (content, expiry time) for this instance.
+_credentials_cache = {}
+
+
+def ClearCredentialsCache():
+  """Drops the credentials cached by this instance."""
+  _credentials_cache.clear()
+
+
 def api_secret_key(secret_table_name=DEFAULT_SECRET_DB_NAME):
   """Constructs a Datastore key for an API secret secret_table_name."""
   return ndb.Key('ApiSecret', secret_table_name)
@@ -28,60 +63,317 @@ def token_key(token_table_name=DEFAULT_SECRET_DB_NAME):
   """Constructs a Datastore key for an Oauth token token_table_name."""
   return ndb.Key('OauthToken', token_table_name)
 
+def reauth_lock_key(credential_id):
+  """Constructs the memcache key of the lock on reauthenticating an app."""
+  return '%s_%s' % (REAUTH_LOCK_KEY, credential_id)
+
 class ApiSecret(ndb.Model):
   """Models an individual Oauth secret or token entry."""
   author = ndb.UserProperty()
   content = ndb.StringProperty(indexed=False)
   date_added = ndb.DateTimeProperty(auto_now_add=True)
 
+  # For a token, the id of the secret it was obtained with. Tokens added
+  # before secrets were pooled don't have one.
+  secret_id = ndb.IntegerProperty(indexed=False)
+
+
+def ConsumerKey(secret):
+  """Returns the consumer key of the app a secret belongs to.
+
+  The secret is the base64 encoding of '<consumer key>:<consumer secret>'.
+  """
+  try:
+    return base64.b64decode(secret).split(':', 1)[0]
+  except TypeError:
+    return secret
+
+
+class Credential(object):
+  """The secret and bearer token of one app.
+
+  Attributes:
+    credential_id: String id of the secret, or None for the only credential
+      when no secrets are stored.
+    secret: The app secret.
+    token: The bearer token, or '' if none was obtained yet.
+  """
+
+  def __init__(self, credential_id, secret, token):
+    self.credential_id = credential_id
+    self.secret = secret
+    self.token = token
+
+  def __eq__(self, other):
+    return (isinstance(other, Credential) and
+        self.credential_id == other.credential_id and
+        self.secret == other.secret and self.token == other.token)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __repr__(self):
+    return 'Credential(%r)' % self.credential_id
+
+
 class OauthTokenManager:
+  """Stores the Oauth secrets and bearer tokens.
+
+  The latest secret and token are read from the datastore, then cached in
+  memcache and for CREDENTIALS_CACHE_SECS by the instance. So are the
+  credentials of all the apps, see GetCredentials.
+  """
 
-  def __init__(self, is_mock=False):
+  def __init__(self, is_mock=False, clock=time.time):
     self.is_mock = is_mock
     self.mock_secret = ''
     self.mock_token = ''
+    self.clock = clock
 
   def GetSecret(self):
     if self.is_mock:
       return self.mock_secret
-
-    account_query = ApiSecret.query(
-      ancestor=api_secret_key()).order(-ApiSecret.date_added)
-    oauth_secrets = account_query.fetch(1)
-    if not oauth_secrets:
-      return ''
-    return oauth_secrets[0].content
+    return self._GetCached(SECRET_KEY,
+        lambda: self._QueryLatestAsync(api_secret_key()))
 
   def GetToken(self):
     if self.is_mock:
       return self.mock_token
+    return self._GetCached(TOKEN_KEY,
+        lambda: self._QueryLatestAsync(token_key()))
 
-    account_query = ApiSecret.query(
-      ancestor=token_key()).order(-ApiSecret.date_added)
-    oauth_tokens = account_query.fetch(1)
-    if not oauth_tokens:
-      return ''
-    return oauth_tokens[0].content
+  def GetCredentials(self, max_age_secs=None):
+    """Returns the credentials of every app, newest secret first.
+
+    Only the newest secret of each app is used, along with the newest token
+    obtained with it. Tokens added without a secret id belong to the newest
+    secret added before them. If no secrets are stored, the newest token is
+    returned as the only credential.
+
+    Args:
+      max_age_secs: Seconds for which credentials cached by this instance are
+        used. Defaults to CREDENTIALS_CACHE_SECS.
+    Returns:
+      A non-empty list of Credential objects.
+    """
+    return self.GetCredentialsAsync(max_age_secs=max_age_secs).get_result()
+
+  @ndb.tasklet
+  def GetCredentialsAsync(self, max_age_secs=None):
+    """Returns an ndb.Future for the credentials, see GetCredentials."""
+    if self.is_mock:
+      raise ndb.Return([Credential(None, self.mock_secret, self.mock_token)])
+    credentials = yield self._GetCachedAsync(CREDENTIALS_KEY,
+        self._QueryCredentialsAsync, max_age_secs=max_age_secs)
+    raise ndb.Return([Credential(*c) for c in credentials])
 
-  def AddToken(self, token):
+  def AddToken(self, token, secret_id=None):
+    """Stores a bearer token.
+
+    Args:
+      token: The bearer token.
+      secret_id: (optional) credential_id of the secret the token was
+        obtained with.
+    """
     if self.is_mock:
       self.mock_token = token
       return
-    account = ApiSecret(parent=token_key())
-    if users.get_current_user():
-      account.author = users.get_current_user()
-    account.content = token
-    account.put()
+    account = self._NewAccount(token_key(), token)
+    if secret_id:
+      account.secret_id = long(secret_id)
+    self._Put(account)
 
   def AddSecret(self, secret):
     if self.is_mock:
       self.mock_secret = secret
       return
-    account = ApiSecret(parent=api_secret_key())
+    self._Put(self._NewAccount(api_secret_key(), secret))
+
+  def RefreshToken(self, stale_token, fetch_token_fn, credential_id=None):
+    """Replaces a bearer token which was rejected by the API.
+
+    See RefreshTokenAsync.
+
+    Args:
+      stale_token: The token which was rejected.
+      fetch_token_fn: Function which requests and returns a new token, or ''
+        if none could be obtained.
+      credential_id: credential_id of the Credential the token belongs to.
+    Returns:
+      The new token, or '' if none could be obtained.
+    """
+    @ndb.tasklet
+    def _FetchTokenAsync():
+      raise ndb.Return(fetch_token_fn())
+
+    return self.RefreshTokenAsync(stale_token, _FetchTokenAsync,
+        credential_id=credential_id).get_result()
+
+  @ndb.tasklet
+  def RefreshTokenAsync(self, stale_token, fetch_token_fn,
+      credential_id=None):
+    """Replaces a bearer token which was rejected by the API.
+
+    If another request has already replaced the stale token, that token is
+    returned. Otherwise fetch_token_fn is called by only one request at a
+    time, and the others wait for the token it stores with ndb.sleep, so the
+    other tasklets of the request carry on meanwhile.
+
+    Args:
+      stale_token: The token which was rejected.
+      fetch_token_fn: Function which requests a new token and returns an
+        ndb.Future for it, or for '' if none could be obtained.
+      credential_id: credential_id of the Credential the token belongs to.
+    Returns:
+      An ndb.Future for the new token, or for '' if none could be obtained.
+    """
+    if self.is_mock:
+      token = yield fetch_token_fn()
+      if token:
+        self.AddToken(token)
+      raise ndb.Return(token)
+
+    token = yield self._CurrentTokenAsync(credential_id)
+    if token and token != stale_token:
+      raise ndb.Return(token)
+
+    context = ndb.get_context()
+    lock_key = reauth_lock_key(credential_id)
+    locked = yield context.memcache_add(lock_key, 1, time=REAUTH_LOCK_SECS,
+        namespace=CREDENTIALS_NAMESPACE)
+    if not locked:
+      deadline = self.clock() + REAUTH_WAIT_SECS
+      while self.clock() < deadline:
+        yield ndb.sleep(REAUTH_POLL_SECS)
+        token = yield self._CurrentTokenAsync(credential_id)
+        if token and token != stale_token:
+          raise ndb.Return(token)
+      # The other request may have failed without releasing the lock. Take
+      # it over if it has expired since; otherwise still fetch a token, as
+      # this request can't wait any longer, but leave the lock to its holder.
+      logging.info('Timed out waiting for another request to reauthenticate')
+      locked = yield context.memcache_add(lock_key, 1,
+          time=REAUTH_LOCK_SECS, namespace=CREDENTIALS_NAMESPACE)
+
+    try:
+      token = yield fetch_token_fn()
+      if token:
+        self.AddToken(token, secret_id=credential_id)
+    finally:
+      if locked:
+        yield context.memcache_delete(lock_key,
+            namespace=CREDENTIALS_NAMESPACE)
+    raise ndb.Return(token)
+
+  @ndb.tasklet
+  def _CurrentTokenAsync(self, credential_id):
+    """Returns the stored token of the credential, bypassing the instance."""
+    credentials = yield self.GetCredentialsAsync(max_age_secs=0)
+    for credential in credentials:
+      if credential.credential_id == credential_id:
+        raise ndb.Return(credential.token)
+    raise ndb.Return('')
+
+  def _GetCached(self, cache_key, load_fn, max_age_secs=None):
+    """Returns a cached value, see _GetCachedAsync."""
+    return self._GetCachedAsync(cache_key, load_fn,
+        max_age_secs=max_age_secs).get_result()
+
+  @ndb.tasklet
+  def _GetCachedAsync(self, cache_key, load_fn, max_age_secs=None):
+    """Returns a cached value, from the fastest cache that has it.
+
+    Args:
+      cache_key: Key of the value in the caches.
+      load_fn: Function which loads the value from the datastore and returns
+        an ndb.Future for it.
+      max_age_secs: Seconds for which a value cached by this instance is
+        used. Defaults to CREDENTIALS_CACHE_SECS.
+    Returns:
+      An ndb.Future for the value.
+    """
+    if max_age_secs is None:
+      max_age_secs = CREDENTIALS_CACHE_SECS
+    now = self.clock()
+    cached = _credentials_cache.get(cache_key)
+    if cached and max_age_secs and now < cached[1]:
+      raise ndb.Return(cached[0])
+
+    context = ndb.get_context()
+    version, versioned_content = yield (
+        context.memcache_get(CREDENTIALS_VERSION_KEY,
+          namespace=CREDENTIALS_NAMESPACE),
+        context.memcache_get(cache_key, namespace=CREDENTIALS_NAMESPACE))
+    if version is None:
+      version = yield context.memcache_incr(CREDENTIALS_VERSION_KEY,
+          initial_value=0, namespace=CREDENTIALS_NAMESPACE)
+    if version is not None and versioned_content and (
+        versioned_content[0] == version):
+      content = versioned_content[1]
+    else:
+      content = yield load_fn()
+      if version is not None:
+        yield context.memcache_set(cache_key, (version, content),
+            namespace=CREDENTIALS_NAMESPACE)
+
+    _credentials_cache[cache_key] = (content, now + CREDENTIALS_CACHE_SECS)
+    raise ndb.Return(content)
+
+  @ndb.tasklet
+  def _QueryLatestAsync(self, ancestor_key):
+    account_query = ApiSecret.query(
+      ancestor=ancestor_key).order(-ApiSecret.date_added)
+    accounts = yield account_query.fetch_async(1)
+    if not accounts:
+      raise ndb.Return('')
+    raise ndb.Return(accounts[0].content)
+
+  @ndb.tasklet
+  def _QueryCredentialsAsync(self):
+    """Returns a (credential_id, secret, token) tuple for each app."""
+    all_secrets, tokens = yield (
+        ApiSecret.query(ancestor=api_secret_key()).order(
+          -ApiSecret.date_added).fetch_async(),
+        ApiSecret.query(ancestor=token_key()).order(
+          -ApiSecret.date_added).fetch_async())
+
+    secrets = []
+    consumer_keys = set()
+    for secret in all_secrets:
+      consumer_key = ConsumerKey(secret.content)
+      if consumer_key in consumer_keys:
+        continue
+      consumer_keys.add(consumer_key)
+      secrets.append(secret)
+
+    if not secrets:
+      raise ndb.Return([(None, '', tokens and tokens[0].content or '')])
+
+    newest_tokens = {}
+    for token in tokens:
+      secret_id = token.secret_id
+      if not secret_id:
+        older_secrets = [secret for secret in secrets
+            if secret.date_added <= token.date_added] or secrets[-1:]
+        secret_id = older_secrets[0].key.id()
+      newest_tokens.setdefault(secret_id, token.content)
+    raise ndb.Return([(str(secret.key.id()), secret.content,
+      newest_tokens.get(secret.key.id(), '')) for secret in secrets])
+
+  def _NewAccount(self, ancestor_key, content):
+    account = ApiSecret(parent=ancestor_key)
     if users.get_current_user():
       account.author = users.get_current_user()
-    account.content = secret
+    account.content = content
+    return account
+
+  def _Put(self, account):
     account.put()
+    memcache.incr(CREDENTIALS_VERSION_KEY, initial_value=0,
+        namespace=CREDENTIALS_NAMESPACE)
+    memcache.delete_multi([SECRET_KEY, TOKEN_KEY, CREDENTIALS_KEY],
+        namespace=CREDENTIALS_NAMESPACE)
+    ClearCredentialsCache()
 
   def SetMockSecret(self, secret):
     self.mock_secret = secret
@@ -15,10 +15,14 @@
 # limitations under the License.
 #
 
+import base64
+import mock
 import unittest
 
 import test_env_setup
 
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
 from google.appengine.ext import testbed
 
 import oauth_token_manager
@@ -30,10 +34,19 @@ class OauthTokenManagerTest(unittest.TestCase):
     self.testbed.activate()
     self.testbed.init_memcache_stub()
     self.testbed.init_datastore_v3_stub()
+    oauth_token_manager.ClearCredentialsCache()
+    self.now = 1000.0
 
   def tearDown(self):
     self.testbed.deactivate()
 
+  def _Sleep(self, secs):
+    """Fake ndb.sleep which advances the clock."""
+    self.now += secs
+    future = ndb.Future()
+    future.set_result(None)
+    return future
+
   def testMockManager(self):
     token_manager = oauth_token_manager.OauthTokenManager(is_mock=True)
 
@@ -84,6 +97,144 @@ class OauthTokenManagerTest(unittest.TestCase):
     self.assertEquals(secret, token_manager.GetSecret())
     self.assertEquals(token, token_manager.GetToken())
 
+  def testGetCredentials(self):
+    token_manager = oauth_token_manager.OauthTokenManager()
+    self.assertEquals([oauth_token_manager.Credential(None, '', '')],
+        token_manager.GetCredentials())
+    token_manager.AddToken('token 1')
+    self.assertEquals([oauth_token_manager.Credential(None, '', 'token 1')],
+        token_manager.GetCredentials())
+
+    # Tokens without a secret id belong to the secret added before them.
+    app_1_secret = base64.b64encode('app1:secret')
+    token_manager.AddSecret(app_1_secret)
+    token_manager.AddToken('token 2')
+    [credential_1] = token_manager.GetCredentials()
+    self.assertEquals(app_1_secret, credential_1.secret)
+    self.assertEquals('token 2', credential_1.token)
+
+    app_2_secret = base64.b64encode('app2:secret')
+    token_manager.AddSecret(app_2_secret)
+    credential_2 = token_manager.GetCredentials()[0]
+    token_manager.AddToken('token 3', secret_id=credential_2.credential_id)
+    self.assertEquals([
+      oauth_token_manager.Credential(credential_2.credential_id,
+        app_2_secret, 'token 3'),
+      credential_1,
+    ], token_manager.GetCredentials())
+
+    # Only the newest secret of an app is used.
+    new_app_1_secret = base64.b64encode('app1:new secret')
+    token_manager.AddSecret(new_app_1_secret)
+    credentials = token_manager.GetCredentials()
+    self.assertEquals([new_app_1_secret, app_2_secret],
+        [c.secret for c in credentials])
+    self.assertEquals(['', 'token 3'], [c.token for c in credentials])
+
+  def testCachedCredentials(self):
+    token_manager = oauth_token_manager.OauthTokenManager(
+        clock=lambda: self.now)
+    token_manager.AddSecret('my secret')
+    token_manager.AddToken('token 1')
+
+    with mock.patch.object(oauth_token_manager.ApiSecret, 'query',
+        wraps=oauth_token_manager.ApiSecret.query) as mock_query:
+      self.assertEquals('my secret', token_manager.GetSecret())
+      self.assertEquals('token 1', token_manager.GetToken())
+      self.assertEquals(2, mock_query.call_count)
+
+      # Other managers use the credentials cached by the instance.
+      other_manager = oauth_token_manager.OauthTokenManager(
+          clock=lambda: self.now)
+      self.assertEquals('my secret', other_manager.GetSecret())
+      self.assertEquals('token 1', other_manager.GetToken())
+
+      # Other instances use the credentials cached in memcache.
+      oauth_token_manager.ClearCredentialsCache()
+      self.assertEquals('token 1', other_manager.GetToken())
+      self.assertEquals(2, mock_query.call_count)
+
+    # Adding a token invalidates the cached token of other instances once
+    # their cached credentials expire.
+    instance_cache = dict(oauth_token_manager._credentials_cache)
+    token_manager.AddToken('token 2')
+    self.assertEquals('token 2', token_manager.GetToken())
+    oauth_token_manager._credentials_cache.update(instance_cache)
+    self.assertEquals('token 1', token_manager.GetToken())
+    self.now += oauth_token_manager.CREDENTIALS_CACHE_SECS
+    self.assertEquals('token 2', token_manager.GetToken())
+    self.assertEquals('my secret', token_manager.GetSecret())
+
+  def testRefreshToken(self):
+    token_manager = oauth_token_manager.OauthTokenManager(
+        clock=lambda: self.now)
+    token_manager.AddToken('token 1')
+    fetch_token_fn = mock.Mock(return_value='token 2')
+
+    self.assertEquals('token 2',
+        token_manager.RefreshToken('token 1', fetch_token_fn))
+    self.assertEquals(1, fetch_token_fn.call_count)
+    self.assertEquals('token 2', token_manager.GetToken())
+
+    # The token was already refreshed by another request.
+    self.assertEquals('token 2',
+        token_manager.RefreshToken('token 1', fetch_token_fn))
+    self.assertEquals(1, fetch_token_fn.call_count)
+
+    # The lock was released, so the token can be refreshed again.
+    fetch_token_fn.return_value = 'token 3'
+    self.assertEquals('token 3',
+        token_manager.RefreshToken('token 2', fetch_token_fn))
+
+  def testRefreshToken_waitsForOtherRequest(self):
+    token_manager = oauth_token_manager.OauthTokenManager(
+        clock=lambda: self.now)
+    token_manager.AddToken('token 1')
+    fetch_token_fn = mock.Mock(return_value='token 2')
+    memcache.add(oauth_token_manager.reauth_lock_key(None), 1,
+        namespace=oauth_token_manager.CREDENTIALS_NAMESPACE)
+
+    # Another request stores a new token while this one waits.
+    def _Sleep(secs):
+      if self.now + secs >= 1002.0:
+        oauth_token_manager.OauthTokenManager().AddToken('other token')
+      return self._Sleep(secs)
+
+    with mock.patch.object(oauth_token_manager.ndb, 'sleep',
+        side_effect=_Sleep) as mock_sleep:
+      self.assertEquals('other token',
+          token_manager.RefreshToken('token 1', fetch_token_fn))
+    self.assertFalse(fetch_token_fn.called)
+    self.assertEquals(4, mock_sleep.call_count)
+
+    # If no token is stored in time the request fetches one itself.
+    with mock.patch.object(oauth_token_manager.ndb, 'sleep',
+        side_effect=self._Sleep):
+      self.assertEquals('token 2',
+          token_manager.RefreshToken('other token', fetch_token_fn))
+    self.assertEquals(1, fetch_token_fn.call_count)
+
+    # The lock of the other request is left alone.
+    self.assertEquals(1, memcache.get(oauth_token_manager.reauth_lock_key(None),
+        namespace=oauth_token_manager.CREDENTIALS_NAMESPACE))
+
+  def testRefreshTokenAsync_doesNotBlock(self):
+    """Verify other tasklets run while a request waits for a new token."""
+    token_manager = oauth_token_manager.OauthTokenManager()
+    token_manager.AddToken('token 1')
+    memcache.add(oauth_token_manager.reauth_lock_key(None), 1,
+        namespace=oauth_token_manager.CREDENTIALS_NAMESPACE)
+
+    @ndb.tasklet
+    def _OtherRequest():
+      yield ndb.sleep(0.01)
+      token_manager.AddToken('other token')
+
+    with mock.patch.object(oauth_token_manager, 'REAUTH_POLL_SECS', 0.01):
+      future = token_manager.RefreshTokenAsync('token 1', mock.Mock())
+      _OtherRequest().get_result()
+      self.assertEquals('other token', future.get_result())
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Martin Cochran
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Shared scheduler for the Twitter API rate limits.
+
+Twitter allows a fixed number of requests to each endpoint in every 15 minute
+window, and reports how many remain in the x-rate-limit-remaining and
+x-rate-limit-reset response headers. RateLimiter keeps a token bucket per
+endpoint in memcache so that all instances draw from the same budget: each
+request takes a token, and each response replaces the local estimate with the
+numbers reported by Twitter. Each app credential has its own buckets, see
+token_pool.py.
+
+More info: https://dev.twitter.com/rest/public/rate-limiting
+"""
+
+import logging
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+RATE_LIMIT_NAMESPACE = 'rate_limits'
+
+REMAINING_HEADER = 'x-rate-limit-remaining'
+RESET_HEADER = 'x-rate-limit-reset'
+
+# Length of the Twitter rate limit window.
+WINDOW_SECS = 15 * 60
+
+# Requests allowed per window for the endpoints used by the crawlers, until
+# the first response from Twitter says otherwise.
+DEFAULT_LIMITS = {
+    '/lists/ownerships.json': 15,
+    '/lists/statuses.json': 180,
+    '/statuses/user_timeline.json': 300,
+    '/users/lookup.json': 60,
+}
+
+# Limit assumed for endpoints not in DEFAULT_LIMITS.
+DEFAULT_LIMIT = 15
+
+# Number of times to retry taking a token if another request updated the
+# bucket concurrently.
+MAX_CAS_RETRIES = 5
+
+
+class RateLimiter(object):
+  """Token bucket per Twitter API endpoint, shared through memcache.
+
+  The state of each bucket is a (remaining, reset) pair, where reset is the
+  time in seconds since the epoch at which the window ends and the bucket is
+  refilled.
+  """
+
+  def __init__(self, clock=time.time):
+    """Initializes the limiter.
+
+    Args:
+      clock: Function returning the current time in seconds since the epoch.
+    """
+    self.clock = clock
+
+  def Acquire(self, endpoint, credential_id=None):
+    """Takes a token for a request to the endpoint, see AcquireAsync."""
+    return self.AcquireAsync(endpoint,
+        credential_id=credential_id).get_result()
+
+  @ndb.tasklet
+  def AcquireAsync(self, endpoint, credential_id=None):
+    """Takes a token for a request to the endpoint, if one is available.
+
+    Args:
+      endpoint: Path of the API endpoint, eg '/lists/statuses.json'.
+      credential_id: (optional) Id of the app credential the request is made
+        with.
+    Returns:
+      An ndb.Future for 0 if a token was taken and the request can be made,
+      or else for the number of seconds until the window resets and more
+      tokens are available.
+    """
+    key = self._BucketKey(endpoint, credential_id)
+    # Each acquisition uses its own client, so that concurrent acquisitions
+    # compete for the bucket through their cas ids.
+    client = memcache.Client()
+    for _ in range(MAX_CAS_RETRIES):
+      now = self.clock()
+      states = yield client.get_multi_async([key], for_cas=True,
+          namespace=RATE_LIMIT_NAMESPACE)
+      state = (states or {}).get(key)
+      if state is None:
+        state = (self._Limit(endpoint), now + WINDOW_SECS)
+        statuses = yield client.add_multi_async({key: self._Take(state)},
+            namespace=RATE_LIMIT_NAMESPACE)
+        if (statuses or {}).get(key) == memcache.STORED:
+          raise ndb.Return(0)
+        continue
+
+      remaining, reset = state
+      if now >= reset:
+        remaining, reset = self._Limit(endpoint), now + WINDOW_SECS
+      if remaining <= 0:
+        raise ndb.Return(reset - now)
+      statuses = yield client.cas_multi_async(
+          {key: self._Take((remaining, reset))},
+          namespace=RATE_LIMIT_NAMESPACE)
+      if (statuses or {}).get(key) == memcache.STORED:
+        raise ndb.Return(0)
+
+    # Don't hold up the crawl on memcache contention; the next response will
+    # correct the bucket from the headers.
+    logging.warning('Could not update rate limit bucket for %s', endpoint)
+    raise ndb.Return(0)
+
+  def UpdateFromHeaders(self, endpoint, headers, credential_id=None):
+    """Updates the bucket for the endpoint from the rate limit headers.
+
+    Args:
+      endpoint: Path of the API endpoint, eg '/lists/statuses.json'.
+      headers: Case-insensitive dict of the response headers.
+      credential_id: (optional) Id of the app credential the request was
+        made with.
+    Returns:
+      True iff the headers contained the rate limit state.
+    """
+    try:
+      remaining = int(headers.get(REMAINING_HEADER))
+      reset = float(headers.get(RESET_HEADER))
+    except (TypeError, ValueError):
+      return False
+    memcache.set(self._BucketKey(endpoint, credential_id), (remaining, reset),
+        namespace=RATE_LIMIT_NAMESPACE)
+    return True
+
+  def MarkExhausted(self, endpoint, reset=None, credential_id=None):
+    """Empties the bucket until the window resets.
+
+    Args:
+      endpoint: Path of the API endpoint, eg '/lists/statuses.json'.
+      reset: Time in seconds since the epoch at which the window resets. If
+        None, a full window from now is assumed.
+      credential_id: (optional) Id of the app credential.
+    """
+    if reset is None:
+      reset = self.clock() + WINDOW_SECS
+    memcache.set(self._BucketKey(endpoint, credential_id), (0, reset),
+        namespace=RATE_LIMIT_NAMESPACE)
+
+  def SecondsUntilReset(self, endpoint, credential_id=None):
+    """Returns the seconds until the endpoint's window resets, or 0."""
+    state = memcache.get(self._BucketKey(endpoint, credential_id),
+        namespace=RATE_LIMIT_NAMESPACE)
+    if state is None:
+      return 0
+    return max(0, state[1] - self.clock())
+
+  def Remaining(self, endpoint, credential_ids):
+    """Returns the state of the endpoint's bucket, see RemainingAsync."""
+    return self.RemainingAsync(endpoint, credential_ids).get_result()
+
+  @ndb.tasklet
+  def RemainingAsync(self, endpoint, credential_ids):
+    """Returns the state of the endpoint's bucket for several credentials.
+
+    Args:
+      endpoint: Path of the API endpoint, eg '/lists/statuses.json'.
+      credential_ids: Ids of the app credentials.
+    Returns:
+      An ndb.Future for a list with a (remaining, seconds until reset) pair
+      for each credential, in the same order.
+    """
+    keys = [self._BucketKey(endpoint, c) for c in credential_ids]
+    states = yield memcache.Client().get_multi_async(keys,
+        namespace=RATE_LIMIT_NAMESPACE)
+    states = states or {}
+    now = self.clock()
+    results = []
+    for key in keys:
+      state = states.get(key)
+      if state is None or now >= state[1]:
+        results.append((self._Limit(endpoint), 0))
+      else:
+        results.append((state[0], state[1] - now))
+    raise ndb.Return(results)
+
+  def _BucketKey(self, endpoint, credential_id):
+    if credential_id is None:
+      return endpoint
+    return '%s:%s' % (credential_id, endpoint)
+
+  def _Limit(self, endpoint):
+    return DEFAULT_LIMITS.get(endpoint, DEFAULT_LIMIT)
+
+  def _Take(self, state):
+    return (state[0] - 1, state[1])
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Martin Cochran
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+import test_env_setup
+
+from google.appengine.ext import testbed
+
+import rate_limiter
+
+
+class FakeClock(object):
+  """Stand-in for time.time which only moves when told to."""
+
+  def __init__(self, now):
+    self.now = now
+
+  def __call__(self):
+    return self.now
+
+  def Advance(self, secs):
+    self.now += secs
+
+
+class RateLimiterTest(unittest.TestCase):
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+    self.clock = FakeClock(1000.0)
+    self.limiter = rate_limiter.RateLimiter(clock=self.clock)
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def testAcquire_defaultLimit(self):
+    """Verify the default limit is used until Twitter reports one."""
+    endpoint = '/lists/ownerships.json'
+    for _ in range(15):
+      self.assertEquals(0, self.limiter.Acquire(endpoint))
+    self.assertEquals(900, self.limiter.Acquire(endpoint))
+
+    # Another endpoint has its own bucket.
+    self.assertEquals(0, self.limiter.Acquire('/lists/statuses.json'))
+
+    self.clock.Advance(300)
+    self.assertEquals(600, self.limiter.Acquire(endpoint))
+    self.clock.Advance(600)
+    self.assertEquals(0, self.limiter.Acquire(endpoint))
+
+  def testAcquire_sharedAcrossInstances(self):
+    """Verify all limiters draw from the same bucket."""
+    endpoint = '/lists/ownerships.json'
+    other_limiter = rate_limiter.RateLimiter(clock=self.clock)
+    for _ in range(8):
+      self.assertEquals(0, self.limiter.Acquire(endpoint))
+      other_limiter.Acquire(endpoint)
+    self.assertEquals(900, self.limiter.Acquire(endpoint))
+
+  def testUpdateFromHeaders(self):
+    endpoint = '/lists/statuses.json'
+    self.assertTrue(self.limiter.UpdateFromHeaders(endpoint, {
+      'x-rate-limit-remaining': '2',
+      'x-rate-limit-reset': '1060',
+    }))
+    self.assertEquals(0, self.limiter.Acquire(endpoint))
+    self.assertEquals(0, self.limiter.Acquire(endpoint))
+    self.assertEquals(60, self.limiter.Acquire(endpoint))
+    self.assertEquals(60, self.limiter.SecondsUntilReset(endpoint))
+
+    # Twitter is the source of truth, even if it allows more requests.
+    self.assertTrue(self.limiter.UpdateFromHeaders(endpoint, {
+      'x-rate-limit-remaining': '50',
+      'x-rate-limit-reset': '1060',
+    }))
+    self.assertEquals(0, self.limiter.Acquire(endpoint))
+
+  def testUpdateFromHeaders_missingHeaders(self):
+    endpoint = '/lists/statuses.json'
+    self.assertFalse(self.limiter.UpdateFromHeaders(endpoint, {}))
+    self.assertFalse(self.limiter.UpdateFromHeaders(endpoint, {
+      'x-rate-limit-remaining': 'a lot',
+      'x-rate-limit-reset': '1060',
+    }))
+    self.assertEquals(0, self.limiter.SecondsUntilReset(endpoint))
+
+  def testMarkExhausted(self):
+    endpoint = '/users/lookup.json'
+    self.limiter.MarkExhausted(endpoint)
+    self.assertEquals(900, self.limiter.Acquire(endpoint))
+
+    self.limiter.MarkExhausted(endpoint, reset=1030)
+    self.assertEquals(30, self.limiter.Acquire(endpoint))
+    self.clock.Advance(30)
+    self.assertEquals(0, self.limiter.Acquire(endpoint))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Martin Cochran
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Ages out old tweets.
+
+Tweets are only needed after they are crawled if they are the source of a
+game. Each retention run walks the tweets created before the retention age,
+in batches chained through the task queue with query cursors:
+  - tweets which aren't the source of any game are deleted, along with their
+    raw JSON.
+  - tweets which are the source of a game keep their metadata, their
+    integers and their user mentions, which is what matching a tweet to a
+    game needs. Their raw JSON and their other entities are dropped. Since
+    scores_api.GetTweets only returns tweets with raw JSON, it no longer
+    returns them.
+
+Each run starts where the last finished run stopped, so a tweet is only
+processed once. The totals of each run are kept in a RetentionRun entity,
+along with the cursor of its next batch. The run is written in the same
+transaction which enqueues that batch, so a retried task doesn't add the
+same batch to the totals twice.
+"""
+
+from datetime import datetime, timedelta
+import logging
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import webapp2
+
+from game_model import Game
+import tweets
+
+# Tweets created longer ago than this are aged out.
+RETENTION_AGE = timedelta(days=365)
+
+# Number of tweets processed by each retention task.
+RETENTION_BATCH_SIZE = 100
+
+RETENTION_QUEUE = 'retention'
+
+
+class RetentionRun(ndb.Model):
+  """Progress and totals of one retention run."""
+  # Tweets created before this are aged out by the run.
+  cutoff = ndb.DateTimeProperty('co', indexed=False)
+
+  # Tweets created before this were aged out by earlier runs.
+  start = ndb.DateTimeProperty('s', indexed=False)
+
+  # Query cursor of the next batch, or None for the first batch.
+  cursor = ndb.StringProperty('c', indexed=False)
+
+  started_at = ndb.DateTimeProperty('sa', auto_now_add=True)
+  finished_at = ndb.DateTimeProperty('fa')
+
+  tweets_deleted = ndb.IntegerProperty('td', indexed=False, default=0)
+  tweets_stripped = ndb.IntegerProperty('ts', indexed=False, default=0)
+  raw_tweets_deleted = ndb.IntegerProperty('rd', indexed=False, default=0)
+
+  # Estimated size of the data deleted or stripped, in bytes.
+  bytes_reclaimed = ndb.IntegerProperty('br', indexed=False, default=0)
+
+  def Summary(self):
+    return ('Retention run for tweets from %s to %s: deleted %d tweets and %d '
+        'raw tweets, stripped %d tweets, reclaimed %d bytes' % (self.start,
+          self.cutoff, self.tweets_deleted, self.raw_tweets_deleted,
+          self.tweets_stripped, self.bytes_reclaimed))
+
+
+def _EntitySize(entity):
+  """Returns the encoded size of the entity in bytes."""
+  return len(entity._to_pb().Encode())
+
+
+def IsStripped(twt):
+  """Returns True iff the heavy fields of the tweet were already dropped."""
+  entities = twt.entities
+  return (twt.original_json is None and (entities is None or not (
+    entities.hashtags or entities.url_mentions or entities.media)))
+
+
+def StripTweet(twt):
+  """Drops the fields of a tweet which aren't needed to match it to games."""
+  twt.original_json = None
+  if twt.entities is not None:
+    twt.entities = tweets.Entities(integers=twt.entities.integers,
+        user_mentions=twt.entities.user_mentions)
+
+
+def FindGameSourceIds(twts):
+  """Returns the id_strs of the tweets which are the source of a game."""
+  futures = [(twt.id_str, Game.query(
+    Game.sources.tweet_id == long(twt.id_str)).get_async(keys_only=True))
+    for twt in twts]
+  return set([id_str for id_str, future in futures if future.get_result()])
+
+
+def AgeOutTweets(run, twts):
+  """Deletes or strips a batch of tweets and adds them to the run's totals.
+
+  The run itself is not written.
+
+  Args:
+    run: The RetentionRun.
+    twts: list of tweets.Tweet objects created before the run's cutoff.
+  """
+  source_ids = FindGameSourceIds(twts)
+  raw_keys = [tweets.raw_tweet_key(twt.id_str) for twt in twts
+      if twt.original_json is None]
+  raw_twts = [r for r in ndb.get_multi(raw_keys) if r]
+
+  to_delete = []
+  to_put = []
+  for twt in twts:
+    size = _EntitySize(twt)
+    if twt.id_str not in source_ids:
+      to_delete.append(twt.key)
+      run.tweets_deleted += 1
+      run.bytes_reclaimed += size
+    elif not IsStripped(twt):
+      StripTweet(twt)
+      to_put.append(twt)
+      run.tweets_stripped += 1
+      run.bytes_reclaimed += size - _EntitySize(twt)
+
+  to_delete.extend([r.key for r in raw_twts])
+  run.raw_tweets_deleted += len(raw_twts)
+  run.bytes_reclaimed += sum([_EntitySize(r) for r in raw_twts])
+
+  ndb.delete_multi(to_delete)
+  ndb.put_multi(to_put)
+
+
+@ndb.transactional
+def _CommitBatch(run, batch_cursor):
+  """Writes the run and enqueues its next batch, unless it's finished.
+
+  Args:
+    run: The RetentionRun, with the totals and the cursor after the batch.
+    batch_cursor: The cursor of the batch, as stored in the run before it.
+  Returns:
+    False if the batch was already committed by another task.
+  """
+  if run.key.get(use_cache=False).cursor != batch_cursor:
+    return False
+  run.put()
+  if not run.finished_at:
+    taskqueue.add(url='/tasks/retention/batch', method='GET',
+        params={'run_id': run.key.id(), 'cursor': run.cursor},
+        queue_name=RETENTION_QUEUE, transactional=True)
+  return True
+
+
+class StartRetentionHandler(webapp2.RequestHandler):
+  """Starts a retention run, which is run by cron.
+
+  The optional age_days parameter overrides RETENTION_AGE.
+  """
+  def get(self):
+    age = RETENTION_AGE
+    if self.request.get('age_days'):
+      try:
+        age = timedelta(days=int(self.request.get('age_days')))
+      except ValueError:
+        msg = 'Could not parse age_days: %s' % self.request.get('age_days')
+        logging.warning(msg)
+        self.response.write(msg)
+        return
+
+    last_run = RetentionRun.query(RetentionRun.finished_at != None).order(
+        -RetentionRun.finished_at).get()
+    start = None
+    if last_run:
+      start = last_run.cutoff
+    cutoff = datetime.utcnow() - age
+    if start and start >= cutoff:
+      msg = 'Tweets before %s were already aged out' % cutoff
+      logging.info(msg)
+      self.response.write(msg)
+      return
+
+    run = RetentionRun(cutoff=cutoff, start=start)
+    run.put()
+    taskqueue.add(url='/tasks/retention/batch', method='GET',
+        params={'run_id': run.key.id()}, queue_name=RETENTION_QUEUE)
+    msg = 'Started retention run %s for tweets before %s' % (run.key.id(),
+        cutoff)
+    logging.info(msg)
+    self.response.write(msg)
+
+
+class RetentionBatchHandler(webapp2.RequestHandler):
+  """Ages out one batch of tweets and enqueues the next batch."""
+  def get(self):
+    run = None
+    try:
+      run = RetentionRun.get_by_id(long(self.request.get('run_id')))
+    except ValueError:
+      pass
+    if not run or run.finished_at:
+      msg = 'No retention run in progress with id %s' % (
+          self.request.get('run_id'))
+      logging.warning(msg)
+      self.response.write(msg)
+      return
+
+    batch_cursor = self.request.get('cursor') or None
+    if batch_cursor != run.cursor:
+      msg = 'Batch of retention run %s was already aged out' % run.key.id()
+      logging.info(msg)
+      self.response.write(msg)
+      return
+
+    start_cursor = None
+    if batch_cursor:
+      start_cursor = Cursor(urlsafe=batch_cursor)
+
+    query = tweets.Tweet.query(tweets.Tweet.created_at < run.cutoff)
+    if run.start:
+      query = query.filter(tweets.Tweet.created_at >= run.start)
+    twts, next_cursor, more = query.order(
+        tweets.Tweet.created_at).fetch_page(RETENTION_BATCH_SIZE,
+            start_cursor=start_cursor)
+
+    if not more or not next_cursor:
+      run.finished_at = datetime.utcnow()
+    else:
+      run.cursor = next_cursor.urlsafe()
+    AgeOutTweets(run, twts)
+
+    if not _CommitBatch(run, batch_cursor):
+      msg = 'Batch of retention run %s was already aged out' % run.key.id()
+    elif run.finished_at:
+      msg = run.Summary()
+    else:
+      msg = 'Aged out %d tweets, enqueued the next batch' % len(twts)
+    logging.info(msg)
+    self.response.write(msg)
+
+
+app = webapp2.WSGIApplication([
+  ('/tasks/retention', StartRetentionHandler),
+  ('/tasks/retention/batch', RetentionBatchHandler),
+], debug=True)
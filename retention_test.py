@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Martin Cochran
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from datetime import datetime, timedelta
+import json
+import mock
+import unittest
+import webtest
+
+import test_env_setup
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from game_model import Game, GameSource
+from scores_messages import GameSourceType
+import retention
+import tweets
+import web_test_base
+
+
+class RetentionTest(web_test_base.WebTestBase):
+
+  def setUp(self):
+    super(RetentionTest, self).setUp()
+    self.testapp = webtest.TestApp(retention.app)
+    self.now = datetime.utcnow()
+
+  def _StoreTweet(self, id_str, age, text='Hello #ultimate'):
+    json_obj = json.loads(self.CreateTweet(id_str, ('bob', 2), text=text,
+      created_at=self.now - age).ToJsonString())
+    json_obj['entities'] = {
+        'hashtags': [{'text': 'ultimate', 'indices': [30, 39]}],
+        'user_mentions': [{'id_str': '3', 'id': 3, 'indices': [0, 1]}],
+    }
+    return tweets.Tweet.BulkGetOrInsertFromJson([json_obj])[0]
+
+  def _StoreGame(self, tweet_id):
+    Game(id_str='game %s' % tweet_id, created_at=self.now, sources=[
+      GameSource(type=GameSourceType.TWITTER, tweet_id=tweet_id)]).put()
+
+  def _RunRetention(self, mock_add_queue, params=None):
+    """Runs a retention run and all of its batches."""
+    mock_add_queue.reset_mock()
+    response = self.testapp.get('/tasks/retention', params or {})
+    self.assertEqual(200, response.status_int)
+    num_tasks = 0
+    while len(mock_add_queue.mock_calls) > num_tasks:
+      num_tasks += 1
+      response = self.testapp.get('/tasks/retention/batch',
+          mock_add_queue.call_args[1]['params'])
+      self.assertEqual(200, response.status_int)
+    return num_tasks
+
+  @mock.patch.object(retention, 'RETENTION_BATCH_SIZE', 2)
+  @mock.patch.object(taskqueue, 'add')
+  def testRetention(self, mock_add_queue):
+    self._StoreTweet(1, timedelta(days=400))
+    self._StoreTweet(2, timedelta(days=400), text='We won 15-13')
+    self._StoreTweet(3, timedelta(days=380))
+    self._StoreTweet(4, timedelta(days=10))
+    self._StoreGame(2L)
+    self._StoreGame(4L)
+
+    self.assertEqual(2, self._RunRetention(mock_add_queue))
+
+    self.assertTweetDbContents(['2', '4'])
+    self.assertEqual(None, tweets.raw_tweet_key('1').get())
+    self.assertEqual(None, tweets.raw_tweet_key('2').get())
+    self.assertNotEqual(None, tweets.raw_tweet_key('4').get())
+
+    # The game source keeps what's needed to match it to the game.
+    twt = tweets.tweet_entity_key('2').get()
+    self.assertEqual('We won 15-13', twt.text)
+    self.assertEqual([15, 13], [ie.num for ie in twt.integers])
+    self.assertEqual(['3'], twt.user_mention_ids)
+    self.assertEqual([], twt.entities.hashtags)
+    self.assertTrue(twt.two_or_more_integers)
+    self.assertEqual(1, len(tweets.tweet_entity_key('4').get(
+      ).entities.hashtags))
+
+    run = retention.RetentionRun.query().get()
+    self.assertNotEqual(None, run.finished_at)
+    self.assertEqual(2, run.tweets_deleted)
+    self.assertEqual(1, run.tweets_stripped)
+    self.assertEqual(3, run.raw_tweets_deleted)
+    self.assertTrue(run.bytes_reclaimed > 0)
+
+  @mock.patch.object(taskqueue, 'add')
+  def testRetention_startsWhereLastRunStopped(self, mock_add_queue):
+    self._StoreTweet(1, timedelta(days=400))
+    self._RunRetention(mock_add_queue)
+    self.assertTweetDbContents([])
+
+    # Nothing that old is left.
+    response = self.testapp.get('/tasks/retention?age_days=400')
+    self.assertTrue(response.body.find('already aged out') != -1)
+
+    self._StoreTweet(2, timedelta(days=40))
+    self._StoreTweet(3, timedelta(days=20))
+    self._RunRetention(mock_add_queue, {'age_days': '30'})
+    self.assertTweetDbContents(['3'])
+
+    runs = retention.RetentionRun.query().order(
+        retention.RetentionRun.started_at).fetch()
+    self.assertEqual(2, len(runs))
+    self.assertEqual(runs[0].cutoff, runs[1].start)
+    self.assertEqual(1, runs[1].tweets_deleted)
+
+  @mock.patch.object(retention, 'RETENTION_BATCH_SIZE', 2)
+  @mock.patch.object(taskqueue, 'add')
+  def testRetention_retriedBatch(self, mock_add_queue):
+    """Verify a retried batch isn't added to the totals again."""
+    for i in range(3):
+      self._StoreTweet(i + 1, timedelta(days=400))
+    self._StoreGame(1L)
+
+    self.testapp.get('/tasks/retention')
+    first_batch = mock_add_queue.call_args[1]['params']
+    self.testapp.get('/tasks/retention/batch', first_batch)
+    self.assertEqual(2, len(mock_add_queue.mock_calls))
+    self.assertTrue(mock_add_queue.call_args[1]['transactional'])
+
+    response = self.testapp.get('/tasks/retention/batch', first_batch)
+    self.assertTrue(response.body.find('already aged out') != -1)
+    self.assertEqual(2, len(mock_add_queue.mock_calls))
+
+    self.testapp.get('/tasks/retention/batch',
+        mock_add_queue.call_args[1]['params'])
+    run = retention.RetentionRun.query().get()
+    self.assertNotEqual(None, run.finished_at)
+    self.assertEqual(2, run.tweets_deleted)
+    self.assertEqual(1, run.tweets_stripped)
+    self.assertEqual(3, run.raw_tweets_deleted)
+
+  def testRetention_badParams(self):
+    response = self.testapp.get('/tasks/retention?age_days=a')
+    self.assertTrue(response.body.find('Could not parse') != -1)
+    response = self.testapp.get('/tasks/retention/batch?run_id=a')
+    self.assertTrue(response.body.find('No retention run') != -1)
+
+
+if __name__ == '__main__':
+  unittest.main()
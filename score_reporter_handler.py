@@ -15,15 +15,19 @@
 # limitations under the License.
 
 from datetime import datetime
+import hashlib
 import logging
 import urllib2
 import webapp2
+import zlib
 
 from google.appengine.api import taskqueue
 from google.appengine.api import urlfetch
+from google.appengine.ext import ndb
 
 import game_model
 import games
+import http_transport
 import score_reporter_crawler
 import scores_messages
 import tweets
@@ -37,30 +41,117 @@ class FetchError(Exception):
   pass
 
 
-def FetchUsauPage(url):
-  """Wrapper around urlfetch for the given USAU url.
+def page_cache_key(url):
+  """Constructs a Datastore key for the cache entry of a USAU page."""
+  return ndb.Key('PageCache', url)
+
+
+class PageCache(ndb.Model):
+  """Validators and digest of a USAU page as of its last successful crawl.
+
+  There is one entity for each page, keyed by full URL. It is only stored once
+  the page has been crawled, so a crawl which fails part way is done again.
+  """
+  # ETag and Last-Modified headers of the response.
+  etag = ndb.StringProperty('e', indexed=False)
+  last_modified = ndb.StringProperty('m', indexed=False)
+
+  # SHA-1 hex digest of the page content.
+  digest = ndb.StringProperty('d', indexed=False)
+
+  # Whatever the handler needs to carry on with the crawl when the page is
+  # unchanged, without parsing it again.
+  data = ndb.JsonProperty('v', indexed=False)
+
+  last_modified_at = ndb.DateTimeProperty('lm', auto_now=True, indexed=False)
+
+
+def FetchUsauPage(url, headers=None):
+  """Fetches the given USAU url with the http_transport.
 
   Args:
     url: URL suffix for USA page.
+    headers: (optional) Dict of extra request headers.
   Returns:
-    The urlfetch.Result object from the fetch.
+    The response from the fetch, with the fields of a urlfetch.Result. Gzipped
+    content is decompressed.
   Raises:
     FetchError on any error raised by the fetch.
   """
   try:
     full_url = '%s%s' % (USAU_URL_PREFIX, url)
     logging.info('Fetching %s', full_url)
-    response = urlfetch.fetch(full_url, deadline=FETCH_DEADLINE_SECS)
+    response = http_transport.GetTransport().Fetch(full_url,
+        headers=headers or {}, deadline=FETCH_DEADLINE_SECS)
   except urlfetch.Error as e:
     logging.warning('Could not fetch URL %s: %s', full_url, e)
     raise FetchError(e)
 
-  if response.status_code not in [200, 404]:
-    raise FetchError('Response code not 200/404: %s, %s' % (response.status_code,
-        response.content))
+  if response.status_code not in [200, 304, 404]:
+    raise FetchError('Response code not 200/304/404: %s, %s' % (
+        response.status_code, response.content))
+
+  # urlfetch may already have decompressed the content.
+  if (response.headers.get('content-encoding', '') == 'gzip' and
+      response.content[:2] == '\x1f\x8b'):
+    try:
+      response.content = zlib.decompress(response.content, 16 + zlib.MAX_WBITS)
+    except zlib.error as e:
+      raise FetchError('Could not decompress %s: %s' % (full_url, e))
   return response
 
 
+def FetchChangedUsauPage(url):
+  """Fetches the given USAU url unless it is unchanged since its last crawl.
+
+  The request is conditional on the ETag and Last-Modified headers from the
+  last crawl. A page whose content has the same digest as the last crawl is
+  unchanged too.
+
+  Args:
+    url: URL suffix for USA page.
+  Returns:
+    A (response, page_cache) pair. If the page is unchanged, response is None
+    and page_cache is the stored PageCache of the page. Otherwise page_cache
+    is the PageCache for the response, which the caller should put once the
+    page has been crawled, or None if the response code is not 200.
+  Raises:
+    FetchError on any error raised by the fetch, or if the page is reported
+    not modified although there is no earlier crawl to compare it to.
+  """
+  key = page_cache_key('%s%s' % (USAU_URL_PREFIX, url))
+  cached = key.get()
+  headers = {'Accept-Encoding': 'gzip'}
+  if cached and cached.etag:
+    headers['If-None-Match'] = cached.etag
+  if cached and cached.last_modified:
+    headers['If-Modified-Since'] = cached.last_modified
+
+  response = FetchUsauPage(url, headers=headers)
+  if response.status_code == 304:
+    if not cached:
+      # Eg a response recorded for a conditional request was replayed.
+      raise FetchError('Page %s not modified since an unknown crawl' % url)
+    logging.info('Page %s not modified', url)
+    return None, cached
+  if response.status_code != 200:
+    return response, None
+
+  page_cache = PageCache(key=key, etag=response.headers.get('etag'),
+      last_modified=response.headers.get('last-modified'),
+      digest=hashlib.sha1(response.content).hexdigest())
+  if not cached or cached.digest != page_cache.digest:
+    return response, page_cache
+
+  logging.info('Page %s unchanged', url)
+  if (cached.etag, cached.last_modified) != (page_cache.etag,
+      page_cache.last_modified):
+    cached.etag = page_cache.etag
+    cached.last_modified = page_cache.last_modified
+    cached.put()
+  return None, cached
+
+
 class ScoreReporterHandler(webapp2.RequestHandler):
   """Handler for /tasks/sr/crawl."""
 
@@ -103,7 +194,11 @@ class TournamentLandingPageHandler(webapp2.RequestHandler):
       WriteError('No tournament name specified', self.response)
       return
 
-    response = FetchUsauPage(url)
+    response, page_cache = FetchChangedUsauPage(url)
+    if response is None:
+      # The scores on the division pages may still have changed.
+      self._EnqueueDivisionCrawls(page_cache.data or [])
+      return
     if response.status_code != 200:
       WriteError('Tourney page not found', self.response)
       return
@@ -121,21 +216,43 @@ class TournamentLandingPageHandler(webapp2.RequestHandler):
         start_date=start_date, end_date=end_date,
         image_url_https=image_url,
         last_modified_at=datetime.utcnow())
-    crawl_url = '/tasks/sr/crawl_tournament'
+    crawl_params = []
     for tourney_info in tournaments:
       tourney_pb.sub_tournaments.append(
           game_model.SubTournament(
             division=tourney_info[0],
             age_bracket=tourney_info[1]))
-      taskqueue.add(url=crawl_url, method='GET',
-          params={'url_suffix': tourney_info[2], 'name': url,
-            'division': tourney_info[0].name,
-            'age_bracket': tourney_info[1].name},
-          queue_name='score-reporter')
+      crawl_params.append({'url_suffix': tourney_info[2], 'name': url,
+        'division': tourney_info[0].name,
+        'age_bracket': tourney_info[1].name})
+    self._EnqueueDivisionCrawls(crawl_params)
+
+    self._UpdateTourney(tourney_pb)
+    page_cache.data = crawl_params
+    page_cache.put()
+
+  def _EnqueueDivisionCrawls(self, crawl_params):
+    """Enqueues a crawl of the scores of each division.
+
+    Args:
+      crawl_params: List of the params for each /tasks/sr/crawl_tournament
+        task.
+    """
+    for params in crawl_params:
+      taskqueue.add(url='/tasks/sr/crawl_tournament', method='GET',
+          params=params, queue_name='score-reporter')
+
+  def _UpdateTourney(self, tourney_pb):
+    """Stores the tournament parsed from its landing page.
 
+    Args:
+      tourney_pb: game_model.Tournament parsed from the landing page.
+    """
+    key = tourney_pb.key
     existing_tourney = key.get()
     if not existing_tourney:
       tourney_pb.put()
+      game_model.ActiveTournamentIndex.AddTournament(tourney_pb)
       return
     changed = False
     if len(tourney_pb.sub_tournaments) > len(existing_tourney.sub_tournaments):
@@ -153,6 +270,9 @@ class TournamentLandingPageHandler(webapp2.RequestHandler):
       existing_tourney.start_date = tourney_pb.start_date
       existing_tourney.end_date = tourney_pb.end_date
       existing_tourney.put()
+    # Also add unchanged tournaments, in case they were stored before the
+    # index existed. This is a no-op if the index is already up to date.
+    game_model.ActiveTournamentIndex.AddTournament(existing_tourney)
 
 
 class TournamentScoresHandler(webapp2.RequestHandler):
@@ -181,33 +301,57 @@ class TournamentScoresHandler(webapp2.RequestHandler):
 
     url = urllib2.unquote(url)
     name = urllib2.unquote(name)
-    response = FetchUsauPage('%s/%s' % (name, url))
+    response, page_cache = FetchChangedUsauPage('%s/%s' % (name, url))
+    if response is None:
+      return
     if response.status_code != 200:
       WriteError('Response code not 200 - page %s/%s not found' % (name, url),
           self.response)
       return
 
+    # If some teams still have to be crawled, the games with them are only
+    # stored the next time the page is crawled, even if it is unchanged.
+    if self._UpdateScores(response.content, name, url, enum_division,
+        enum_age_bracket):
+      page_cache.put()
+
+  def _UpdateScores(self, content, name, url, division, age_bracket):
+    """Stores the games on a division's schedule page.
+
+    Args:
+      content: HTML of the schedule page.
+      name: Name of the tournament.
+      url: URL suffix of the schedule page.
+      division: scores_messages.Division of the schedule.
+      age_bracket: scores_messages.AgeBracket of the schedule.
+    Returns:
+      True iff all the games on the page were checked against the datastore,
+      ie none of them is waiting for its teams to be crawled.
+    """
     crawler = score_reporter_crawler.ScoreReporterCrawler()
     full_url = '%s/%s' % (name, url)
-    game_infos = crawler.ParseGameInfos(response.content,
-        full_url, name, enum_division, enum_age_bracket)
+    game_infos = crawler.ParseGameInfos(content,
+        full_url, name, division, age_bracket)
     changed = False
     non_zero_score = False
+    complete = True
     for game_info in game_infos:
-      c, nz = self._HandleGame(game_info, enum_division, enum_age_bracket)
+      c, nz, waiting = self._HandleGame(game_info, division, age_bracket)
       changed |= c
       non_zero_score |= nz
+      complete &= not waiting
     full_url = '%s%s' % (USAU_URL_PREFIX, name)
     key = game_model.tourney_key_full(name)
     existing_tourney = key.get()
     if not changed:
       if non_zero_score and existing_tourney and existing_tourney.has_started:
-        return
+        return complete
     # Only update the tourney if it's already known.
     if existing_tourney:
       existing_tourney.last_modified_at = datetime.utcnow()
       existing_tourney.has_started = non_zero_score
       existing_tourney.put()
+    return complete
 
   def _HandleGame(self, game_info, division, age_bracket):
     """Check and maybe update the parsed game info object against the datastore .
@@ -217,16 +361,17 @@ class TournamentScoresHandler(webapp2.RequestHandler):
       division: scores_messages.Division division of team
       age_bracket: scores_messages.AgeBracket age bracket of team
     Returns:
-      A (updated, non_zero_score) pair of Booleans. 'updated' is True iff the game
-      was updated in the database. 'non_zero_score' is updated iff any
-      score in the game is greater than 0.
+      A (updated, non_zero_score, waiting) triple of Booleans. 'updated' is
+      True iff the game was updated in the database. 'non_zero_score' is
+      updated iff any score in the game is greater than 0. 'waiting' is True
+      iff the game was not checked because its teams are still being crawled.
     """
     team_tourney_ids = set()
     home_tourney_id = self._ParseTourneyId(game_info.home_team_link)
     away_tourney_id = self._ParseTourneyId(game_info.away_team_link)
     if not home_tourney_id or not away_tourney_id:
       logging.debug('Ignore game %s since no teams are involved.', game_info)
-      return False, False
+      return False, False, False
 
     team_tourney_ids.add((home_tourney_id, game_info.home_team_link))
     team_tourney_ids.add((away_tourney_id, game_info.away_team_link))
@@ -253,7 +398,7 @@ class TournamentScoresHandler(webapp2.RequestHandler):
     # tournament-specific ID).
     if not found_all:
       logging.debug('Did not find all teams in db for %s', game_info.tourney_id)
-      return False, False
+      return False, False, True
 
     # OK - both teams are known and game should be added to DB if it
     # is new or updated.
@@ -265,8 +410,8 @@ class TournamentScoresHandler(webapp2.RequestHandler):
     db_game = game_model.game_key(game).get()
     if self._ShouldUpdateGame(db_game, game):
       game.put()
-      return True, non_zero_score
-    return False, non_zero_score
+      return True, non_zero_score, False
+    return False, non_zero_score, False
 
   def _ShouldUpdateGame(self, db_game, incoming_game):
     """Returns true if any fields in incoming_game are more recent than db_game.
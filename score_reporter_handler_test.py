@@ -15,8 +15,10 @@
 # limitations under the License.
 
 from datetime import datetime
+import gzip
 import logging
 import mock
+import StringIO
 import unittest
 import webtest
 
@@ -24,6 +26,7 @@ import test_env_setup
 from google.appengine.api import taskqueue
 
 import game_model
+import http_transport
 import score_reporter_crawler
 import score_reporter_handler
 import score_reporter_testdata
@@ -249,6 +252,12 @@ class ScoreReporterHandlerTest(web_test_base.WebTestBase):
         ])
     self.assertEquals(got_tourney, want_tourney)
 
+    # The tourney is in the index used by the Twitter crawl.
+    self.assertEquals(['my-tourney'],
+        game_model.ActiveTournamentIndex.LookupTournamentIds(
+          scores_messages.Division.OPEN, scores_messages.AgeBracket.COLLEGE,
+          datetime(2016, 3, 31, 12, 0), now=datetime(2016, 4, 1)))
+
     # Crawl it again. There should still only be one tourney in the db.
     self.SetHtmlResponse(FAKE_TOURNEY_LANDING_PAGE)
     response = self.testapp.get(
@@ -257,6 +266,30 @@ class ScoreReporterHandlerTest(web_test_base.WebTestBase):
     all_tourneys = game_model.Tournament.query().fetch()
     self.assertEquals(1, len(all_tourneys))
 
+  @mock.patch.object(taskqueue, 'add')
+  def testParseTourneyLandingPage_unchanged(self, mock_add_queue):
+    self.SetHtmlResponse(FAKE_TOURNEY_LANDING_PAGE)
+    response = self.testapp.get(
+        '/tasks/sr/list_tournament_details?name=my-tourney')
+    self.assertEqual(200, response.status_int)
+    game_model.tourney_key_full('my-tourney').delete()
+
+    # The page isn't parsed again, but the divisions are still crawled.
+    self.SetHtmlResponse(FAKE_TOURNEY_LANDING_PAGE)
+    response = self.testapp.get(
+        '/tasks/sr/list_tournament_details?name=my-tourney')
+    self.assertEqual(200, response.status_int)
+    self.assertEquals(None, game_model.tourney_key_full('my-tourney').get())
+    calls = mock_add_queue.mock_calls
+    self.assertEquals(2, len(calls))
+    self.assertEquals(calls[0], calls[1])
+
+    self.SetHtmlResponse(FAKE_TOURNEY_LANDING_PAGE + ' ')
+    response = self.testapp.get(
+        '/tasks/sr/list_tournament_details?name=my-tourney')
+    self.assertEqual(200, response.status_int)
+    self.assertNotEquals(None, game_model.tourney_key_full('my-tourney').get())
+
   @mock.patch.object(taskqueue, 'add')
   def testParseTourneyLandingPage_updateTourney(self, mock_add_queue):
     key = game_model.tourney_key_full('my-tourney')
@@ -544,6 +577,72 @@ class ScoreReporterHandlerTest(web_test_base.WebTestBase):
     self.assertEquals(True, db_tourney.has_started)
     self.assertTrue(db_tourney.last_modified_at >= now)
  
+  @mock.patch.object(taskqueue, 'add')
+  def testParseTourneyScores_unchanged(self, mock_add_queue):
+    params = {
+        'url_suffix': 'schedule/Men/College-Men/',
+        'name': 'my-tourney',
+        'division': 'OPEN',
+        'age_bracket': 'COLLEGE'
+    }
+    # The page isn't cached while the teams are being crawled.
+    self.SetHtmlResponse(FAKE_TOURNEY_SCORES_PAGE)
+    response = self.testapp.get('/tasks/sr/crawl_tournament', params=params)
+    self.assertEqual(200, response.status_int)
+    self.assertEquals(2, len(mock_add_queue.mock_calls))
+
+    game_model.TeamIdLookup(
+        score_reporter_id='123',
+        score_reporter_tourney_id=['8%3d']).put()
+    game_model.TeamIdLookup(
+        score_reporter_id='456',
+        score_reporter_tourney_id=['g%3d']).put()
+    self.SetHtmlResponse(FAKE_TOURNEY_SCORES_PAGE)
+    response = self.testapp.get('/tasks/sr/crawl_tournament', params=params)
+    self.assertEqual(200, response.status_int)
+    self.assertEqual(1, len(game_model.Game.query().fetch(1000)))
+
+    self.SetHtmlResponse(FAKE_TOURNEY_SCORES_PAGE)
+    with mock.patch.object(score_reporter_crawler.ScoreReporterCrawler,
+        'ParseGameInfos') as mock_parse:
+      response = self.testapp.get('/tasks/sr/crawl_tournament', params=params)
+    self.assertEqual(200, response.status_int)
+    self.assertEquals([], mock_parse.mock_calls)
+
+  @mock.patch.object(score_reporter_handler, 'FetchUsauPage')
+  def testFetchChangedUsauPage_conditional(self, mock_fetch_page):
+    mock_fetch_page.return_value = http_transport.Response(200, 'page',
+        {'ETag': '"v1"', 'Last-Modified': 'Wed, 01 Jun 2016 00:00:00 GMT'})
+    response, page_cache = score_reporter_handler.FetchChangedUsauPage('t')
+    self.assertEquals('page', response.content)
+    page_cache.put()
+
+    mock_fetch_page.return_value = http_transport.Response(304, '', {})
+    response, page_cache = score_reporter_handler.FetchChangedUsauPage('t')
+    self.assertEquals(None, response)
+    self.assertEquals('"v1"', page_cache.etag)
+    self.assertEquals(mock.call('t', headers={
+      'Accept-Encoding': 'gzip',
+      'If-None-Match': '"v1"',
+      'If-Modified-Since': 'Wed, 01 Jun 2016 00:00:00 GMT',
+    }), mock_fetch_page.call_args)
+
+  @mock.patch.object(score_reporter_handler, 'FetchUsauPage')
+  def testFetchChangedUsauPage_notModifiedWithoutCache(self, mock_fetch_page):
+    mock_fetch_page.return_value = http_transport.Response(304, '', {})
+    self.assertRaises(score_reporter_handler.FetchError,
+        score_reporter_handler.FetchChangedUsauPage, 't')
+
+  def testFetchUsauPage_gzip(self):
+    content = StringIO.StringIO()
+    with gzip.GzipFile(fileobj=content, mode='wb') as f:
+      f.write(FAKE_LANDING_PAGE)
+    with mock.patch.object(http_transport.Transport, 'Fetch',
+        return_value=http_transport.Response(200, content.getvalue(),
+          {'Content-Encoding': 'gzip'})):
+      response = score_reporter_handler.FetchUsauPage('t')
+    self.assertEquals(FAKE_LANDING_PAGE, response.content)
+
   @mock.patch.object(score_reporter_handler, 'FetchUsauPage')
   @mock.patch.object(taskqueue, 'add')
   def testParseTourneyScores_urlEncoded(self, mock_add_queue, mock_fetch_page):
@@ -559,7 +658,8 @@ class ScoreReporterHandlerTest(web_test_base.WebTestBase):
     calls = mock_fetch_page.mock_calls
 
     self.assertEqual(calls[0], mock.call(
-      'US-Open-Ultimate-Championships-2015//schedule/Women/Club-Women/'))
+      'US-Open-Ultimate-Championships-2015//schedule/Women/Club-Women/',
+      headers={'Accept-Encoding': 'gzip'}))
 
   @mock.patch.object(taskqueue, 'add')
   def testParseTourneyScores_badParams(self, mock_add_queue):
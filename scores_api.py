@@ -211,11 +211,12 @@ class ScoresApi(remote.Service):
     """
     response = TweetsResponse()
     response.tweets = []
-    for tweet in self._LookupTweets(request):
-      # Only return tweets with geo-coded response
-      #if not tweet.geo:
-        #continue
-      response.tweets.append(tweet.original_json)
+    twts = self._LookupTweets(request)
+    # Only return tweets with geo-coded response
+    #twts = [t for t in twts if t.geo]
+    for raw_json in tweets.Tweet.GetOriginalJsonMulti(twts):
+      if raw_json:
+        response.tweets.append(raw_json)
     return response
 
   @staticmethod
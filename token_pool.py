@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Martin Cochran
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Pool of the credentials of every registered Twitter app.
+
+Twitter rate limits each app separately, so spreading the requests over
+several apps multiplies the number of requests which can be made in each
+window. For every request the pool leases the credential with the most
+requests left for the endpoint, according to the buckets kept by
+rate_limiter.RateLimiter for each credential.
+
+A credential which gets a 429 response has its bucket for the endpoint
+emptied until the window resets, so it isn't leased for that endpoint again
+until then. A credential whose token is rejected and can't be renewed is
+retired for RETIRE_SECS.
+"""
+
+import logging
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import rate_limiter
+
+TOKEN_POOL_NAMESPACE = 'token_pool'
+RETIRED_KEY_PREFIX = 'retired_'
+
+# Seconds for which a credential that failed to authenticate is not leased.
+RETIRE_SECS = 15 * 60
+
+
+class TokenPool(object):
+  """Leases the app credential with the most headroom for each request."""
+
+  def __init__(self, token_manager, limiter=None):
+    """Initializes the pool.
+
+    Args:
+      token_manager: oauth_token_manager.OauthTokenManager with the
+        credentials.
+      limiter: rate_limiter.RateLimiter with the buckets of the credentials.
+        Defaults to one using the wall clock.
+    """
+    self.token_manager = token_manager
+    self.rate_limiter = limiter or rate_limiter.RateLimiter()
+
+  def Lease(self, endpoint):
+    """Picks the credential to make a request to the endpoint with.
+
+    See LeaseAsync.
+    """
+    return self.LeaseAsync(endpoint).get_result()
+
+  @ndb.tasklet
+  def LeaseAsync(self, endpoint):
+    """Picks the credential to make a request to the endpoint with.
+
+    Args:
+      endpoint: Path of the API endpoint, eg '/lists/statuses.json'.
+    Returns:
+      An ndb.Future for a (credential, retry_after_secs) pair. If a request
+      could be counted against one of the credentials, that
+      oauth_token_manager.Credential is returned and retry_after_secs is 0.
+      Otherwise credential is None and retry_after_secs is the number of
+      seconds until a credential can make requests to the endpoint again.
+    """
+    credentials = yield self._ActiveCredentialsAsync()
+    states = yield self.rate_limiter.RemainingAsync(endpoint,
+        [c.credential_id for c in credentials])
+
+    # Most requests left first. Ties go to the newest secret.
+    order = sorted(range(len(credentials)), key=lambda i: -states[i][0])
+    retry_after_secs = None
+    for i in order:
+      remaining, secs_until_reset = states[i]
+      if remaining > 0:
+        secs_until_reset = yield self.rate_limiter.AcquireAsync(endpoint,
+            credential_id=credentials[i].credential_id)
+        if not secs_until_reset:
+          raise ndb.Return((credentials[i], 0))
+      if retry_after_secs is None or secs_until_reset < retry_after_secs:
+        retry_after_secs = secs_until_reset
+    raise ndb.Return((None, retry_after_secs))
+
+  def Retire(self, credential, secs=RETIRE_SECS):
+    """Stops leasing the credential for a while.
+
+    Args:
+      credential: oauth_token_manager.Credential which failed to
+        authenticate.
+      secs: Seconds for which the credential is not leased.
+    """
+    logging.warning('Retiring credential %s for %d seconds',
+        credential.credential_id, secs)
+    memcache.set(self._RetiredKey(credential), True, time=secs,
+        namespace=TOKEN_POOL_NAMESPACE)
+
+  @ndb.tasklet
+  def _ActiveCredentialsAsync(self):
+    """Returns the credentials which are not retired.
+
+    If every credential is retired they are all returned, so that requests
+    keep trying to reauthenticate.
+    """
+    credentials = yield self.token_manager.GetCredentialsAsync()
+    if len(credentials) == 1:
+      raise ndb.Return(credentials)
+    retired = yield memcache.Client().get_multi_async(
+        [self._RetiredKey(c) for c in credentials],
+        namespace=TOKEN_POOL_NAMESPACE)
+    retired = retired or {}
+    active = [c for c in credentials if not retired.get(self._RetiredKey(c))]
+    if not active:
+      logging.warning('All %d credentials are retired', len(credentials))
+      raise ndb.Return(credentials)
+    raise ndb.Return(active)
+
+  def _RetiredKey(self, credential):
+    return '%s%s' % (RETIRED_KEY_PREFIX, credential.credential_id)
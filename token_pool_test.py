@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Martin Cochran
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import base64
+import unittest
+
+import test_env_setup
+
+from google.appengine.ext import testbed
+
+import oauth_token_manager
+import rate_limiter
+import token_pool
+
+ENDPOINT = '/lists/statuses.json'
+
+
+class TokenPoolTest(unittest.TestCase):
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+    self.testbed.init_datastore_v3_stub()
+    oauth_token_manager.ClearCredentialsCache()
+
+    self.now = 1000.0
+    self.limiter = rate_limiter.RateLimiter(clock=lambda: self.now)
+    self.token_manager = oauth_token_manager.OauthTokenManager()
+    self.pool = token_pool.TokenPool(self.token_manager, limiter=self.limiter)
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def _AddApps(self, *names):
+    """Adds a secret and a token for each app, returns their credentials."""
+    for name in names:
+      self.token_manager.AddSecret(base64.b64encode('%s:secret' % name))
+      credential = self.token_manager.GetCredentials()[0]
+      self.token_manager.AddToken('%s token' % name,
+          secret_id=credential.credential_id)
+    return self.token_manager.GetCredentials()
+
+  def testLease_singleCredential(self):
+    """Verify the newest token is used when no secrets are stored."""
+    self.token_manager.AddToken('token')
+    credential, retry_after_secs = self.pool.Lease(ENDPOINT)
+    self.assertEquals(oauth_token_manager.Credential(None, '', 'token'),
+        credential)
+    self.assertEquals(0, retry_after_secs)
+    self.assertEquals(900, self.limiter.SecondsUntilReset(ENDPOINT))
+
+  def testLease_mostHeadroom(self):
+    credential_b, credential_a = self._AddApps('a', 'b')
+
+    # Ties go to the newest secret.
+    self.assertEquals(credential_b, self.pool.Lease(ENDPOINT)[0])
+
+    self.limiter.UpdateFromHeaders(ENDPOINT, {
+      'x-rate-limit-remaining': '10', 'x-rate-limit-reset': '1600'},
+      credential_id=credential_b.credential_id)
+    self.limiter.UpdateFromHeaders(ENDPOINT, {
+      'x-rate-limit-remaining': '50', 'x-rate-limit-reset': '1600'},
+      credential_id=credential_a.credential_id)
+    self.assertEquals(credential_a, self.pool.Lease(ENDPOINT)[0])
+    self.assertEquals([(10, 600), (49, 600)], self.limiter.Remaining(ENDPOINT,
+      [credential_b.credential_id, credential_a.credential_id]))
+
+    # Other endpoints have their own buckets.
+    self.assertEquals(credential_b,
+        self.pool.Lease('/users/lookup.json')[0])
+
+  def testLease_exhausted(self):
+    credential_b, credential_a = self._AddApps('a', 'b')
+    self.limiter.MarkExhausted(ENDPOINT, reset=1300.0,
+        credential_id=credential_b.credential_id)
+    self.assertEquals(credential_a, self.pool.Lease(ENDPOINT)[0])
+
+    self.limiter.MarkExhausted(ENDPOINT, reset=1100.0,
+        credential_id=credential_a.credential_id)
+    self.assertEquals((None, 100), self.pool.Lease(ENDPOINT))
+
+    self.now = 1100.0
+    self.assertEquals(credential_a, self.pool.Lease(ENDPOINT)[0])
+
+  def testLeaseAsync_concurrent(self):
+    """Verify concurrent leases don't take the same last request."""
+    credential_b, credential_a = self._AddApps('a', 'b')
+    self.limiter.UpdateFromHeaders(ENDPOINT, {
+      'x-rate-limit-remaining': '1', 'x-rate-limit-reset': '1600'},
+      credential_id=credential_b.credential_id)
+    self.limiter.UpdateFromHeaders(ENDPOINT, {
+      'x-rate-limit-remaining': '1', 'x-rate-limit-reset': '1600'},
+      credential_id=credential_a.credential_id)
+
+    futures = [self.pool.LeaseAsync(ENDPOINT) for _ in range(3)]
+    leases = [future.get_result() for future in futures]
+    self.assertEquals(sorted([(credential_a.credential_id, 0),
+      (credential_b.credential_id, 0), (None, 600)]),
+      sorted([(c and c.credential_id, secs) for c, secs in leases]))
+
+  def testRetire(self):
+    credential_b, credential_a = self._AddApps('a', 'b')
+    self.pool.Retire(credential_b)
+    self.assertEquals(credential_a, self.pool.Lease(ENDPOINT)[0])
+    self.assertEquals(credential_a, self.pool.Lease(ENDPOINT)[0])
+
+    # If every credential is retired they are all leased again.
+    self.pool.Retire(credential_a)
+    self.assertEquals(credential_b, self.pool.Lease(ENDPOINT)[0])
+
+
+if __name__ == '__main__':
+  unittest.main()
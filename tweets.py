@@ -15,18 +15,63 @@
 # limitations under the License.
 #
 
+import bisect
+import collections
 import datetime
 import logging
 import json
 import os
 import re
+import struct
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import users
 from google.appengine.ext import ndb
 
 DEFAULT_TWEET_DB_NAME = 'tweet_db'
 DEFAULT_AUTHOR_DB_NAME = 'author_db'
 
+# How the raw JSON of each tweet is stored:
+# - RAW_JSON_INLINE: in the original_json property of the Tweet itself.
+# - RAW_JSON_SEPARATE: in a RawTweet entity keyed by tweet id, so that the
+#   Tweet entities read by queries stay small.
+# - RAW_JSON_PROJECTED: like RAW_JSON_SEPARATE, but only RAW_JSON_FIELDS are
+#   kept.
+RAW_JSON_INLINE = 'inline'
+RAW_JSON_SEPARATE = 'separate'
+RAW_JSON_PROJECTED = 'projected'
+RAW_JSON_STORAGE = RAW_JSON_SEPARATE
+
+# Fields of the status JSON kept with RAW_JSON_PROJECTED. The nested user
+# object, which is most of the size of a status, is reduced to its ids.
+RAW_JSON_FIELDS = ['id', 'id_str', 'created_at', 'text', 'entities', 'geo',
+    'place', 'lang', 'in_reply_to_status_id_str', 'in_reply_to_user_id_str',
+    'retweet_count', 'favorite_count']
+RAW_JSON_USER_FIELDS = ['id', 'id_str', 'screen_name']
+
+# How the entities of each tweet are stored:
+# - ENTITIES_STRUCTURED: as repeated structured properties of the Tweet.
+# - ENTITIES_PACKED: packed into one unindexed blob by PackEntities, which is
+#   smaller and faster to decode.
+# Either way they are read and written through Tweet.entities, and tweets
+# stored one way can still be read after switching to the other.
+ENTITIES_STRUCTURED = 'structured'
+ENTITIES_PACKED = 'packed'
+ENTITY_STORAGE = ENTITIES_STRUCTURED
+
+# Datastore names of the only Tweet and User properties which are indexed.
+# Every indexed value costs index writes on each put, so everything else is
+# declared with indexed=False. A property must be added here (and to its
+# model) before it is used in a query or in index.yaml, and existing
+# entities need to be rewritten with /accounts/reindex.
+TWEET_INDEXED_PROPERTIES = frozenset(['an', 'cd', 'fl', 'tom'])
+USER_INDEXED_PROPERTIES = frozenset(['id', 'id_64', 'sn'])
+
+# Tweet ids start with the time the tweet was created, in ms since
+# TWEET_ID_EPOCH_MS, above the low TWEET_ID_TIME_SHIFT bits.
+TWEET_ID_EPOCH_MS = 1288834974657L
+TWEET_ID_TIME_SHIFT = 22
+
 # Example data: 'Wed Dec 10 21:00:24 2014'
 DATE_PARSE_FMT_STR = '%a %b %d %H:%M:%S %Y'
 
@@ -45,6 +90,47 @@ def tweet_key(tweet_id, tweet_table_name=DEFAULT_TWEET_DB_NAME):
   return ndb.Key('Tweet', '%s_%s' % (tweet_table_name, tweet_id)) 
 
 
+def raw_tweet_key(tweet_id):
+  """Returns the key of the RawTweet entity for a tweet.
+
+  It's in the entity group of the tweet, so both are written in the same
+  transaction when a tweet is inserted.
+  """
+  return ndb.Key('RawTweet', tweet_id, parent=tweet_key(tweet_id))
+
+
+def ProjectRawJson(json_obj):
+  """Returns the subset of a status JSON object kept by RAW_JSON_PROJECTED."""
+  projected = dict([(k, json_obj[k]) for k in RAW_JSON_FIELDS if k in json_obj])
+  user = json_obj.get('user')
+  if user:
+    projected['user'] = dict(
+        [(k, user[k]) for k in RAW_JSON_USER_FIELDS if k in user])
+  return projected
+
+
+def user_entity_key(user_id):
+  """Returns the key of the User entity itself, as built by FromJson."""
+  return ndb.Key('User', user_id, parent=user_key(user_id))
+
+
+def tweet_entity_key(tweet_id):
+  """Returns the key of the Tweet entity itself, as built by FromJson."""
+  return ndb.Key('Tweet', tweet_id, parent=tweet_key(tweet_id))
+
+
+MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12,
+}
+
+WEEKDAYS = frozenset(['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'])
+
+# Parsed UTC offsets by offset string, eg '+0000'. There are few distinct
+# offsets, so this stays small.
+_UTC_OFFSETS = {}
+
+
 def ParseTweetDateString(date_str, tweet_id='', user_id=''):
   """Parses a date string from a tweet, returning 'utcnow' on failure.
 
@@ -57,6 +143,58 @@ def ParseTweetDateString(date_str, tweet_id='', user_id=''):
     id_value, date_type = CalculateDateType(tweet_id, user_id)
     logging.warning('Empty creation date in %s id %s', date_type, id_value)
     return datetime.datetime.utcnow()
+  dt = ParseFixedFormatDateString(date_str)
+  if dt:
+    return dt
+  return ParseDateStringWithStrptime(date_str, tweet_id=tweet_id,
+      user_id=user_id)
+
+
+def ParseFixedFormatDateString(date_str):
+  """Parses a date string in exactly the format used by the Twitter API.
+
+  This is much faster than strptime, which is only needed for date strings
+  which deviate from the format.
+
+  Args:
+    date_str: The date string to be parsed, eg 'Wed Dec 10 21:00:24 +0000 2014'.
+  Returns:
+    The date in UTC, or None if date_str is not in the expected format.
+  """
+  if (len(date_str) != 30 or date_str[3] != ' ' or date_str[7] != ' ' or
+      date_str[10] != ' ' or date_str[13] != ':' or date_str[16] != ':' or
+      date_str[19] != ' ' or date_str[25] != ' '):
+    return None
+  month = MONTHS.get(date_str[4:7])
+  if not month or date_str[:3] not in WEEKDAYS:
+    return None
+  if not (date_str[8:10] + date_str[11:13] + date_str[14:16] +
+      date_str[17:19] + date_str[26:30]).isdigit():
+    return None
+
+  td_str = date_str[20:25]
+  td = _UTC_OFFSETS.get(td_str)
+  if td is None:
+    if td_str[0] not in ['-', '+'] or not td_str[1:].isdigit():
+      return None
+    td = ParseUtcTimeDelta(td_str)
+    _UTC_OFFSETS[td_str] = td
+
+  try:
+    return datetime.datetime(int(date_str[26:30]), month, int(date_str[8:10]),
+        int(date_str[11:13]), int(date_str[14:16]), int(date_str[17:19])) + td
+  except ValueError:
+    return None
+
+
+def ParseDateStringWithStrptime(date_str, tweet_id='', user_id=''):
+  """Parses a date string with strptime, returning 'utcnow' on failure.
+
+  Args:
+    date_str: The non-empty date string to be parsed.
+    tweet_id: The id of the tweet this date is being parsed from.
+    user_id: The id of the user this date is being parsed from.
+  """
   try:
     # Convert to UTC time by manually parsing the timedelta because it is not
     # supported on all platforms.
@@ -100,6 +238,13 @@ def WriteTweetDateString(dt):
   return '%s +0000 %s' % (dt.strftime('%a %b %d %H:%M:%S'), dt.strftime('%Y'))
 
 
+def TweetIdAt(dt):
+  """Returns the smallest id of a tweet created at the UTC datetime dt."""
+  td = dt - datetime.datetime(1970, 1, 1)
+  ms = (td.days * 86400 + td.seconds) * 1000L + td.microseconds / 1000
+  return max(0L, ms - TWEET_ID_EPOCH_MS) << TWEET_ID_TIME_SHIFT
+
+
 def CalculateDateType(tweet_id, user_id):
   id_value = tweet_id or user_id
   if tweet_id:
@@ -107,6 +252,18 @@ def CalculateDateType(tweet_id, user_id):
   return ('user', id_value)
 
 
+# Matches the numbers in a tweet which could be scores: at most 3 characters of
+# digits, possibly ending in a '.' or ',' (eg, "We won 15-13."). The match may
+# not be part of a longer run of digits and ':.,' characters (big numbers,
+# times, decimals, numbers with commas) or follow a '$' (money amounts).
+INTEGER_RE = re.compile(r'(?<![\d:.,$])(?:(\d{1,3})|(\d{1,2})[.,])(?![\d:.,])')
+
+
+# An integer parsed from the text of a tweet, as a plain tuple.
+IntegerSpan = collections.namedtuple('IntegerSpan',
+    ['num', 'start_idx', 'end_idx'])
+
+
 def ParseIntegersFromTweet(entities, tweet_text):
   """Parses integers that don't occur in other entities.
 
@@ -118,50 +275,77 @@ def ParseIntegersFromTweet(entities, tweet_text):
     A possibly empty list of IntegerEntity objects
   """
   ies = []
-  if not tweet_text:
-    return []
-  for item in re.finditer(r'\$?[\d:.,]+', tweet_text):
-    # Don't worry about big numbers - they're not scores
-    if len(item.group(0)) > 3:
-      continue
+  for span in ParseIntegerSpans(tweet_text, entities.NonIntegerEntityMask):
+    ies.append(IntegerEntity(num=span.num, start_idx=span.start_idx,
+      end_idx=span.end_idx))
+  return ies
 
-    # If we didn't match any numbers, move on
-    if not re.findall(r'\d+', item.group(0)):
-      continue
 
-    # Don't worry about money amounts
-    if '$' in item.group(0)[0]:
-      continue
+def ParseIntegerSpans(tweet_text, mask_fn):
+  """Parses integers that don't occur in other entities.
 
-    # Numbers with commas are not scores, but don't worry about trailing commas
-    if '.' in item.group(0)[:-1]:
-      continue
+  Args:
+    tweet_text: The text of the tweet.
+    mask_fn: Function returning the EntityMask of the other entities in the
+      tweet. It's only called if the text contains any candidate integers.
 
-    # Neither are decimal numbers
-    if ',' in item.group(0)[:-1]:
+  Returns:
+    A possibly empty list of IntegerSpan tuples.
+  """
+  if not tweet_text:
+    return []
+  spans = []
+  mask = None
+  for item in INTEGER_RE.finditer(tweet_text):
+    if mask is None:
+      mask = mask_fn()
+    start_idx = item.start(0)
+    # Don't worry about numbers in other entities
+    if mask.Contains(start_idx):
       continue
+    number_text = item.group(1) or item.group(2)
+    spans.append(IntegerSpan(long(number_text), start_idx,
+      start_idx + len(number_text)))
 
-    # Neither are decimal numbers
-    if ':' in item.group(0):
-      continue
+  return spans
 
-    # Don't worry about numbers in other entities
-    if entities.IsIndexInEntities(item.start(0), item.end(0)):
-      continue
-    ie = IntegerEntity()
-    number_text = item.group(0)
-    end_offset = 0
-    if number_text[-1] in ['.', ',']:
-      number_text = number_text[:-1]
-      end_offset = -1
 
-    ie.num = long(number_text)
-    ie.start_idx = int(item.start(0))
-    ie.end_idx = int(item.end(0) + end_offset)
+class EntityMask(object):
+  """Sorted, disjoint character intervals covered by entities in a tweet."""
 
-    ies.append(ie)
+  def __init__(self, intervals):
+    """Initializes the mask.
 
-  return ies
+    Args:
+      intervals: Iterable of (start_idx, end_idx) pairs. Each interval covers
+        start_idx up to but not including end_idx, and they may overlap.
+    """
+    self.starts = []
+    self.ends = []
+    for (start_idx, end_idx) in sorted(intervals):
+      if end_idx <= start_idx:
+        continue
+      if self.ends and start_idx <= self.ends[-1]:
+        self.ends[-1] = max(self.ends[-1], end_idx)
+        continue
+      self.starts.append(start_idx)
+      self.ends.append(end_idx)
+
+  @classmethod
+  def FromJson(cls, json_obj):
+    """Builds the mask of the entities in the 'entities' tag of a status."""
+    intervals = []
+    for entity_type in ['hashtags', 'user_mentions', 'urls', 'media']:
+      for entity in json_obj.get(entity_type, []):
+        indices = entity.get('indices', [])
+        if len(indices) >= 2:
+          intervals.append((indices[0], indices[1]))
+    return cls(intervals)
+
+  def Contains(self, idx):
+    """Returns True iff the character at idx is covered by an entity."""
+    i = bisect.bisect_right(self.starts, idx) - 1
+    return i >= 0 and idx < self.ends[i]
 
 
 def ParseGeoData(json_obj):
@@ -185,15 +369,15 @@ def ParsePlaceId(json_obj):
 
 class UserMentionEntity(ndb.Model):
   """Information about the mention of a user in a tweet."""
-  user_id = ndb.StringProperty('id', required=True)
+  user_id = ndb.StringProperty('id', required=True, indexed=False)
 
   # ID property as a 64-bit signed int. This will eventually replace user_id as
   # the main property.
-  user_id_64 = ndb.IntegerProperty('id_64')
+  user_id_64 = ndb.IntegerProperty('id_64', indexed=False)
 
   # The character positions in the tweet where this entity started and ended.
-  start_idx = ndb.IntegerProperty('si')
-  end_idx = ndb.IntegerProperty('ei')
+  start_idx = ndb.IntegerProperty('si', indexed=False)
+  end_idx = ndb.IntegerProperty('ei', indexed=False)
 
   @classmethod
   def fromJson(cls, json_obj):
@@ -221,8 +405,8 @@ class UrlMentionEntity(ndb.Model):
   expanded_url = ndb.StringProperty('eu', indexed=False)
 
   # The character positions in the tweet where this entity started and ended.
-  start_idx = ndb.IntegerProperty('si')
-  end_idx = ndb.IntegerProperty('ei')
+  start_idx = ndb.IntegerProperty('si', indexed=False)
+  end_idx = ndb.IntegerProperty('ei', indexed=False)
 
   @classmethod
   def fromJson(cls, json_obj):
@@ -242,11 +426,11 @@ class UrlMentionEntity(ndb.Model):
 
 class HashTagEntity(ndb.Model):
   """Information about a hashtag in the tweet."""
-  text = ndb.StringProperty()
+  text = ndb.StringProperty(indexed=False)
 
   # The character positions in the tweet where this entity started and ended.
-  start_idx = ndb.IntegerProperty('si')
-  end_idx = ndb.IntegerProperty('ei')
+  start_idx = ndb.IntegerProperty('si', indexed=False)
+  end_idx = ndb.IntegerProperty('ei', indexed=False)
 
   @classmethod
   def fromJson(cls, json_obj):
@@ -268,8 +452,8 @@ class MediaEntity(ndb.Model):
   id_str = ndb.StringProperty(indexed=False)
 
   # The character positions in the tweet where this entity started and ended.
-  start_idx = ndb.IntegerProperty('si')
-  end_idx = ndb.IntegerProperty('ei')
+  start_idx = ndb.IntegerProperty('si', indexed=False)
+  end_idx = ndb.IntegerProperty('ei', indexed=False)
 
   @classmethod
   def fromJson(cls, json_obj):
@@ -291,11 +475,11 @@ class IntegerEntity(ndb.Model):
   Note: this is *not* returned from the Twitter API, but it's important enough
   for Score minion that we parse it out for each tweet.
   """
-  num = ndb.IntegerProperty()
+  num = ndb.IntegerProperty(indexed=False)
 
   # The character positions in the tweet where this entity started and ended.
-  start_idx = ndb.IntegerProperty('si')
-  end_idx = ndb.IntegerProperty('ei')
+  start_idx = ndb.IntegerProperty('si', indexed=False)
+  end_idx = ndb.IntegerProperty('ei', indexed=False)
 
 
 class Entities(ndb.Model):
@@ -310,22 +494,15 @@ class Entities(ndb.Model):
   media = ndb.StructuredProperty(MediaEntity, 'me', repeated=True)
   integers = ndb.StructuredProperty(IntegerEntity, 'n', repeated=True)
 
-  def IsIndexInEntities(self, start_idx, end_idx):
-    """Returns True if this interval overlaps with another non-Integer entity interval."""
-    for hashtag in self.hashtags:
-      if start_idx >= hashtag.start_idx and start_idx < hashtag.end_idx:
-        return True
-    for um in self.user_mentions:
-      if start_idx >= um.start_idx and start_idx < um.end_idx:
-        return True
-    for um in self.url_mentions:
-      if start_idx >= um.start_idx and start_idx < um.end_idx:
-        return True
-    for ment in self.media:
-      if start_idx >= ment.start_idx and start_idx < ment.end_idx:
-        return True
-    # Don't worry about integers because this is called by the integer-parsing code.
-    return False
+  def NonIntegerEntityMask(self):
+    """Returns an EntityMask of all entities except the integers."""
+    intervals = []
+    for entity_list in [self.hashtags, self.user_mentions, self.url_mentions,
+        self.media]:
+      for entity in entity_list:
+        if entity.start_idx is not None and entity.end_idx is not None:
+          intervals.append((entity.start_idx, entity.end_idx))
+    return EntityMask(intervals)
 
   # Major field this class is ignoring: media
   @classmethod
@@ -360,16 +537,218 @@ class Entities(ndb.Model):
     return entities
 
 
+# Version byte at the start of every blob written by PackEntities.
+PACKED_ENTITIES_VERSION = 1
+
+# Version byte and the number of hashtags, user mentions, url mentions, media
+# and integers.
+_PACKED_HEADER = struct.Struct('<B5H')
+
+# Stand-ins for None in the packed indices, integers and string lengths.
+_PACKED_NONE_INDEX = 0xFFFF
+_PACKED_NONE_LONG = -2 ** 63
+_PACKED_NONE_STRING = 0xFFFF
+
+
+def _PackIndex(idx):
+  if idx is None:
+    return _PACKED_NONE_INDEX
+  return idx
+
+
+def _UnpackIndex(idx):
+  if idx == _PACKED_NONE_INDEX:
+    return None
+  return idx
+
+
+def _PackLong(num):
+  if num is None:
+    return _PACKED_NONE_LONG
+  return num
+
+
+def _UnpackLong(num):
+  if num == _PACKED_NONE_LONG:
+    return None
+  return num
+
+
+def _PackString(value):
+  if value is None:
+    return struct.pack('<H', _PACKED_NONE_STRING)
+  if isinstance(value, unicode):
+    value = value.encode('utf-8')
+  return struct.pack('<H', len(value)) + value
+
+
+def _UnpackString(data, offset):
+  """Returns the string at offset and the offset just past it."""
+  (length,) = struct.unpack_from('<H', data, offset)
+  offset += 2
+  if length == _PACKED_NONE_STRING:
+    return None, offset
+  return data[offset:offset + length].decode('utf-8'), offset + length
+
+
+def PackEntities(entities):
+  """Packs an Entities object into a compact binary string.
+
+  The format is a version byte, the number of each type of entity, the start
+  and end index of every entity, then the other fields of each entity in
+  order. Strings are utf-8 with a 2-byte length prefix.
+
+  Args:
+    entities: Entities object.
+  Returns:
+    The packed string, which UnpackEntities turns back into Entities.
+  """
+  groups = [entities.hashtags, entities.user_mentions, entities.url_mentions,
+      entities.media, entities.integers]
+  parts = [_PACKED_HEADER.pack(PACKED_ENTITIES_VERSION,
+    *[len(g) for g in groups])]
+  spans = []
+  for group in groups:
+    for entity in group:
+      spans.append(_PackIndex(entity.start_idx))
+      spans.append(_PackIndex(entity.end_idx))
+  parts.append(struct.pack('<%dH' % len(spans), *spans))
+  for hashtag in entities.hashtags:
+    parts.append(_PackString(hashtag.text))
+  for user_mention in entities.user_mentions:
+    parts.append(struct.pack('<q', _PackLong(user_mention.user_id_64)))
+    parts.append(_PackString(user_mention.user_id))
+  for url_mention in entities.url_mentions:
+    parts.append(_PackString(url_mention.url))
+    parts.append(_PackString(url_mention.display_url))
+    parts.append(_PackString(url_mention.expanded_url))
+  for media in entities.media:
+    parts.append(_PackString(media.url_https))
+    parts.append(_PackString(media.id_str))
+  parts.append(struct.pack('<%dq' % len(entities.integers),
+    *[_PackLong(ie.num) for ie in entities.integers]))
+  return ''.join(parts)
+
+
+def UnpackEntities(data):
+  """Unpacks a string written by PackEntities.
+
+  Args:
+    data: The packed string.
+  Returns:
+    An Entities object.
+  Raises:
+    ValueError if the string is from an unknown version of PackEntities.
+  """
+  header = _PACKED_HEADER.unpack_from(data, 0)
+  if header[0] != PACKED_ENTITIES_VERSION:
+    raise ValueError('Unknown packed entities version: %d' % header[0])
+  num_hashtags, num_user_mentions, num_url_mentions, num_media, num_ints = (
+      header[1:])
+  offset = _PACKED_HEADER.size
+  num_spans = 2 * sum(header[1:])
+  spans = [_UnpackIndex(i)
+      for i in struct.unpack_from('<%dH' % num_spans, data, offset)]
+  offset += 2 * num_spans
+  span_iter = iter(spans)
+
+  entities = Entities()
+  for _ in range(num_hashtags):
+    text, offset = _UnpackString(data, offset)
+    entities.hashtags.append(HashTagEntity(text=text,
+      start_idx=next(span_iter), end_idx=next(span_iter)))
+  for _ in range(num_user_mentions):
+    (user_id_64,) = struct.unpack_from('<q', data, offset)
+    user_id, offset = _UnpackString(data, offset + 8)
+    entities.user_mentions.append(UserMentionEntity(user_id=user_id,
+      user_id_64=_UnpackLong(user_id_64), start_idx=next(span_iter),
+      end_idx=next(span_iter)))
+  for _ in range(num_url_mentions):
+    url, offset = _UnpackString(data, offset)
+    display_url, offset = _UnpackString(data, offset)
+    expanded_url, offset = _UnpackString(data, offset)
+    entities.url_mentions.append(UrlMentionEntity(url=url,
+      display_url=display_url, expanded_url=expanded_url,
+      start_idx=next(span_iter), end_idx=next(span_iter)))
+  for _ in range(num_media):
+    url_https, offset = _UnpackString(data, offset)
+    id_str, offset = _UnpackString(data, offset)
+    entities.media.append(MediaEntity(url_https=url_https, id_str=id_str,
+      start_idx=next(span_iter), end_idx=next(span_iter)))
+  nums = struct.unpack_from('<%dq' % num_ints, data, offset)
+  entities.integers = [IntegerEntity(num=_UnpackLong(num),
+    start_idx=next(span_iter), end_idx=next(span_iter)) for num in nums]
+  return entities
+
+
+class PackedEntitiesProperty(ndb.BlobProperty):
+  """Stores an Entities object in one blob, packed with PackEntities."""
+
+  def _validate(self, value):
+    if not isinstance(value, Entities):
+      raise TypeError('Expected Entities, got %r' % (value,))
+
+  def _to_base_type(self, value):
+    return PackEntities(value)
+
+  def _from_base_type(self, value):
+    return UnpackEntities(value)
+
+
+class ListIdProperty(ndb.IntegerProperty):
+  """A Twitter list id, stored as an integer.
+
+  List ids are numeric strings in the API and in the rest of the app, so the
+  property takes and returns strings. Values written when list ids were
+  stored as strings are still read; /accounts/reindex rewrites them.
+  """
+
+  def _validate(self, value):
+    if not isinstance(value, basestring) or not value.isdigit():
+      raise datastore_errors.BadValueError(
+          'Expected a numeric list id, got %r' % (value,))
+
+  def _to_base_type(self, value):
+    return long(value)
+
+  def _from_base_type(self, value):
+    return str(value)
+
+  def _db_get_value(self, v, p):
+    if v.has_stringvalue():
+      # Written by the StringProperty this replaced.
+      if not v.stringvalue().isdigit():
+        return None
+      return long(v.stringvalue())
+    return super(ListIdProperty, self)._db_get_value(v, p)
+
+
+def _EntitiesArgs(entities):
+  """Returns the Tweet constructor args to store entities per ENTITY_STORAGE."""
+  if ENTITY_STORAGE == ENTITIES_PACKED:
+    return {'packed_entities': entities}
+  return {'structured_entities': entities}
+
+
+class RawTweet(ndb.Model):
+  """The raw JSON of a tweet, stored apart from the Tweet entity.
+
+  Only the few callers which return the original status need this, so it's
+  kept out of the Tweet to keep Tweet queries cheap. See RAW_JSON_STORAGE.
+  """
+  json = ndb.TextProperty('j', compressed=True)
+
+
 class Tweet(ndb.Model):
   """Models an individual Tweet diplayed in a timeline.
   
   More info: https://dev.twitter.com/overview/api/tweets
   """
   # Author of the tweet
-  author_id = ndb.StringProperty('a', required=True)
+  author_id = ndb.StringProperty('a', required=True, indexed=False)
 
   # 64-bit integer form of author ID
-  author_id_64 = ndb.IntegerProperty('a64')
+  author_id_64 = ndb.IntegerProperty('a64', indexed=False)
 
   # Screen name of the author
   author_screen_name = ndb.StringProperty('an', required=True)
@@ -379,28 +758,28 @@ class Tweet(ndb.Model):
 
   # ID property as a 64-bit signed int. This will eventually replace id_str as
   # the main property.
-  id_64 = ndb.IntegerProperty()
+  id_64 = ndb.IntegerProperty(indexed=False)
 
   # 64-bit, unique, stable id, but Keys should use strings, not ints, to avoid
   # key collisions with keys picked by the datastore
   # See: https://cloud.google.com/appengine/docs/python/ndb/entities#numeric_keys
-  id_str = ndb.StringProperty('id', required=True)
+  id_str = ndb.StringProperty('id', required=True, indexed=False)
 
   # Text of tweet
-  text = ndb.StringProperty('t')
+  text = ndb.StringProperty('t', indexed=False)
 
   # Client used to post
   source = ndb.StringProperty('cli', indexed=False)
 
   # ID of tweet this is a reply to.
-  in_reply_to_status_id = ndb.StringProperty('rts')
+  in_reply_to_status_id = ndb.StringProperty('rts', indexed=False)
 
   # ID of user of the tweet this is in reply to.
-  in_reply_to_user_id = ndb.StringProperty('rtu')
+  in_reply_to_user_id = ndb.StringProperty('rtu', indexed=False)
 
   # Geo-tag for where this was tweet from.
   # eg, "geo":{"type":"Point","coordinates":[37.779201,-122.4387313]},
-  geo = ndb.GeoPtProperty('g')
+  geo = ndb.GeoPtProperty('g', indexed=False)
 
   # When present, indicates the tweet is associated with (but not necessarily
   # tweeted from) a given place.
@@ -419,38 +798,44 @@ class Tweet(ndb.Model):
   #         "type":"Polygon","coordinates":[[[-122.514926,37.708075],
   #            [-122.514926,37.833238], [-122.357031,37.833238],
   #            [-122.357031,37.708075]]]}
-  place_id = ndb.StringProperty('pl')
+  place_id = ndb.StringProperty('pl', indexed=False)
 
   # Number of times this has been retweeted.
-  retweet_count = ndb.IntegerProperty('rc')
+  retweet_count = ndb.IntegerProperty('rc', indexed=False)
 
   # Number of times this has been favorited.
-  favorite_count = ndb.IntegerProperty('fc')
+  favorite_count = ndb.IntegerProperty('fc', indexed=False)
 
-  # Entities which have been parsed from the text of this tweet.
-  entities = ndb.StructuredProperty(Entities, 'ents')
+  # Entities which have been parsed from the text of this tweet. Only one of
+  # these is set, depending on ENTITY_STORAGE when the tweet was written. Use
+  # the entities attribute to read or write them.
+  structured_entities = ndb.StructuredProperty(Entities, 'ents')
+  packed_entities = PackedEntitiesProperty('pe')
 
   # BCP 47 lang code: http://tools.ietf.org/html/bcp47
-  lang = ndb.StringProperty('la')  # eg, "en"
+  lang = ndb.StringProperty('la', indexed=False)  # eg, "en"
 
-  # Eventually I might deprecate this, but it's staying until parsing bugs are
-  # worked out.
+  # Raw JSON of the tweet. Unless RAW_JSON_STORAGE is RAW_JSON_INLINE, it is
+  # moved to a RawTweet when the tweet is put, so this is only set in the
+  # datastore for tweets stored inline. Use GetOriginalJson() to read the raw
+  # JSON of any tweet.
   original_json = ndb.TextProperty('json', compressed=True)
 
   ##### Score minion-specific metadata about this object #####
-  date_added = ndb.DateTimeProperty('da', auto_now_add=True)
-  date_modified = ndb.DateTimeProperty('dm', auto_now=True)
-  num_entities = ndb.ComputedProperty(lambda self: len(self.entities.integers), 'ne')
+  date_added = ndb.DateTimeProperty('da', auto_now_add=True, indexed=False)
+  date_modified = ndb.DateTimeProperty('dm', auto_now=True, indexed=False)
+  num_entities = ndb.ComputedProperty(
+      lambda self: len(self.entities.integers) if self.entities else 0, 'ne',
+      indexed=False)
   two_or_more_integers = ndb.ComputedProperty(
       lambda self: self.entities and len(self.entities.integers) > 1, 'tom')
 
   # The list ID if this tweet was indexed by getting statuses from a list.
-  from_list = ndb.StringProperty('fl')
-
-  # TODO: add an integer 'from_list" which is stored more efficiently
+  from_list = ListIdProperty('fl')
 
   # Keep track of which version added this data
-  added_by_app_version = ndb.StringProperty('ver', required=True)
+  added_by_app_version = ndb.StringProperty('ver', required=True,
+      indexed=False)
 
   @classmethod
   def GetOrInsertFromJson(cls, json_obj, from_list=None):
@@ -462,6 +847,164 @@ class Tweet(ndb.Model):
     """Builds a Tweet object from a json object."""
     return Tweet.__BuildConstructorArgs(json_obj, False, from_list=from_list)
 
+  @classmethod
+  def BulkGetOrInsertFromJson(cls, json_objs, from_list=None, is_new=None):
+    """Batched version of GetOrInsertFromJson for a page of tweets.
+
+    Tweets already in the db are looked up with one get_multi and returned
+    as stored, so, as with get_or_insert, an existing tweet is not
+    overwritten. Only the missing tweets are built and they are all written
+    with one put_multi. Unlike get_or_insert this is not transactional: a
+    concurrent crawl inserting the same tweet can rewrite it with identical
+    content, attributed to its own list.
+
+    Args:
+      json_objs: list of json tweet objects, eg a ListStatuses response.
+      from_list: The list ID the tweets were crawled from, if any.
+      is_new: (optional) Function from a tweet id string to True if the tweet
+        is known not to be in the db. Those tweets are written without being
+        looked up first, so a stored tweet for which this returns True is
+        overwritten.
+    Returns:
+      A list with one element for each object in json_objs: the Tweet
+      object, or None if the json object could not be parsed.
+    """
+    twt_map = cls.__GetStoredMulti(json_objs, is_new)
+    new_twts = []
+    results = []
+    for json_obj in json_objs:
+      id_str = json_obj.get('id_str', '')
+      twt = twt_map.get(id_str)
+      if not twt:
+        twt = cls.FromJson(json_obj, from_list=from_list)
+        if twt:
+          twt_map[id_str] = twt
+          new_twts.append(twt)
+      results.append(twt)
+
+    if new_twts:
+      ndb.put_multi(new_twts)
+    return results
+
+  @classmethod
+  def BulkInsertFromJson(cls, json_objs, from_list=None, is_new=None):
+    """Writes the tweets of a page which are not in the db yet.
+
+    Same as BulkGetOrInsertFromJson, but only the Tweets which are written
+    are built and returned, for callers which don't need the others.
+
+    Args:
+      json_objs: list of json tweet objects, eg a ListStatuses response.
+      from_list: The list ID the tweets were crawled from, if any.
+      is_new: (optional) As for BulkGetOrInsertFromJson.
+    Returns:
+      The list of Tweet objects which were written.
+    """
+    twt_map = cls.__GetStoredMulti(json_objs, is_new)
+    new_twts = []
+    for json_obj in json_objs:
+      if json_obj.get('id_str', '') in twt_map:
+        continue
+      twt = cls.FromJson(json_obj, from_list=from_list)
+      if twt:
+        twt_map[twt.id_str] = twt
+        new_twts.append(twt)
+
+    if new_twts:
+      ndb.put_multi(new_twts)
+    return new_twts
+
+  @classmethod
+  def __GetStoredMulti(cls, json_objs, is_new):
+    """Returns the stored Tweets of the json objects, keyed by id string.
+
+    The tweets for which is_new returns True are not looked up.
+    """
+    id_strs = []
+    for json_obj in json_objs:
+      id_str = json_obj.get('id_str', '')
+      if id_str and id_str not in id_strs and not (is_new and is_new(id_str)):
+        id_strs.append(id_str)
+
+    keys = [tweet_entity_key(id_str) for id_str in id_strs]
+    twt_map = {}
+    for key, twt in zip(keys, ndb.get_multi(keys)):
+      if twt:
+        twt_map[key.id()] = twt
+    return twt_map
+
+  @ndb.tasklet
+  def _put_async(self, **ctx_options):
+    """Puts the tweet, with its raw JSON stored as per RAW_JSON_STORAGE.
+
+    Every put of a tweet goes through here, so the RawTweet is written along
+    with it in the same batch, or the same transaction for get_or_insert.
+    """
+    raw_twt = None
+    if RAW_JSON_STORAGE != RAW_JSON_INLINE and self.original_json is not None:
+      raw_twt = RawTweet(key=raw_tweet_key(self.id_str),
+          json=self.original_json)
+      self.original_json = None
+    futures = [super(Tweet, self)._put_async(**ctx_options)]
+    if raw_twt:
+      futures.append(raw_twt.put_async(**ctx_options))
+    keys = yield futures
+    raise ndb.Return(keys[0])
+  put_async = _put_async
+
+  @property
+  def entities(self):
+    """The Entities of this tweet, however they are stored."""
+    if self.packed_entities is not None:
+      return self.packed_entities
+    return self.structured_entities
+
+  @entities.setter
+  def entities(self, entities):
+    self.structured_entities = None
+    self.packed_entities = None
+    if entities is not None:
+      for name, value in _EntitiesArgs(entities).items():
+        setattr(self, name, value)
+
+  @property
+  def integers(self):
+    """The integers in the text, as for ParsedTweet."""
+    if not self.entities:
+      return []
+    return self.entities.integers
+
+  @property
+  def user_mention_ids(self):
+    """The string ids of the mentioned users, as for ParsedTweet."""
+    if not self.entities:
+      return []
+    return [um.user_id for um in self.entities.user_mentions]
+
+  def GetOriginalJson(self):
+    """Returns the raw JSON string of this tweet, or None if it wasn't kept."""
+    return Tweet.GetOriginalJsonMulti([self])[0]
+
+  @classmethod
+  def GetOriginalJsonMulti(cls, twts):
+    """Returns the raw JSON strings of the tweets, looked up in one batch.
+
+    Args:
+      twts: list of Tweet objects.
+    Returns:
+      A list with the raw JSON string of each tweet, or None for tweets whose
+      raw JSON wasn't kept.
+    """
+    results = [t.original_json for t in twts]
+    missing = [i for (i, r) in enumerate(results) if r is None]
+    if not missing:
+      return results
+    raw_twts = ndb.get_multi([raw_tweet_key(twts[i].id_str) for i in missing])
+    for i, raw_twt in zip(missing, raw_twts):
+      if raw_twt:
+        results[i] = raw_twt.json
+    return results
+
   @classmethod
   def __BuildConstructorArgs(cls, json_obj, insert, from_list=None):
     id_str = json_obj.get('id_str', '')
@@ -472,8 +1015,12 @@ class Tweet(ndb.Model):
     if not id_64:
       logging.warning('could not parse tweet, no id: %s', json_obj)
       return None
+    raw_json_obj = json_obj
+    if RAW_JSON_STORAGE == RAW_JSON_PROJECTED:
+      raw_json_obj = ProjectRawJson(json_obj)
+
     # todo: async?
-    return Tweet.__BuildObject(id_str, insert, parent=tweet_key(id_str),
+    twt = Tweet.__BuildObject(id_str, insert, parent=tweet_key(id_str),
         author_id=json_obj.get('user', {}).get('id_str', ''),
         author_id_64=json_obj.get('user', {}).get('id', 0),
         author_screen_name=json_obj.get('user', {}).get('screen_name', ''),
@@ -491,10 +1038,11 @@ class Tweet(ndb.Model):
         place_id=ParsePlaceId(json_obj.get('place', {})),
         retweet_count = long(json_obj.get('retweet_count', 0)),
         favorite_count = long(json_obj.get('favorite_count', 0)),
-        entities=Entities.fromJson(json_obj.get('entities', {}),
-          tweet_text=json_obj.get('text', '')),
-        original_json=json.dumps(json_obj),
-        lang=json_obj.get('lang', ''))
+        original_json=json.dumps(raw_json_obj),
+        lang=json_obj.get('lang', ''),
+        **_EntitiesArgs(Entities.fromJson(json_obj.get('entities', {}),
+          tweet_text=json_obj.get('text', ''))))
+    return twt
 
   @classmethod
   def __BuildObject(cls, tweet_id, insert, **kwargs):
@@ -528,6 +1076,72 @@ class Tweet(ndb.Model):
     return json.dumps(d)
 
 
+class ParsedTweet(object):
+  """The fields of a tweet which are used to match it to games.
+
+  This is a plain, compact record, so statuses can be matched without
+  building an ndb Tweet for each of them. Tweet has the same fields, so the
+  matching code can take either.
+  """
+  __slots__ = ['id_str', 'id_64', 'author_id', 'author_id_64', 'created_at',
+      'text', 'integers', 'user_mention_ids']
+
+  def __init__(self, id_str, id_64, author_id, author_id_64, created_at,
+      text, integers=(), user_mention_ids=()):
+    """Initializes the record.
+
+    Args:
+      id_str: String id of the tweet.
+      id_64: The id of the tweet as a long.
+      author_id: String id of the author.
+      author_id_64: The id of the author as a long.
+      created_at: datetime the tweet was posted, in UTC.
+      text: Text of the tweet.
+      integers: Tuple of IntegerSpan tuples for the integers in the text.
+      user_mention_ids: Tuple of the string ids of the mentioned users.
+    """
+    self.id_str = id_str
+    self.id_64 = id_64
+    self.author_id = author_id
+    self.author_id_64 = author_id_64
+    self.created_at = created_at
+    self.text = text
+    self.integers = integers
+    self.user_mention_ids = user_mention_ids
+
+  @property
+  def two_or_more_integers(self):
+    return len(self.integers) > 1
+
+  @classmethod
+  def FromJson(cls, json_obj):
+    """Builds a ParsedTweet from a status json object, or returns None."""
+    id_str = json_obj.get('id_str', '')
+    id_64 = json_obj.get('id', 0)
+    if not id_str or not id_64:
+      logging.warning('could not parse tweet, no id_str or id: %s', json_obj)
+      return None
+    user = json_obj.get('user', {})
+    text = json_obj.get('text', '')
+    entities = json_obj.get('entities', {})
+    return cls(id_str, id_64, user.get('id_str', ''), user.get('id', 0),
+        ParseTweetDateString(json_obj.get('created_at', ''), tweet_id=id_str),
+        text,
+        integers=tuple(ParseIntegerSpans(text,
+          lambda: EntityMask.FromJson(entities))),
+        user_mention_ids=tuple([um.get('id_str', '')
+          for um in entities.get('user_mentions', [])]))
+
+  @classmethod
+  def FromTweet(cls, twt):
+    """Builds a ParsedTweet from a Tweet."""
+    return cls(twt.id_str, twt.id_64, twt.author_id, twt.author_id_64,
+        twt.created_at, twt.text,
+        integers=tuple([IntegerSpan(ie.num, ie.start_idx, ie.end_idx)
+          for ie in twt.integers]),
+        user_mention_ids=tuple(twt.user_mention_ids))
+
+
 class User(ndb.Model):
   """Models a twitter user.
   
@@ -543,16 +1157,16 @@ class User(ndb.Model):
   id_64 = ndb.IntegerProperty()
 
   # User-defined name
-  name = ndb.StringProperty('n')  # eg, "Martin Cochran"
+  name = ndb.StringProperty('n', indexed=False)  # eg, "Martin Cochran"
 
   # User-defined handle.  Can change.  Always stored as lowercase string.
   screen_name = ndb.StringProperty('sn')  # eg, "martin_cochran"
 
   # User-defined location - arbitrary string.
-  location = ndb.StringProperty('l')
+  location = ndb.StringProperty('l', indexed=False)
 
   # User-defined self-description.
-  description = ndb.StringProperty('d')
+  description = ndb.StringProperty('d', indexed=False)
 
   # User-supplied URL.
   url = ndb.StringProperty(indexed=False)
@@ -565,11 +1179,11 @@ class User(ndb.Model):
   protected = ndb.BooleanProperty('p', indexed=False)
 
   # When was this user created?
-  created_at = ndb.DateTimeProperty('cd')
+  created_at = ndb.DateTimeProperty('cd', indexed=False)
 
   # Number of tweets this user has favorited in the account's lifetime.
   # English sp is consistent with Twitter API - whatever.
-  favourites_count = ndb.IntegerProperty('f')
+  favourites_count = ndb.IntegerProperty('f', indexed=False)
 
   # Offset from GMT/UTC in seconds.
   utc_offset = ndb.IntegerProperty('uo', indexed=False)
@@ -578,46 +1192,47 @@ class User(ndb.Model):
   time_zone = ndb.StringProperty('tz', indexed=False)
 
   # Has the user enabled the option of geo-tagging their tweets?
-  geo_enabled = ndb.BooleanProperty('ge')
+  geo_enabled = ndb.BooleanProperty('ge', indexed=False)
 
   # Spam control.
   verified = ndb.BooleanProperty('vfd', indexed=False)
 
   # Total # of tweets by the user.
-  statuses_count = ndb.IntegerProperty('sc')
+  statuses_count = ndb.IntegerProperty('sc', indexed=False)
 
   # BCP 47 lang code: http://tools.ietf.org/html/bcp47
-  lang = ndb.StringProperty('la')
+  lang = ndb.StringProperty('la', indexed=False)
 
   # URLs for displaying user icon / banner in tweets.
   profile_image_url_https = ndb.StringProperty('piu', indexed=False)
   profile_banner_url_https = ndb.StringProperty('pbu', indexed=False)
 
   # Number of people that follow this user.
-  followers_count = ndb.IntegerProperty()
+  followers_count = ndb.IntegerProperty(indexed=False)
 
   # Number of people this user follows.
-  friends_count = ndb.IntegerProperty()
+  friends_count = ndb.IntegerProperty(indexed=False)
 
   # Number of public lists this user is a member of.
-  listed_count = ndb.IntegerProperty()
+  listed_count = ndb.IntegerProperty(indexed=False)
 
   ##### Score minion added data. #####
   # User ids of followers of this user.
-  followers = ndb.StringProperty(repeated=True)
+  followers = ndb.StringProperty(repeated=True, indexed=False)
 
   # User ids of accounts this user follows.
-  friends = ndb.StringProperty(repeated=True)
+  friends = ndb.StringProperty(repeated=True, indexed=False)
 
   ##### Score minion-specific metadata. #####
-  date_added = ndb.DateTimeProperty('da', auto_now_add=True)
-  date_modified = ndb.DateTimeProperty('dm', auto_now=True)
+  date_added = ndb.DateTimeProperty('da', auto_now_add=True, indexed=False)
+  date_modified = ndb.DateTimeProperty('dm', auto_now=True, indexed=False)
 
   # The list ID if this user was indexed by getting statuses from a list.
-  from_list = ndb.StringProperty('fl')
+  from_list = ListIdProperty('fl', indexed=False)
 
   # Keep track of which version of the app added this data 
-  added_by_app_version = ndb.StringProperty('ver', required=True)
+  added_by_app_version = ndb.StringProperty('ver', required=True,
+      indexed=False)
 
   @classmethod
   def GetOrInsertFromJson(cls, json_obj):
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Martin Cochran
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for parsing tweets.
+
+Usage: python tweets_benchmark.py
+"""
+
+import contextlib
+from datetime import datetime, timedelta
+import random
+import re
+
+import benchmark_util
+
+import tweets
+
+
+def _IsIndexInEntities(entities, start_idx):
+  """Scans every non-integer entity, as Entities.IsIndexInEntities did."""
+  for entity_list in [entities.hashtags, entities.user_mentions,
+      entities.url_mentions, entities.media]:
+    for entity in entity_list:
+      if start_idx >= entity.start_idx and start_idx < entity.end_idx:
+        return True
+  return False
+
+
+def ParseIntegersFromTweetLegacy(entities, tweet_text):
+  """Parses integers the way tweets.ParseIntegersFromTweet did originally."""
+  ies = []
+  if not tweet_text:
+    return []
+  for item in re.finditer(r'\$?[\d:.,]+', tweet_text):
+    if len(item.group(0)) > 3:
+      continue
+    if not re.findall(r'\d+', item.group(0)):
+      continue
+    if '$' in item.group(0)[0]:
+      continue
+    if '.' in item.group(0)[:-1]:
+      continue
+    if ',' in item.group(0)[:-1]:
+      continue
+    if ':' in item.group(0):
+      continue
+    if _IsIndexInEntities(entities, item.start(0)):
+      continue
+    ie = tweets.IntegerEntity()
+    number_text = item.group(0)
+    end_offset = 0
+    if number_text[-1] in ['.', ',']:
+      number_text = number_text[:-1]
+      end_offset = -1
+
+    ie.num = long(number_text)
+    ie.start_idx = int(item.start(0))
+    ie.end_idx = int(item.end(0) + end_offset)
+
+    ies.append(ie)
+
+  return ies
+
+
+def LoadSampleEntities():
+  """Returns (entities, text) for every tweet in the sample list statuses."""
+  samples = []
+  for _, json_obj in benchmark_util.LoadListStatuses():
+    for json_twt in json_obj:
+      text = json_twt.get('text', '')
+      entities = tweets.Entities.fromJson(json_twt.get('entities', {}))
+      samples.append((entities, text))
+  return samples
+
+
+def BenchmarkParseIntegers(repetitions=20):
+  """Reports the integer extraction throughput over the sample tweets."""
+  bed = benchmark_util.ActivateTestbed()
+  samples = LoadSampleEntities()
+  print('Integer extraction: %d sample tweets x %d' % (len(samples),
+      repetitions))
+  for name, parse_fn in [('legacy', ParseIntegersFromTweetLegacy),
+                         ('single pass', tweets.ParseIntegersFromTweet)]:
+    with benchmark_util.Timer() as timer:
+      for _ in range(repetitions):
+        for entities, text in samples:
+          parse_fn(entities, text)
+    tweets_per_sec = len(samples) * repetitions / (timer.elapsed_ms / 1000.0)
+    print('  %-11s  %8.1f ms  %10.0f tweets/s' % (name, timer.elapsed_ms,
+        tweets_per_sec))
+  bed.deactivate()
+
+
+def SyntheticDateStrings(num_dates, seed=0):
+  """Returns Twitter API date strings at random times and UTC offsets."""
+  rand = random.Random(seed)
+  offsets = ['+0000', '+0000', '-0700', '-0400', '+0100', '+0530', '-1000']
+  date_strs = []
+  for _ in range(num_dates):
+    dt = datetime(2006, 3, 21) + timedelta(
+        seconds=rand.randint(0, 12 * 365 * 24 * 3600))
+    date_strs.append('%s %s %s' % (dt.strftime('%a %b %d %H:%M:%S'),
+      rand.choice(offsets), dt.strftime('%Y')))
+  return date_strs
+
+
+def BenchmarkDateParsing(num_dates=100000):
+  """Compares strptime with the fixed-format parser on synthetic dates."""
+  date_strs = SyntheticDateStrings(num_dates)
+  print('Date parsing: %d synthetic timestamps' % num_dates)
+  for name, parse_fn in [
+      ('strptime', tweets.ParseDateStringWithStrptime),
+      ('fixed format', tweets.ParseTweetDateString)]:
+    with benchmark_util.Timer() as timer:
+      for date_str in date_strs:
+        parse_fn(date_str)
+    print('  %-12s  %8.1f ms  %10.0f dates/s' % (name, timer.elapsed_ms,
+        num_dates / (timer.elapsed_ms / 1000.0)))
+
+
+# Properties which were indexed before tweets.TWEET_INDEXED_PROPERTIES and
+# tweets.USER_INDEXED_PROPERTIES trimmed the index profile.
+LEGACY_INDEXED_PROPERTIES = [
+    (tweets.UserMentionEntity, ['user_id', 'user_id_64', 'start_idx',
+      'end_idx']),
+    (tweets.UrlMentionEntity, ['start_idx', 'end_idx']),
+    (tweets.HashTagEntity, ['text', 'start_idx', 'end_idx']),
+    (tweets.MediaEntity, ['start_idx', 'end_idx']),
+    (tweets.IntegerEntity, ['num', 'start_idx', 'end_idx']),
+    (tweets.Tweet, ['author_id', 'author_id_64', 'id_64', 'id_str', 'text',
+      'in_reply_to_status_id', 'in_reply_to_user_id', 'geo', 'place_id',
+      'retweet_count', 'favorite_count', 'lang', 'date_added',
+      'date_modified', 'num_entities', 'added_by_app_version']),
+    (tweets.User, ['name', 'location', 'description', 'created_at',
+      'favourites_count', 'geo_enabled', 'statuses_count', 'lang',
+      'followers_count', 'friends_count', 'listed_count', 'followers',
+      'friends', 'date_added', 'date_modified', 'from_list',
+      'added_by_app_version']),
+]
+
+# Composite indexes in index.yaml before the index profile was trimmed.
+LEGACY_COMPOSITE_INDEXES = {'Tweet': 9, 'User': 1}
+
+
+@contextlib.contextmanager
+def LegacyIndexProfile():
+  """Temporarily indexes every property that used to be indexed."""
+  props = []
+  for model_class, names in LEGACY_INDEXED_PROPERTIES:
+    props.extend([getattr(model_class, name) for name in names])
+  saved = [prop._indexed for prop in props]
+  try:
+    for prop in props:
+      prop._indexed = True
+    yield
+  finally:
+    for prop, indexed in zip(props, saved):
+      prop._indexed = indexed
+
+
+def IndexedValueNames(entity):
+  """Returns the name of every indexed value written when entity is put."""
+  return [p.name() for p in entity._to_pb().property_list()]
+
+
+def CompositeIndexCount(kind, index_yaml='index.yaml'):
+  """Returns the number of composite indexes on kind in index.yaml."""
+  with open(index_yaml, 'r') as f:
+    return len([l for l in f if l.strip() == '- kind: %s' % kind])
+
+
+def WriteOpsPerPut(entity, num_composite_indexes):
+  """Returns the datastore write ops to put a new entity.
+
+  A new entity costs 2 writes, plus 2 for each indexed value (ascending and
+  descending index rows) and 1 for each composite index row. This assumes
+  the composite indexes are on single-valued properties.
+  """
+  return 2 + 2 * len(IndexedValueNames(entity)) + num_composite_indexes
+
+
+def LoadSampleModels():
+  """Returns Tweet and User entities built from the sample list statuses."""
+  twts = []
+  users = []
+  for list_id, json_obj in benchmark_util.LoadListStatuses():
+    for json_twt in json_obj:
+      twts.append(tweets.Tweet.FromJson(json_twt, from_list=list_id))
+      users.append(tweets.User.FromJson(json_twt.get('user', {})))
+  return twts, users
+
+
+def BenchmarkIndexWrites():
+  """Reports the write ops per put with the old and new index profiles."""
+  bed = benchmark_util.ActivateTestbed()
+  twts, users = LoadSampleModels()
+  print('Index writes: %d sample tweets and users' % len(twts))
+  for kind, entities in [('Tweet', twts), ('User', users)]:
+    with LegacyIndexProfile():
+      before = [WriteOpsPerPut(e, LEGACY_COMPOSITE_INDEXES[kind])
+          for e in entities]
+    after = [WriteOpsPerPut(e, CompositeIndexCount(kind)) for e in entities]
+    print('  %-5s  before %6.1f  after %6.1f  write ops per put' % (kind,
+        float(sum(before)) / len(before), float(sum(after)) / len(after)))
+  bed.deactivate()
+
+
+def _StoredPb(twt):
+  """Returns the pb of the tweet as it is written by put."""
+  if tweets.RAW_JSON_STORAGE != tweets.RAW_JSON_INLINE:
+    twt.original_json = None
+  return twt._to_pb()
+
+
+def BenchmarkEntityDecoding(repetitions=20):
+  """Compares decoding structured and packed entities of the sample tweets.
+
+  Each stored tweet is decoded from its protocol buffer and its entities are
+  read, as when a tweet is loaded by a query.
+  """
+  bed = benchmark_util.ActivateTestbed()
+  json_twts = [(list_id, json_twt)
+      for list_id, json_obj in benchmark_util.LoadListStatuses()
+      for json_twt in json_obj]
+  print('Entity decoding: %d sample tweets x %d' % (len(json_twts),
+      repetitions))
+  saved_storage = tweets.ENTITY_STORAGE
+  try:
+    for storage in [tweets.ENTITIES_STRUCTURED, tweets.ENTITIES_PACKED]:
+      tweets.ENTITY_STORAGE = storage
+      pbs = [_StoredPb(tweets.Tweet.FromJson(json_twt, from_list=list_id))
+          for list_id, json_twt in json_twts]
+      size = sum([len(pb.Encode()) for pb in pbs])
+      with benchmark_util.Timer() as timer:
+        for _ in range(repetitions):
+          for pb in pbs:
+            tweets.Tweet._from_pb(pb).entities.integers
+      print('  %-10s  %8.1f ms  %8.1f bytes/tweet' % (storage,
+          timer.elapsed_ms, float(size) / len(pbs)))
+  finally:
+    tweets.ENTITY_STORAGE = saved_storage
+  bed.deactivate()
+
+
+if __name__ == '__main__':
+  BenchmarkParseIntegers()
+  BenchmarkDateParsing()
+  BenchmarkIndexWrites()
+  BenchmarkEntityDecoding()
@@ -17,14 +17,18 @@
 
 import datetime
 import json
+import mock
 import unittest
 
 import test_env_setup
 
+from google.appengine.api import datastore
+from google.appengine.api import datastore_errors
 from google.appengine.ext import testbed
 from google.appengine.ext import ndb
 
 import tweets
+import tweets_benchmark
 
 TWEET_JSON_LINES = [
     '{"created_at":"Wed Dec 10 21:00:24 +0000 2014",',
@@ -229,6 +233,239 @@ class TweetTest(unittest.TestCase):
 
     self.assertEqual(None, user)
 
+  def testTweetIdAt(self):
+    twt = tweets.Tweet.FromJson(json.loads(''.join(TWEET_JSON_LINES)))
+    self.assertTrue(tweets.TweetIdAt(twt.created_at) <= twt.id_64)
+    self.assertTrue(twt.id_64 < tweets.TweetIdAt(
+      twt.created_at + datetime.timedelta(seconds=1)))
+    self.assertEqual(0, tweets.TweetIdAt(datetime.datetime(2010, 1, 1)))
+
+  def testBulkGetOrInsertFromJson(self):
+    """Verify bulk insertion writes only new tweets and keeps existing ones."""
+    json_obj = json.loads(''.join(TWEET_JSON_LINES))
+    existing = tweets.Tweet.GetOrInsertFromJson(json_obj, from_list='1')
+
+    new_obj = json.loads(''.join(TWEET_JSON_LINES))
+    new_obj['id_str'] = '542785926674399233'
+    new_obj['id'] = 542785926674399233
+
+    twts = tweets.Tweet.BulkGetOrInsertFromJson(
+        [new_obj, json_obj, {}, new_obj], from_list='2')
+    self.assertEqual(4, len(twts))
+    self.assertEqual('542785926674399233', twts[0].id_str)
+    self.assertEqual('2', twts[0].from_list)
+
+    # The existing tweet is returned as stored, not overwritten.
+    self.assertEqual(existing.key, twts[1].key)
+    self.assertEqual('1', twts[1].from_list)
+
+    self.assertEqual(None, twts[2])
+    self.assertEqual(twts[0].key, twts[3].key)
+    self.assertEqual(2, len(tweets.Tweet.query().fetch(10)))
+
+    # Inserting the same page again is a no-op.
+    twts = tweets.Tweet.BulkGetOrInsertFromJson([new_obj, json_obj])
+    self.assertEqual('2', twts[0].from_list)
+    self.assertEqual('1', twts[1].from_list)
+    self.assertEqual(2, len(tweets.Tweet.query().fetch(10)))
+
+  def testBulkInsertFromJson(self):
+    """Verify only the tweets which are written are built and returned."""
+    json_obj = json.loads(''.join(TWEET_JSON_LINES))
+    tweets.Tweet.GetOrInsertFromJson(json_obj, from_list='1')
+
+    new_obj = json.loads(''.join(TWEET_JSON_LINES))
+    new_obj['id_str'] = '542785926674399233'
+    new_obj['id'] = 542785926674399233
+
+    with mock.patch.object(tweets.Tweet, 'FromJson',
+        wraps=tweets.Tweet.FromJson) as mock_from_json:
+      twts = tweets.Tweet.BulkInsertFromJson(
+          [new_obj, json_obj, {}, new_obj], from_list='2')
+    self.assertEqual(['542785926674399233'], [t.id_str for t in twts])
+    self.assertEqual(2, mock_from_json.call_count)
+    self.assertEqual('1', tweets.tweet_entity_key(json_obj['id_str']).get(
+      ).from_list)
+    self.assertEqual('2', twts[0].key.get().from_list)
+
+    self.assertEqual([], tweets.Tweet.BulkInsertFromJson([new_obj, json_obj]))
+
+  def testParsedTweet(self):
+    """Verify a ParsedTweet has the same matching fields as a Tweet."""
+    json_obj = json.loads(''.join(TWEET_JSON_LINES))
+    twt = tweets.Tweet.FromJson(json_obj)
+    for parsed in [tweets.ParsedTweet.FromJson(json_obj),
+        tweets.ParsedTweet.FromTweet(twt)]:
+      self.assertEqual('542785926674399232', parsed.id_str)
+      self.assertEqual(542785926674399232, parsed.id_64)
+      self.assertEqual('568757027', parsed.author_id)
+      self.assertEqual(568757027, parsed.author_id_64)
+      self.assertEqual(twt.created_at, parsed.created_at)
+      self.assertEqual(twt.text, parsed.text)
+      self.assertEqual(('35773039',), parsed.user_mention_ids)
+      self.assertEqual(((8, 105, 106), (11, 107, 109)), parsed.integers)
+      self.assertEqual(8, parsed.integers[0].num)
+      self.assertTrue(parsed.two_or_more_integers)
+      self.assertRaises(AttributeError, setattr, parsed, 'lang', 'en')
+
+    self.assertEqual(None, tweets.ParsedTweet.FromJson({}))
+
+  def testIndexProfile(self):
+    """Verify only the properties in the index profile are indexed."""
+    json_obj = json.loads(''.join(TWEET_JSON_LINES))
+    twt = tweets.Tweet.FromJson(json_obj, from_list='123')
+    user = tweets.User.FromJson(json_obj['user'])
+    self.assertEqual(tweets.TWEET_INDEXED_PROPERTIES,
+        set(tweets_benchmark.IndexedValueNames(twt)))
+    self.assertEqual(tweets.USER_INDEXED_PROPERTIES,
+        set(tweets_benchmark.IndexedValueNames(user)))
+
+    # The unindexed entities are still stored and read back.
+    twt.put()
+    twt = twt.key.get()
+    self.assertEqual(2, len(twt.entities.integers))
+    self.assertEqual('35773039', twt.entities.user_mentions[0].user_id)
+
+    with tweets_benchmark.LegacyIndexProfile():
+      legacy_ops = tweets_benchmark.WriteOpsPerPut(twt, 9)
+    self.assertTrue(tweets_benchmark.WriteOpsPerPut(twt, 5) < legacy_ops / 3)
+
+  def testPackedEntities(self):
+    """Verify packed entities read back the same as structured entities."""
+    json_obj = json.loads(''.join(TWEET_JSON_LINES))
+    structured_twt = tweets.Tweet.FromJson(json_obj)
+    with mock.patch.object(tweets, 'ENTITY_STORAGE', tweets.ENTITIES_PACKED):
+      twt = tweets.Tweet.BulkGetOrInsertFromJson([json_obj])[0]
+    self.assertEqual(None, twt.structured_entities)
+
+    twt = twt.key.get()
+    self.assertEqual(None, twt.structured_entities)
+    self.assertEqual(structured_twt.entities, twt.entities)
+    self.assertEqual(2, twt.num_entities)
+    self.assertTrue(twt.two_or_more_integers)
+    self.assertEqual([8, 11], [ie.num for ie in twt.integers])
+    self.assertEqual(['35773039'], twt.user_mention_ids)
+
+    # Tweets stored with either encoding are read after switching back.
+    structured_twt.put()
+    self.assertEqual(structured_twt.key.get().entities, twt.entities)
+
+    # Setting the entities stores them with the current encoding.
+    twt.entities = tweets.Entities(
+        hashtags=[tweets.HashTagEntity(text='ultimate')])
+    twt.put()
+    twt = twt.key.get()
+    self.assertEqual(None, twt.packed_entities)
+    self.assertEqual('ultimate', twt.entities.hashtags[0].text)
+    self.assertEqual(0, twt.num_entities)
+    self.assertFalse(twt.two_or_more_integers)
+
+  def testPackEntities(self):
+    entities = tweets.Entities(
+        hashtags=[tweets.HashTagEntity(text=u'caf\xe9', start_idx=0,
+          end_idx=5)],
+        user_mentions=[tweets.UserMentionEntity(user_id='3', user_id_64=3)],
+        url_mentions=[tweets.UrlMentionEntity(url='u', display_url=None,
+          expanded_url='', start_idx=7, end_idx=8)],
+        media=[tweets.MediaEntity(url_https='m', id_str='4', start_idx=9,
+          end_idx=10)],
+        integers=[tweets.IntegerEntity(num=15, start_idx=11, end_idx=13),
+          tweets.IntegerEntity(num=0, start_idx=14, end_idx=15)])
+    data = tweets.PackEntities(entities)
+    self.assertEqual(entities, tweets.UnpackEntities(data))
+    self.assertEqual(None,
+        tweets.UnpackEntities(data).user_mentions[0].start_idx)
+    self.assertEqual(tweets.Entities(),
+        tweets.UnpackEntities(tweets.PackEntities(tweets.Entities())))
+
+    self.assertRaises(ValueError, tweets.UnpackEntities, '\x09' + data[1:])
+
+  def testListIdProperty(self):
+    """Verify list ids are stored as integers and legacy strings are read."""
+    legacy_twt = datastore.Entity('Tweet', name='1')
+    legacy_twt['fl'] = '123'
+    datastore.Put(legacy_twt)
+    query = tweets.Tweet.query(tweets.Tweet.from_list == '123')
+    self.assertEqual([], query.fetch())
+
+    twt = tweets.Tweet.get_by_id('1')
+    self.assertEqual('123', twt.from_list)
+    twt.put()
+    self.assertEqual(123L, datastore.Get(legacy_twt.key())['fl'])
+    self.assertEqual([twt.key], query.fetch(keys_only=True))
+    self.assertEqual('123', twt.key.get().from_list)
+
+    self.assertRaises(datastore_errors.BadValueError, tweets.Tweet,
+        from_list='list')
+    self.assertRaises(datastore_errors.BadValueError, tweets.Tweet,
+        from_list=123)
+
+  def testRawJsonStorage(self):
+    """Verify the raw JSON is stored apart from the tweet and read lazily."""
+    json_obj = json.loads(''.join(TWEET_JSON_LINES))
+    twt = tweets.Tweet.BulkGetOrInsertFromJson([json_obj])[0]
+    self.assertEqual(None, twt.original_json)
+
+    twt = twt.key.get()
+    self.assertEqual(None, twt.original_json)
+    self.assertEqual(json_obj, json.loads(twt.GetOriginalJson()))
+    raw_twt = tweets.raw_tweet_key(twt.id_str).get()
+    self.assertEqual(json_obj, json.loads(raw_twt.json))
+
+  def testRawJsonStorage_put(self):
+    """Verify every put path writes the RawTweet, but only on insert."""
+    json_obj = json.loads(''.join(TWEET_JSON_LINES))
+    twt = tweets.Tweet.FromJson(json_obj)
+    self.assertEqual(json_obj, json.loads(twt.GetOriginalJson()))
+    twt.put()
+    self.assertEqual(None, twt.key.get().original_json)
+    self.assertEqual(json_obj, json.loads(twt.key.get().GetOriginalJson()))
+
+    # get_or_insert of an existing tweet doesn't write the raw JSON again.
+    twt.key.delete()
+    raw_twt = tweets.raw_tweet_key(twt.id_str).get()
+    raw_twt.json = '{}'
+    raw_twt.put()
+    tweets.Tweet(key=twt.key, id_str=twt.id_str, author_id='1',
+        author_screen_name='a', created_at=twt.created_at,
+        added_by_app_version='1').put()
+    twt = tweets.Tweet.GetOrInsertFromJson(json_obj)
+    self.assertEqual('{}', twt.GetOriginalJson())
+
+    new_obj = json.loads(''.join(TWEET_JSON_LINES))
+    new_obj['id_str'] = '542785926674399233'
+    new_obj['id'] = 542785926674399233
+    twt = tweets.Tweet.GetOrInsertFromJson(new_obj)
+    self.assertEqual(None, twt.key.get().original_json)
+    self.assertEqual(new_obj, json.loads(twt.GetOriginalJson()))
+
+  def testRawJsonStorage_projected(self):
+    json_obj = json.loads(''.join(TWEET_JSON_LINES))
+    with mock.patch.object(tweets, 'RAW_JSON_STORAGE',
+        tweets.RAW_JSON_PROJECTED):
+      twt = tweets.Tweet.BulkGetOrInsertFromJson([json_obj])[0]
+    raw_obj = json.loads(twt.GetOriginalJson())
+    self.assertEqual(json_obj['text'], raw_obj['text'])
+    self.assertEqual(json_obj['entities'], raw_obj['entities'])
+    self.assertEqual({'id': 568757027, 'id_str': '568757027',
+      'screen_name': 'martin_cochran'}, raw_obj['user'])
+    self.assertFalse('source' in raw_obj)
+
+  def testRawJsonStorage_inline(self):
+    json_obj = json.loads(''.join(TWEET_JSON_LINES))
+    with mock.patch.object(tweets, 'RAW_JSON_STORAGE', tweets.RAW_JSON_INLINE):
+      twts = tweets.Tweet.BulkGetOrInsertFromJson([json_obj])
+    self.assertEqual(json_obj, json.loads(twts[0].original_json))
+    self.assertEqual(None, tweets.raw_tweet_key(twts[0].id_str).get())
+
+    # Tweets stored either way can be read together.
+    new_obj = json.loads(''.join(TWEET_JSON_LINES))
+    new_obj['id_str'] = '542785926674399233'
+    new_obj['id'] = 542785926674399233
+    twts.extend(tweets.Tweet.BulkGetOrInsertFromJson([new_obj]))
+    raw_jsons = tweets.Tweet.GetOriginalJsonMulti(twts)
+    self.assertEqual([json_obj, new_obj], [json.loads(r) for r in raw_jsons])
+
   def testDateParsing(self):
     data_str = ''
     dt = tweets.ParseTweetDateString(data_str)
@@ -257,6 +494,23 @@ class TweetTest(unittest.TestCase):
     dt = tweets.ParseTweetDateString(data_str)
     self.assertEqual(datetime.datetime(2012, 5, 2, 3, 21, 39), dt)
 
+    # Deviations from the format are left to strptime.
+    data_str = 'wed May 2 03:21:39 +0000 2012'
+    self.assertEqual(None, tweets.ParseFixedFormatDateString(data_str))
+    dt = tweets.ParseTweetDateString(data_str)
+    self.assertEqual(datetime.datetime(2012, 5, 2, 3, 21, 39), dt)
+
+    data_str = 'Wed Feb 30 03:21:39 +0000 2012'
+    self.assertEqual(None, tweets.ParseFixedFormatDateString(data_str))
+    dt = tweets.ParseTweetDateString(data_str)
+    self.assertTrue((datetime.datetime.now() - dt) < datetime.timedelta(0, 600, 0))
+
+  def testDateParsing_matchesStrptime(self):
+    """Verify the fixed-format parser agrees with strptime."""
+    for date_str in tweets_benchmark.SyntheticDateStrings(2000):
+      self.assertEqual(tweets.ParseDateStringWithStrptime(date_str),
+          tweets.ParseFixedFormatDateString(date_str), date_str)
+
   def testParseGeoData(self):
     geo_obj = None
     self.assertEqual(None, tweets.ParseGeoData(geo_obj))
@@ -331,6 +585,30 @@ class TweetTest(unittest.TestCase):
     ies = tweets.ParseIntegersFromTweet(entities, text)
     self.assertEquals(1, len(ies))
 
+  def testParseIntegersInTweet_overlappingEntities(self):
+    entities = tweets.Entities()
+    entities.hashtags = [tweets.HashTagEntity(text='a1', start_idx=0,
+      end_idx=3)]
+    entities.url_mentions = [tweets.UrlMentionEntity(start_idx=2, end_idx=8),
+        tweets.UrlMentionEntity(start_idx=4, end_idx=6)]
+    entities.user_mentions = [tweets.UserMentionEntity(user_id='1')]
+    text = '#a1 2 3 4 5'
+
+    ies = tweets.ParseIntegersFromTweet(entities, text)
+    self.assertEquals([(4, 8, 9), (5, 10, 11)],
+        [(ie.num, ie.start_idx, ie.end_idx) for ie in ies])
+
+  def testParseIntegersInTweet_matchesLegacyParser(self):
+    """Verify the parser output is unchanged on the sample tweets."""
+    samples = tweets_benchmark.LoadSampleEntities()
+    texts = ['8-5', '5.', '8,', '18,', '1.7k', '7,000', '$500', '3:45',
+        '$5 5$5', '12. 1,2 ,3 4,, 100 1000', 'won 15-13, next up at 9.']
+    samples.extend([(tweets.Entities(), text) for text in texts])
+    for entities, text in samples:
+      self.assertEquals(
+          tweets_benchmark.ParseIntegersFromTweetLegacy(entities, text),
+          tweets.ParseIntegersFromTweet(entities, text), text)
+
 
 if __name__ == '__main__':
   unittest.main()
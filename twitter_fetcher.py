@@ -15,17 +15,83 @@
 # limitations under the License.
 #
 
+import itertools
 import json
 import logging
 import urlparse
 
 from google.appengine.api import urlfetch
+from google.appengine.ext import ndb
+
+import http_transport
+import rate_limiter
+import token_pool
 
 
 class FetchError(Exception):
   """Any error that occurred with the fetch."""
   pass
 
+class RateLimitError(FetchError):
+  """The rate limit for the endpoint has been used up for this window."""
+
+  def __init__(self, endpoint, retry_after_secs):
+    """Initializes the error.
+
+    Args:
+      endpoint: Path of the rate-limited API endpoint.
+      retry_after_secs: Seconds until the endpoint can be fetched again.
+    """
+    super(RateLimitError, self).__init__(
+        'Rate limit reached for %s, retry in %d seconds' % (
+          endpoint, retry_after_secs))
+    self.endpoint = endpoint
+    self.retry_after_secs = retry_after_secs
+
+def IterJsonArray(content):
+  """Yields the items of a JSON array, decoding them one at a time.
+
+  Only one item is decoded at a time, so the items which have been consumed
+  can be freed before the rest of the array is decoded.
+
+  Args:
+    content: String with a JSON array.
+  Raises:
+    ValueError if the content is not a JSON array. Errors after the start of
+    the array are only raised once the items before them have been yielded.
+  """
+  decoder = json.JSONDecoder()
+  idx = _SkipJsonWhitespace(content, 0)
+  if content[idx:idx + 1] != '[':
+    raise ValueError('Expected a JSON array at %d' % idx)
+  idx = _SkipJsonWhitespace(content, idx + 1)
+  if content[idx:idx + 1] == ']':
+    return
+  while True:
+    item, idx = decoder.raw_decode(content, idx)
+    yield item
+    idx = _SkipJsonWhitespace(content, idx)
+    separator = content[idx:idx + 1]
+    if separator == ']':
+      return
+    if separator != ',':
+      raise ValueError('Expected , or ] at %d' % idx)
+    idx = _SkipJsonWhitespace(content, idx + 1)
+
+
+def _SkipJsonWhitespace(content, idx):
+  return json.decoder.WHITESPACE.match(content, idx).end()
+
+
+def _IterStatuses(items):
+  """Yields the items from IterJsonArray, raising FetchError on errors."""
+  try:
+    for item in items:
+      yield item
+  except ValueError as e:
+    raise FetchError('Could not parse json response: %s' % e)
+
+
 class TwitterFetcher:
   """Interface with the Twitter API using the 'Application Only' API.
 
@@ -39,6 +105,10 @@ class TwitterFetcher:
     - Show users (info similar to that which you get from viewing a user in Twitter app)
     - User search
     - Get contributors / contributees
+
+  ListStatuses and LookupUsers also have async versions, which start the
+  request and return an ndb.Future for the parsed json. Their errors are
+  raised by the future's get_result().
   
   More info: https://dev.twitter.com/oauth/application-only
   Rate limits: https://dev.twitter.com/rest/public/rate-limits
@@ -61,10 +131,23 @@ class TwitterFetcher:
   LIST_SUBSCRIBERS_URL ='/lists/subscribers.json'
   LIST_SUBSCRIPTIONS_URL ='/lists/subscriptions.json'
 
-  def __init__(self, token_manager):
+  # Status code returned by Twitter when the rate limit has been reached.
+  TOO_MANY_REQUESTS = 429
+
+  def __init__(self, token_manager, limiter=None, transport=None):
+    """Initializes the fetcher.
+
+    Args:
+      token_manager: oauth_token_manager.OauthTokenManager with the credentials.
+      limiter: rate_limiter.RateLimiter which schedules the API requests.
+        Defaults to one using the wall clock.
+      transport: http_transport.Transport which makes the API requests.
+        Defaults to the one for http_transport.TRANSPORT_MODE.
+    """
     self.token_manager = token_manager
-    self.secret_string = token_manager.GetSecret()
-    self.bearer_token = token_manager.GetToken()
+    self.transport = transport or http_transport.GetTransport()
+    self.rate_limiter = limiter or rate_limiter.RateLimiter()
+    self.token_pool = token_pool.TokenPool(token_manager, self.rate_limiter)
 
   def UserTimeline(self, screen_name, count=1):
     """Fetches the last count posts from the timeline of screen_name.
@@ -121,6 +204,11 @@ class TwitterFetcher:
     Returns:
       List of Twitter user json objects.
     """
+    return self.LookupUsersAsync(user_id,
+        use_screen_name=use_screen_name).get_result()
+
+  def LookupUsersAsync(self, user_id, use_screen_name=False):
+    """Starts a LookupUsers request and returns a future for its result."""
     url = '%s%s' % (self.API_BASE_URL, self.LOOKUP_USERS_URL)
     if use_screen_name:
       params = {
@@ -130,8 +218,7 @@ class TwitterFetcher:
       params = {
           'user_id': user_id,
       }
-    response = self._FetchResults(url, params=params)
-    return response
+    return self._FetchResultsAsync(url, params=params)
 
   def LookupLists(self, screen_name, count=50, fake_data=False):
     """List the lists owned by a given user.
@@ -149,7 +236,7 @@ class TwitterFetcher:
     return response
 
   def ListStatuses(self, list_id, count=200, include_rts=0, since_id=None,
-      max_id=None, fake_data=False):
+      max_id=None, fake_data=False, stream=False):
     """Returns a timeline of tweets authored by members of the given list.
 
     Rate limit: 180 / 15 minute window.
@@ -164,9 +251,18 @@ class TwitterFetcher:
         id.
       max_id: (optional) If supplied, fetch only tweets older than that id.
       fake_data: If True, return fake data from a static file on disk.
+      stream: If True, return an iterator which decodes the statuses one at a
+        time as it is consumed, instead of a list.
     Returns:
       The response of the API call
     """
+    return self.ListStatusesAsync(list_id, count=count,
+        include_rts=include_rts, since_id=since_id, max_id=max_id,
+        fake_data=fake_data, stream=stream).get_result()
+
+  def ListStatusesAsync(self, list_id, count=200, include_rts=0,
+      since_id=None, max_id=None, fake_data=False, stream=False):
+    """Starts a ListStatuses request and returns a future for its result."""
     url = '%s%s' % (self.API_BASE_URL, self.LIST_STATUSES_URL)
     params = {
       'count': count,
@@ -178,8 +274,8 @@ class TwitterFetcher:
     if max_id:
       params['max_id'] = max_id
 
-    response = self._FetchResults(url, params=params, fake_data=fake_data)
-    return response
+    return self._FetchResultsAsync(url, params=params, fake_data=fake_data,
+        stream=stream)
 
   def ListMemberships(self):
     """Returns the lists the specified user has been added to.
@@ -213,7 +309,17 @@ class TwitterFetcher:
     """
     pass
 
-  def _FetchResults(self, url, params={}, fake_data=False):
+  def _FetchResults(self, url, params={}, fake_data=False, stream=False):
+    """Fetches and returns the parsed json results from the API.
+
+    See _FetchResultsAsync.
+    """
+    return self._FetchResultsAsync(url, params=params, fake_data=fake_data,
+        stream=stream).get_result()
+
+  @ndb.tasklet
+  def _FetchResultsAsync(self, url, params={}, fake_data=False,
+      stream=False):
     """Tries to fetch and return the parsed json results from the API.
 
     On a successful invocation the parsed, non-empty json object will be
@@ -224,12 +330,17 @@ class TwitterFetcher:
       url: (string) URL to fetch
       params: Dictionary of parameter to add to get requests
       fake_data: If True, return fake data from a static file on disk.
+      stream: If True, the response must be a JSON array, and its items are
+        decoded one at a time by the returned iterator. Errors in the rest of
+        the array are raised as FetchError by the iterator.
     Returns:
-      The parsed json from the content of the response to the Http.request() method.
-    Throws:
+      An ndb.Future for the parsed json from the content of the response.
+    Throws (from the future's get_result()):
       FetchError on any underlying error or a non-200 status code response.
+      RateLimitError if the rate limit for the endpoint has been reached.
     """
     logging.info('Loading results from URL %s, %s', url, params)
+    endpoint = self._Endpoint(url)
 
     param_str = '&'.join(['%s=%s' % (i[0], i[1]) for i in params.iteritems()])
     if param_str:
@@ -238,25 +349,53 @@ class TwitterFetcher:
     if fake_data:
       response = self._LoadFakeResponse(url)
     else:
+      credential, retry_after_secs = yield self.token_pool.LeaseAsync(
+          endpoint)
+      if not credential:
+        raise RateLimitError(endpoint, retry_after_secs)
+      credential_id = credential.credential_id
       try:
         # TODO: check, possibly increase default timeout
-        response = urlfetch.fetch(url, headers=self._BuildHeaders(),
-            deadline=30)
+        response = yield self.transport.FetchAsync(url,
+            headers=self._BuildHeaders(credential), deadline=30)
 
         # Check to see if we need to re-authenticate to get a new token.
         if self._ShouldReAuthenticate(response):
-          self._ReAuthenticate()
+          token = yield self._ReAuthenticateAsync(credential)
+          if not token:
+            self.token_pool.Retire(credential)
+            raise FetchError('Could not reauthenticate credential %s' %
+                credential_id)
           # Try again, once.
-          response = urlfetch.fetch(url, headers=self._BuildHeaders(),
-              deadline=30)
+          response = yield self.transport.FetchAsync(url,
+              headers=self._BuildHeaders(credential), deadline=30)
       except urlfetch.Error as e:
         logging.warning('Could not fetch URL %s: %s', url, e)
         raise FetchError(e)
 
+      has_limits = self.rate_limiter.UpdateFromHeaders(endpoint,
+          response.headers, credential_id=credential_id)
+      if response.status_code == self.TOO_MANY_REQUESTS:
+        if not has_limits:
+          self.rate_limiter.MarkExhausted(endpoint,
+              credential_id=credential_id)
+        raise RateLimitError(endpoint, self.rate_limiter.SecondsUntilReset(
+          endpoint, credential_id=credential_id))
+
       if response.status_code != 200:
         raise FetchError('Response code not 200: %s, %s' % (response.status_code,
             response.content))
 
+    if stream:
+      items = IterJsonArray(response.content)
+      try:
+        first_item = next(items, None)
+      except ValueError as e:
+        raise FetchError('Could not parse json response: %s' % response.content, e)
+      if first_item is None:
+        raise FetchError('Empty json response: %s' % response)
+      raise ndb.Return(_IterStatuses(itertools.chain([first_item], items)))
+
     try:
       json_obj = json.loads(response.content)
     except ValueError as e:
@@ -265,10 +404,16 @@ class TwitterFetcher:
     if not json_obj:
       raise FetchError('Empty json response: %s' % response)
 
-    return json_obj
+    raise ndb.Return(json_obj)
 
-  def _BuildHeaders(self):
-    return {'Authorization': 'Bearer %s' % self.bearer_token}
+  def _Endpoint(self, url):
+    """Returns the path of the API endpoint for the URL."""
+    if url.startswith(self.API_BASE_URL):
+      return url[len(self.API_BASE_URL):]
+    return urlparse.urlparse(url).path
+
+  def _BuildHeaders(self, credential):
+    return {'Authorization': 'Bearer %s' % credential.token}
 
   def _LoadFakeResponse(self, url):
     """Read and return the fake data for a given URL.
@@ -338,30 +483,49 @@ class TwitterFetcher:
     error_code = errors[0].get('code', -1)
     return int(error_code) in [89, 215]
 
-  def _ReAuthenticate(self):
-    """Obtain a new bearer token using the stored client secret.
+  def _ReAuthenticate(self, credential):
+    """Replaces the bearer token of a credential, see _ReAuthenticateAsync."""
+    return self._ReAuthenticateAsync(credential).get_result()
+
+  @ndb.tasklet
+  def _ReAuthenticateAsync(self, credential):
+    """Replaces the bearer token of a credential, which was rejected.
+
+    The token may already have been replaced by another request, see
+    oauth_token_manager.OauthTokenManager.RefreshTokenAsync.
+
+    Args:
+      credential: oauth_token_manager.Credential whose token was rejected. Its
+        token is updated.
+    Returns:
+      An ndb.Future for the new token, or for '' if none could be obtained.
+    """
+    credential.token = yield self.token_manager.RefreshTokenAsync(
+        credential.token, lambda: self._RequestTokenAsync(credential.secret),
+        credential_id=credential.credential_id)
+    if credential.token:
+      logging.info('Successfully updated bearer_token')
+    raise ndb.Return(credential.token)
+
+  @ndb.tasklet
+  def _RequestTokenAsync(self, secret):
+    """Obtain a new bearer token using a client secret.
 
     Submit a request to get a new token, parse the resulting json and get the
     'bearer' token as described in
     https://dev.twitter.com/oauth/application-only
     """
     headers = {
-      'Authorization': 'Basic %s' % self.secret_string,
+      'Authorization': 'Basic %s' % secret,
       'Content-Type': 'application/x-www-form-urlencoded;charset=UTF-8'
     }
 
     content = 'grant_type=client_credentials'
 
     logging.info('Obtaining new authentication code')
-    response = urlfetch.fetch(self.TOKEN_URL, method='POST', payload=content,
-        headers=headers, deadline=30)
+    # Always fetched live, so that tokens are never recorded by the transport.
+    response = yield ndb.get_context().urlfetch(self.TOKEN_URL, method='POST',
+        payload=content, headers=headers, deadline=30)
 
     token_response = json.loads(response.content)
-    self.bearer_token = token_response.get('access_token', '')
-    if self.bearer_token:
-      logging.info('Successfully updated bearer_token')
-
-      # TODO: Sleep for a random amount of time, then check to see if token has
-      # changed before writing.
-      self.token_manager.AddToken(self.bearer_token)
-    return self.bearer_token
+    raise ndb.Return(token_response.get('access_token', ''))
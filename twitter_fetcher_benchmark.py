@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Martin Cochran
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for decoding Twitter API responses.
+
+Usage: python twitter_fetcher_benchmark.py
+"""
+
+import os
+import sys
+
+import benchmark_util
+
+import crawl_lists
+import oauth_token_manager
+import tweets
+import twitter_fetcher
+
+
+def DeepSize(obj):
+  """Returns the size in bytes of a decoded JSON object and its contents."""
+  size = sys.getsizeof(obj)
+  if isinstance(obj, dict):
+    size += sum([DeepSize(k) + DeepSize(v) for k, v in obj.iteritems()])
+  elif isinstance(obj, list):
+    size += sum([DeepSize(item) for item in obj])
+  return size
+
+
+def _IngestPages(fetcher, list_id, stream, batch_size):
+  """Decodes a page and parses its tweets one batch at a time.
+
+  Returns:
+    The largest size in bytes of the decoded statuses held at once.
+  """
+  json_obj = fetcher.ListStatuses(list_id, fake_data=True, stream=stream)
+  if stream:
+    batches = crawl_lists.StreamedPage(json_obj).Batches(batch_size)
+  else:
+    batches = [json_obj]
+
+  peak_size = 0
+  for batch in batches:
+    peak_size = max(peak_size, DeepSize(batch))
+    [tweets.Tweet.FromJson(json_twt, from_list=list_id) for json_twt in batch]
+  return peak_size
+
+
+def BenchmarkStreamingDecode(batch_size=crawl_lists.STREAM_BATCH_SIZE):
+  """Compares decoding each sample list page whole and streamed.
+
+  The response body itself is held in both cases and is not counted.
+  """
+  print('ListStatuses decoding: peak decoded statuses held and wall time')
+  bed = benchmark_util.ActivateTestbed()
+  fetcher = twitter_fetcher.TwitterFetcher(
+      oauth_token_manager.OauthTokenManager(is_mock=True))
+  for list_id, _ in benchmark_util.LoadListStatuses():
+    filename = os.path.join(benchmark_util.LIST_STATUSES_DIR,
+        '%s.json' % list_id)
+    results = []
+    for stream in [False, True]:
+      with benchmark_util.Timer() as timer:
+        peak_size = _IngestPages(fetcher, list_id, stream, batch_size)
+      results.append((peak_size / 1024, timer.elapsed_ms))
+    print('  list %s (%4d KB)  whole page: %6d KB %7.1f ms   '
+        'streamed (batches of %d): %5d KB %7.1f ms' % (list_id,
+          os.path.getsize(filename) / 1024, results[0][0], results[0][1],
+          batch_size, results[1][0], results[1][1]))
+  bed.deactivate()
+
+
+if __name__ == '__main__':
+  BenchmarkStreamingDecode()
@@ -26,6 +26,7 @@ from google.appengine.ext import testbed
 from google.appengine.runtime import apiproxy_errors
 
 import oauth_token_manager
+import rate_limiter
 import twitter_fetcher
 
 class TwitterFetcherTest(unittest.TestCase):
@@ -34,11 +35,13 @@ class TwitterFetcherTest(unittest.TestCase):
     """Mock out the logic from urlfetch which does the actual fetching."""
     self.testbed = testbed.Testbed()
     self.testbed.activate()
+    self.testbed.init_memcache_stub()
     self.testbed.init_urlfetch_stub()
     self.url_fetch_stub = self.testbed.get_stub(testbed.URLFETCH_SERVICE_NAME)
 
     self.return_statuscode = [500]
     self.return_content = ['']
+    self.return_headers = []
 
     # Stub out the call to fetch the URL
     def _FakeFetch(url, payload, method, headers, request, response,
@@ -46,6 +49,11 @@ class TwitterFetcherTest(unittest.TestCase):
         validate_certificate=urlfetch_stub._API_CALL_VALIDATE_CERTIFICATE_DEFAULT):
       response.set_statuscode(self.return_statuscode.pop(0))
       response.set_content(self.return_content.pop(0))
+      if self.return_headers:
+        for key, value in self.return_headers.pop(0).iteritems():
+          header = response.add_header()
+          header.set_key(key)
+          header.set_value(value)
 
     self.saved_retrieve_url = self.url_fetch_stub._RetrieveURL
     self.token_manager = oauth_token_manager.OauthTokenManager(is_mock=True)
@@ -60,7 +68,10 @@ class TwitterFetcherTest(unittest.TestCase):
     # 3. Change this value to be a real Oauth secret.
     self.token_manager.AddSecret('mock secret')
 
-    self.fetcher = twitter_fetcher.TwitterFetcher(self.token_manager)
+    self.now = 1000.0
+    self.limiter = rate_limiter.RateLimiter(clock=lambda: self.now)
+    self.fetcher = twitter_fetcher.TwitterFetcher(self.token_manager,
+        limiter=self.limiter)
 
   def tearDown(self):
     # Reset the URL stub to the original function
@@ -109,7 +120,7 @@ class TwitterFetcherTest(unittest.TestCase):
 
   def testVerifyReauthenicatedCalledOnError(self):
     """Verify that needing to refresh token is handled correctly."""
-    self.fetcher.bearer_token = 'bad token'
+    self.token_manager.AddToken('bad token')
 
     self.return_statuscode = [401, 200, 200]
     self.return_content = [
@@ -118,6 +129,7 @@ class TwitterFetcherTest(unittest.TestCase):
         '{"id_str": "1"}',
     ]
     timeline = self.fetcher.UserTimeline('martin_cochran')
+    self.assertEquals('new access token', self.token_manager.GetToken())
 
   def testReAuthenticate(self):
     self.return_statuscode = [200, 200]
@@ -126,7 +138,9 @@ class TwitterFetcherTest(unittest.TestCase):
         '{"id_str": "1"}',
     ]
 
-    self.fetcher._ReAuthenticate()
+    credential = self.token_manager.GetCredentials()[0]
+    self.fetcher._ReAuthenticate(credential)
+    self.assertEquals('new access token', credential.token)
     timeline = self.fetcher.UserTimeline('martin_cochran')
 
   def testHandleTooManyRedirects(self):
@@ -252,6 +266,28 @@ class TwitterFetcherTest(unittest.TestCase):
     json_obj = self.fetcher.ListStatuses('186815046')
     self.assertEquals(type(json_obj), list)
 
+  def testListStatuses_stream(self):
+    """Verify statuses are decoded as they are consumed in stream mode."""
+    self.return_statuscode = [200, 200, 200]
+    self.return_content = [
+        ' [ {"id_str": "2", "text": "a, b"} ,\n{"id_str": "1"}] ',
+        '[]',
+        '[{"id_str": "2"}, {"id_str": ]',
+    ]
+
+    statuses = self.fetcher.ListStatuses('186815046', stream=True)
+    self.assertNotEquals(list, type(statuses))
+    self.assertEquals({'id_str': '2', 'text': 'a, b'}, next(statuses))
+    self.assertEquals([{'id_str': '1'}], list(statuses))
+
+    self.assertRaises(twitter_fetcher.FetchError,
+        self.fetcher.ListStatuses, '186815046', stream=True)
+
+    # Errors after the first status are raised while iterating.
+    statuses = self.fetcher.ListStatuses('186815046', stream=True)
+    self.assertEquals({'id_str': '2'}, next(statuses))
+    self.assertRaises(twitter_fetcher.FetchError, next, statuses)
+
   def testLookupUsers(self):
     """Test basic LookupUsers functionality."""
     self.return_statuscode = [200]
@@ -282,6 +318,74 @@ class TwitterFetcherTest(unittest.TestCase):
     json_obj = self.fetcher.LookupUsers('bob', use_screen_name=True)
     self.assertEquals(type(json_obj), list)
 
+  def testAsyncRequests(self):
+    """Verify several requests can be in flight at once."""
+    self.return_statuscode = [200, 200, 200]
+    self.return_content = ['[{"id_str": "1"}]'] * 3
+
+    futures = [
+        self.fetcher.ListStatusesAsync('186815046'),
+        self.fetcher.ListStatusesAsync('186815047'),
+        self.fetcher.LookupUsersAsync('186815046'),
+    ]
+    for future in futures:
+      self.assertEquals([{'id_str': '1'}], future.get_result())
+    self.assertEquals([], self.return_content)
+
+  def testAsyncRequests_error(self):
+    """Verify errors are raised when the result is requested."""
+    self.return_statuscode = [404]
+    self.return_content = [
+        '{"errors":[{"message":"Sorry, that page does not exist","code":34}]}']
+
+    future = self.fetcher.ListStatusesAsync('186815046')
+    self.assertRaises(twitter_fetcher.FetchError, future.get_result)
+
+  def testRateLimitHeaders(self):
+    """Verify requests stop once the headers say the window is used up."""
+    self.return_statuscode = [200, 200]
+    self.return_content = ['[{"id_str": "1"}]', '[{"id_str": "2"}]']
+    self.return_headers = [
+        {'x-rate-limit-remaining': '1', 'x-rate-limit-reset': '1600'},
+        {'x-rate-limit-remaining': '0', 'x-rate-limit-reset': '1600'},
+    ]
+
+    self.fetcher.ListStatuses('186815046')
+    self.fetcher.ListStatuses('186815046')
+    try:
+      self.fetcher.ListStatuses('186815046')
+      self.fail('Should have thrown an error')
+    except twitter_fetcher.RateLimitError as e:
+      self.assertEquals('/lists/statuses.json', e.endpoint)
+      self.assertEquals(600, e.retry_after_secs)
+
+    # Other endpoints are limited separately.
+    self.return_statuscode = [200]
+    self.return_content = ['[{"id_str": "1"}]']
+    self.fetcher.LookupUsers('186815046')
+
+    # Requests are allowed again once the window resets.
+    self.now = 1600.0
+    self.return_statuscode = [200]
+    self.return_content = ['[{"id_str": "3"}]']
+    self.fetcher.ListStatuses('186815046')
+
+  def testRateLimitExceeded(self):
+    """Verify a 429 response backs off until the window resets."""
+    self.return_statuscode = [429]
+    self.return_content = [
+        '{"errors":[{"message":"Rate limit exceeded","code":88}]}']
+    self.return_headers = [
+        {'x-rate-limit-remaining': '0', 'x-rate-limit-reset': '1300'}]
+
+    try:
+      self.fetcher.UserTimeline('martin_cochran')
+      self.fail('Should have thrown an error')
+    except twitter_fetcher.RateLimitError as e:
+      self.assertEquals(300, e.retry_after_secs)
+    self.assertEquals(300,
+        self.limiter.SecondsUntilReset('/statuses/user_timeline.json'))
+
 
 if __name__ == '__main__':
   unittest.main()
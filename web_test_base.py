@@ -27,6 +27,7 @@ from google.appengine.api import urlfetch_stub
 from google.appengine.ext import testbed
 
 import game_model
+import oauth_token_manager
 import tweets
 
 
@@ -45,6 +46,9 @@ class WebTestBase(unittest.TestCase):
     self.testbed.init_urlfetch_stub()
     self.testbed.init_user_stub()
 
+    # Credentials cached by an earlier test are not in this test's datastore.
+    oauth_token_manager.ClearCredentialsCache()
+
     # Stub out the request / response for the Twitter API
     def _FakeFetch(url, payload, method, headers, request, response,
         follow_redirects=True, deadline=urlfetch_stub._API_CALL_DEADLINE,
@@ -143,6 +147,16 @@ class WebTestBase(unittest.TestCase):
 
     raise WebTestError('Bad argument to SetTimelineResponse: %s', twts)
 
+  def SetTimelineResponses(self, pages):
+    """Set a sequence of timeline responses, one for each fetch.
+
+    Args:
+      pages: A list of lists of tweets.Tweet objects.
+    """
+    self.return_statuscode = [200] * len(pages)
+    self.return_content = ['[%s]' % ','.join([t.ToJsonString() for t in twts])
+        for twts in pages]
+
   def assertTweetDbContents(self, tweet_ids, list_id=''):
     """Assert that all tweets in the DB are in tweet_ids."""
     tweet_query = tweets.Tweet.query()